@@ -0,0 +1,135 @@
+import hashlib
+import pickle
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+
+
+def normalize_query(query_text):
+    """Case- and whitespace-insensitive form of a query, without trailing punctuation"""
+    return re.sub(r"\s+", " ", query_text).strip().rstrip("?.!").strip().casefold()
+
+
+def dataframe_fingerprint(df):
+    """Content hash of a DataFrame (values, row order, index, column names and dtypes)"""
+    row_hashes = pd.util.hash_pandas_object(df, index=True).values
+    content_hash = hashlib.sha1(row_hashes.tobytes()).hexdigest()[:16]
+    schema = "|".join(f"{col}:{dtype}" for col, dtype in df.dtypes.items())
+    schema_hash = hashlib.sha1(schema.encode("utf-8")).hexdigest()[:12]
+    return f"{content_hash}-{len(df)}-{schema_hash}"
+
+
+class AnswerCache:
+    def __init__(self, max_entries=1024, max_bytes=64 * 1024 * 1024, ttl=None, db_path=None):
+        """
+        LRU/TTL cache of query answers, optionally persisted to SQLite
+        Args:
+            max_entries: Maximum number of cached answers
+            max_bytes: Maximum total pickled size of the cached answers
+            ttl: Seconds an answer stays valid (None keeps answers until evicted)
+            db_path: SQLite file answers are also written to, so they survive restarts
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()   # key -> (value, size, created)
+        self.total_bytes = 0
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+        self.lock = threading.Lock()
+        self.db = None
+        if db_path:
+            self.db = sqlite3.connect(db_path, check_same_thread=False)
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS answers "
+                "(key TEXT PRIMARY KEY, value BLOB, created REAL, accessed REAL)"
+            )
+            self.db.commit()
+
+    @staticmethod
+    def make_key(query_text, df_version):
+        return f"{df_version}\x00{normalize_query(query_text)}"
+
+    def _expired(self, created):
+        return self.ttl is not None and time.time() - created > self.ttl
+
+    def _remember(self, key, value, size, created):
+        if key in self.entries:
+            self.total_bytes -= self.entries.pop(key)[1]
+        self.entries[key] = (value, size, created)
+        self.total_bytes += size
+        while self.entries and (len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes):
+            _, (_, evicted_size, _) = self.entries.popitem(last=False)
+            self.total_bytes -= evicted_size
+            self.stats["evictions"] += 1
+
+    def get(self, query_text, df_version):
+        """
+        Look up a cached answer
+        Returns:
+            The cached answer, or None on a miss
+        """
+        key = self.make_key(query_text, df_version)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self._expired(entry[2]):
+                self.total_bytes -= self.entries.pop(key)[1]
+                self.stats["expirations"] += 1
+                entry = None
+            if entry is None and self.db is not None:
+                row = self.db.execute("SELECT value, created FROM answers WHERE key = ?", (key,)).fetchone()
+                if row is not None and not self._expired(row[1]):
+                    entry = (pickle.loads(row[0]), len(row[0]), row[1])
+                    self._remember(key, *entry)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            if key in self.entries:
+                self.entries.move_to_end(key)
+            self.stats["hits"] += 1
+            if self.db is not None:
+                self.db.execute("UPDATE answers SET accessed = ? WHERE key = ?", (time.time(), key))
+                self.db.commit()
+            return entry[0]
+
+    def set(self, query_text, df_version, value):
+        """Cache an answer for a query against a DataFrame version"""
+        key = self.make_key(query_text, df_version)
+        payload = pickle.dumps(value)
+        created = time.time()
+        with self.lock:
+            self._remember(key, value, len(payload), created)
+            if self.db is not None:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO answers (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                    (key, payload, created, created)
+                )
+                # Keep the file bounded by the same entry limit, least recently used first
+                self.db.execute(
+                    "DELETE FROM answers WHERE key NOT IN "
+                    "(SELECT key FROM answers ORDER BY accessed DESC LIMIT ?)",
+                    (self.max_entries,)
+                )
+                self.db.commit()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+            if self.db is not None:
+                self.db.execute("DELETE FROM answers")
+                self.db.commit()
+
+    def info(self):
+        """Hit-rate statistics and current size"""
+        with self.lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "hit_rate": self.stats["hits"] / lookups if lookups else 0.0,
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+            }
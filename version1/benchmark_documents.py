@@ -0,0 +1,82 @@
+"""
+Benchmark of the product description builders
+
+Compares the original row-wise ProductAnalyzer._create_detailed_text (iterrows and
+string +=) with the column-wise documents.iter_detailed_texts on synthetic product
+frames, and checks that both produce the same descriptions.
+
+Usage:
+    python benchmark_documents.py
+    python benchmark_documents.py --sizes 10000 100000 --chunk-size 50000
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from documents import iter_detailed_texts
+
+
+def make_products(n_rows, seed=0):
+    """Synthetic frame with the column mix of product_data.csv (strings, ints, floats, missing values)"""
+    rng = np.random.default_rng(seed)
+    categories = np.array(["Electronics", "Clothing", "Home & Kitchen", "Books", "Toys"])
+    price = rng.uniform(1, 500, n_rows).round(2)
+    price[rng.random(n_rows) < 0.01] = np.nan
+    return pd.DataFrame({
+        "product_id": np.arange(n_rows),
+        "product_name": np.char.add("Product ", np.arange(n_rows).astype(str)),
+        "category": categories[rng.integers(0, len(categories), n_rows)],
+        "price": price,
+        "stock_quantity": rng.integers(0, 1000, n_rows),
+        "rating": rng.uniform(1, 5, n_rows).round(1),
+        "on_sale": rng.random(n_rows) < 0.2,
+    })
+
+
+def iterrows_texts(df):
+    """The original row-wise builder"""
+    texts = []
+    for index, row in df.iterrows():
+        text = f"Product Details - "
+        for col in df.columns:
+            text += f"{col}: {row[col]}. "
+        texts.append(text)
+    return texts
+
+
+def vectorized_texts(df, chunk_size):
+    texts = []
+    for chunk in iter_detailed_texts(df, chunk_size=chunk_size):
+        texts.extend(chunk)
+    return texts
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def run(sizes, chunk_size, skip_iterrows_above):
+    print(f"{'rows':>10} {'iterrows (s)':>14} {'vectorized (s)':>16} {'speedup':>9}  identical")
+    for n_rows in sizes:
+        df = make_products(n_rows)
+        fast, fast_seconds = timed(vectorized_texts, df, chunk_size)
+        if n_rows > skip_iterrows_above:
+            print(f"{n_rows:>10} {'skipped':>14} {fast_seconds:>16.3f} {'-':>9}  -")
+            continue
+        slow, slow_seconds = timed(iterrows_texts, df)
+        print(f"{n_rows:>10} {slow_seconds:>14.3f} {fast_seconds:>16.3f} "
+              f"{slow_seconds / fast_seconds:>8.1f}x  {slow == fast}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--chunk-size", type=int, default=10_000)
+    parser.add_argument("--skip-iterrows-above", type=int, default=10_000_000,
+                        help="Only time the vectorized builder for larger frames")
+    args = parser.parse_args()
+    run(args.sizes, args.chunk_size, args.skip_iterrows_above)
@@ -0,0 +1,20 @@
+import pandas as pd
+
+
+def iter_detailed_texts(df, chunk_size=10000, prefix="Product Details - "):
+    """
+    Build one product description per row, column-wise, in fixed-size chunks
+    Args:
+        df: DataFrame whose rows are described
+        chunk_size: Number of rows per yielded chunk
+        prefix: Text every description starts with
+    Yields:
+        List of descriptions ("<prefix>col: value. col: value. ") for the next chunk of rows
+    """
+    labels = [f"{col}: " for col in df.columns]
+    for start in range(0, len(df), chunk_size):
+        chunk = df.iloc[start:start + chunk_size]
+        text = pd.Series(prefix, index=chunk.index, dtype=object)
+        for position, label in enumerate(labels):
+            text = text + label + chunk.iloc[:, position].astype(str) + ". "
+        yield text.tolist()
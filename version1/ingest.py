@@ -0,0 +1,262 @@
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import requests
+from langchain_core.embeddings import Embeddings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from documents import iter_detailed_texts
+
+
+class OllamaEmbedClient(Embeddings):
+    def __init__(self, model="bge-m3", base_url="http://localhost:11434", timeout=300, retries=3):
+        """
+        Ollama /api/embed client over keep-alive HTTP sessions, one per calling thread
+        Args:
+            model: Ollama embedding model
+            base_url: Ollama server URL
+            timeout: Seconds to wait for one batch
+            retries: Retries of a batch on connection errors and 5xx/429 responses
+        """
+        self.model = model
+        self.url = base_url.rstrip("/") + "/api/embed"
+        self.timeout = timeout
+        self.retries = retries
+        self._local = threading.local()
+
+    def _session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            retry = Retry(total=self.retries, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504),
+                          allowed_methods=None)
+            session.mount("http://", HTTPAdapter(max_retries=retry))
+            session.mount("https://", HTTPAdapter(max_retries=retry))
+            self._local.session = session
+        return session
+
+    def embed_documents(self, texts):
+        if not texts:
+            return []
+        response = self._session().post(self.url, json={"model": self.model, "input": list(texts)}, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()["embeddings"]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+def file_sha1(path, block_size=1 << 20):
+    """
+    SHA-1 of a file's bytes, read in blocks
+    Args:
+        path: File to hash
+        block_size: Bytes read at a time
+    Returns:
+        Hex digest
+    """
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _checkpoint_key(source, input_hash, batch_size):
+    source = os.path.abspath(source) if source else None
+    payload = json.dumps({"source": source, "input_hash": input_hash, "batch_size": batch_size}, sort_keys=True)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def _read_checkpoint(checkpoint_path, key):
+    if not checkpoint_path or not os.path.exists(checkpoint_path):
+        return 0
+    with open(checkpoint_path) as f:
+        checkpoint = json.load(f)
+    if checkpoint.get("key") != key:
+        raise ValueError(f"Checkpoint {checkpoint_path} was written for another input, source or batch size; "
+                         f"resume with the same ones or remove it")
+    return checkpoint["committed_batches"]
+
+
+def _write_checkpoint(checkpoint_path, key, batch_size, committed_batches, committed_rows):
+    tmp_path = checkpoint_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"key": key, "batch_size": batch_size, "committed_batches": committed_batches,
+                   "committed_rows": committed_rows}, f)
+    os.replace(tmp_path, checkpoint_path)
+
+
+def iter_batches(documents, batch_size=64):
+    """
+    Cut a stream of documents into embedding batches
+    Args:
+        documents: Iterable of (id, text, metadata) tuples
+        batch_size: Documents per batch
+    Yields:
+        (ids, texts, metadatas) lists of at most batch_size documents
+    """
+    batch = ([], [], [])
+    for document in documents:
+        for target, value in zip(batch, document):
+            target.append(value)
+        if len(batch[0]) >= batch_size:
+            yield batch
+            batch = ([], [], [])
+    if batch[0]:
+        yield batch
+
+
+def ingest_batches(vectorstore, embeddings, batches, batch_size=64, workers=4, max_pending=None,
+                   upsert_size=1024, checkpoint_path=None, report_every=10.0, source=None, input_hash=None,
+                   prune=False):
+    """
+    Embed batches on a worker pool and upsert them into a Chroma collection in input order
+    The calling thread produces batches and commits finished ones; up to `max_pending`
+    batches are embedding concurrently. Batches are committed strictly in order, so the
+    checkpoint (number of committed batches) always describes a prefix of the input and a
+    rerun with the same input and batch size skips exactly what was already stored. The
+    checkpoint is keyed on source, input_hash and batch_size, a rerun with any of them
+    changed is refused, and it is removed once the run completes.
+    Args:
+        vectorstore: langchain Chroma store; vectors are upserted into its collection directly
+        embeddings: Embeddings used by the workers (e.g. OllamaEmbedClient)
+        batches: Iterable of (ids, texts, metadatas) from iter_batches
+        batch_size: Batch size the batches were cut with, recorded in the checkpoint
+        workers: Concurrent embedding requests
+        max_pending: Batches in flight or awaiting commit (default 2 * workers)
+        upsert_size: Documents per upsert into the collection
+        checkpoint_path: JSON file recording committed batches, for resuming after a crash
+        report_every: Seconds between progress lines (None for no output)
+        source: Path of the input, recorded in the checkpoint key
+        input_hash: Hash of the input (e.g. file_sha1(source)), recorded in the checkpoint key
+        prune: Delete documents of the collection whose ids are not in `batches` once the run
+            completes, for a collection that holds this input only
+    Returns:
+        Dictionary with batches, rows, skipped_batches, pruned, seconds and rows_per_second
+    """
+    max_pending = max_pending or 2 * workers
+    collection = vectorstore._collection
+    key = _checkpoint_key(source, input_hash, batch_size)
+    skip = _read_checkpoint(checkpoint_path, key)
+    stats = {"batches": 0, "rows": 0, "skipped_batches": skip, "pruned": 0}
+    seen_ids = set()
+    pending = deque()
+    staged = ([], [], [], [])
+    staged_batches = 0
+    start = last_report = time.monotonic()
+
+    def embed(texts):
+        return embeddings.embed_documents(texts)
+
+    def upsert():
+        nonlocal staged, staged_batches
+        if not staged[0]:
+            return
+        ids, texts, metadatas, vectors = staged
+        # Chroma rejects empty metadata dictionaries; None means "no metadata"
+        metadatas = [metadata or None for metadata in metadatas]
+        for i in range(0, len(ids), upsert_size):
+            part = slice(i, i + upsert_size)
+            collection.upsert(ids=ids[part], documents=texts[part], embeddings=vectors[part],
+                              metadatas=metadatas[part] if any(metadatas[part]) else None)
+        stats["batches"] += staged_batches
+        stats["rows"] += len(ids)
+        if checkpoint_path:
+            _write_checkpoint(checkpoint_path, key, batch_size, skip + stats["batches"], stats["rows"])
+        staged = ([], [], [], [])
+        staged_batches = 0
+
+    def commit(item):
+        nonlocal staged_batches, last_report
+        (ids, texts, metadatas), future = item
+        vectors = future.result()
+        for target, values in zip(staged, (ids, texts, metadatas, vectors)):
+            target.extend(values)
+        staged_batches += 1
+        if len(staged[0]) >= upsert_size:
+            upsert()
+        now = time.monotonic()
+        if report_every is not None and now - last_report >= report_every:
+            last_report = now
+            print(f"Ingested {stats['rows']} documents in {stats['batches']} batches "
+                  f"({stats['rows'] / (now - start):.1f} documents/s)")
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for number, batch in enumerate(batches):
+            if prune:
+                seen_ids.update(batch[0])
+            if number < skip:
+                continue
+            pending.append((batch, pool.submit(embed, batch[1])))
+            while len(pending) >= max_pending:
+                commit(pending.popleft())
+        while pending:
+            commit(pending.popleft())
+        upsert()
+    if prune:
+        # ids left over from an earlier, larger version of the input
+        stale = [doc_id for doc_id in collection.get(include=[])["ids"] if doc_id not in seen_ids]
+        for i in range(0, len(stale), upsert_size):
+            collection.delete(ids=stale[i:i + upsert_size])
+        stats["pruned"] = len(stale)
+    # the input is fully stored: a later run over changed data must start from the beginning
+    if checkpoint_path and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+    stats["seconds"] = time.monotonic() - start
+    stats["rows_per_second"] = stats["rows"] / stats["seconds"] if stats["seconds"] else 0.0
+    return stats
+
+
+def iter_row_documents(df, chunk_size=1000, chunk_overlap=100):
+    """
+    Product descriptions of `df` as documents laid out like ProductAnalyzer's collection
+    Yields:
+        ("<row>:<n>", text, {"row_id", "row_hash"}) for every split of every row
+    """
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    row = 0
+    for texts in iter_detailed_texts(df):
+        for text in texts:
+            metadata = {"row_id": str(row), "row_hash": hashlib.sha1(text.encode("utf-8")).hexdigest()}
+            for n, split in enumerate(splitter.split_text(text)):
+                yield f"{row}:{n}", split, metadata
+            row += 1
+
+
+if __name__ == "__main__":
+    from langchain_community.vectorstores import Chroma
+
+    parser = argparse.ArgumentParser(description="Embed product descriptions of a CSV into a persisted Chroma collection")
+    parser.add_argument("csv_path")
+    parser.add_argument("--persist-directory", default="./chroma_db")
+    parser.add_argument("--collection-name", default="products")
+    parser.add_argument("--embedding-model", default="bge-m3")
+    parser.add_argument("--base-url", default="http://localhost:11434")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--checkpoint", default=None, help="defaults to <persist-directory>/<collection>.ingest.json")
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.csv_path)
+    embeddings = OllamaEmbedClient(args.embedding_model, args.base_url)
+    vectorstore = Chroma(collection_name=args.collection_name, embedding_function=embeddings,
+                         persist_directory=args.persist_directory)
+    os.makedirs(args.persist_directory, exist_ok=True)
+    checkpoint = args.checkpoint or os.path.join(args.persist_directory, f"{args.collection_name}.ingest.json")
+    stats = ingest_batches(vectorstore, embeddings, iter_batches(iter_row_documents(df), args.batch_size),
+                           batch_size=args.batch_size, workers=args.workers, checkpoint_path=checkpoint,
+                           source=args.csv_path, input_hash=file_sha1(args.csv_path), prune=True)
+    print(f"Done: {stats['rows']} documents in {stats['seconds']:.1f}s ({stats['rows_per_second']:.1f} documents/s), "
+          f"{stats['skipped_batches']} batches skipped from the checkpoint, {stats['pruned']} stale documents removed")
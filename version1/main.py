@@ -1,11 +1,40 @@
-import time
+import hashlib
+import importlib.util
+import sys
+from pathlib import Path
 import pandas as pd
-from langchain_ollama import OllamaLLM, OllamaEmbeddings
-from langchain_experimental.agents import create_pandas_dataframe_agent
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import Chroma
-from langchain.chains import RetrievalQA
 from langchain.prompts import PromptTemplate
+from documents import iter_detailed_texts
+from ingest import OllamaEmbedClient, ingest_batches, iter_batches
+from answer_cache import AnswerCache, dataframe_fingerprint
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+def import_from_repo(module):
+    """
+    Import a module of another version of the repository from its file, without running the
+    __init__ of the packages above it (version2's pulls in the DataFrame agent)
+    Args:
+        module: Dotted name from the repository root, e.g. "version4.embedding_cache"
+    Returns:
+        The module, registered under that name so a regular import later gets the same one
+    """
+    if module in sys.modules:
+        return sys.modules[module]
+    spec = importlib.util.spec_from_file_location(module, REPO_ROOT.joinpath(*module.split(".")).with_suffix(".py"))
+    loaded = importlib.util.module_from_spec(spec)
+    sys.modules[module] = loaded
+    try:
+        spec.loader.exec_module(loaded)
+    except BaseException:
+        del sys.modules[module]
+        raise
+    return loaded
+
+
+# TokenBucket and iter_batch, shared with version2's DataFrame agent
+batching = import_from_repo("version2.interrogate_4agent.batching")
             
             
 class ProductAnalyzer:
@@ -13,49 +42,190 @@ class ProductAnalyzer:
                  csv_path="product_data.csv", 
                  model_name="llama3.1", 
                  embedding_model="bge-m3", 
-                 base_url="http://localhost:11434"
+                 base_url="http://localhost:11434",
+                 embedding_cache_dir=None,
+                 persist_directory="./chroma_db",
+                 collection_name="products",
+                 index_mode="incremental",
+                 id_column=None,
+                 cache_size=1024,
+                 cache_ttl=None,
+                 cache_db_path=None,
+                 embed_batch_size=64,
+                 embed_workers=4
                  ):
-        """Initialize the product analyzer"""
+        """
+        Initialize the product analyzer
+        Args:
+            persist_directory: Directory of the persisted Chroma collection
+            collection_name: Name of the Chroma collection holding the product documents
+            index_mode: "incremental" opens the persisted collection and only embeds new or
+                changed rows and deletes removed ones; "rebuild" drops the collection and embeds every row
+            id_column: Column that uniquely identifies a product (e.g. "asin"). Defaults to
+                the row position, so inserting rows in the middle of the CSV re-embeds the tail
+            embedding_cache_dir: Optional directory for the persistent embedding cache
+                (version4/embedding_cache.py, imported by path).
+                Texts embedded by an earlier run are read from disk instead of Ollama.
+            cache_size: Maximum number of cached answers
+            cache_ttl: Seconds a cached answer stays valid (None keeps it until evicted)
+            cache_db_path: Optional SQLite file so cached answers survive restarts
+            embed_batch_size: Documents per /api/embed request while indexing
+            embed_workers: Concurrent embedding requests while indexing
+        """
         # Add caching mechanism
-        self.query_cache = {}   
+        self.query_cache = AnswerCache(max_entries=cache_size, ttl=cache_ttl, db_path=cache_db_path)
         self.df = pd.read_csv(csv_path)        
+        self.refresh_dataframe_version()
+        self.persist_directory = persist_directory
+        self.collection_name = collection_name
+        self.index_mode = index_mode
+        self.id_column = id_column
+        from langchain_ollama import OllamaLLM
         self.llm = OllamaLLM(
             model=model_name, 
             temperature=0.75
         )
-        self.embeddings = OllamaEmbeddings(
+        self.embed_batch_size = embed_batch_size
+        self.embed_workers = embed_workers
+        self.embeddings = OllamaEmbedClient(
             model=embedding_model,
             base_url=base_url
         )
+        if embedding_cache_dir:
+            CachedEmbeddings = import_from_repo("version4.embedding_cache").CachedEmbeddings
+            self.embeddings = CachedEmbeddings(self.embeddings, embedding_cache_dir, model_name=embedding_model)
         self._initialize_components()
 
     def _initialize_components(self):
         """Initialize all necessary components"""
-        # Create text descriptions and split
-        texts = self._create_detailed_text()
-        text_splitter = RecursiveCharacterTextSplitter(
+        self.text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=1000,  
             chunk_overlap=100, 
         )
-        splits = text_splitter.create_documents(texts)
         
-        self.vectorstore = Chroma.from_documents(
-            documents=splits,
-            embedding=self.embeddings,
-            persist_directory="./chroma_db"
+        if self.index_mode not in ("incremental", "rebuild"):
+            raise ValueError(f"Unsupported index mode: {self.index_mode}")
+        from langchain_community.vectorstores import Chroma
+        self.vectorstore = Chroma(
+            collection_name=self.collection_name,
+            embedding_function=self.embeddings,
+            persist_directory=self.persist_directory
         )
+        if self.index_mode == "rebuild":
+            self.vectorstore.delete_collection()
+            self.vectorstore = Chroma(
+                collection_name=self.collection_name,
+                embedding_function=self.embeddings,
+                persist_directory=self.persist_directory
+            )
+        # Create text descriptions chunk by chunk and stream them into the collection
+        self.index_stats = self._sync_vectorstore(iter_detailed_texts(self.df))
         self.qa_chain = self._setup_qa_chain()
-        self.agent = self._create_df_agent()
+        # The DataFrame agent (langchain_experimental) is built on the first query that needs it
+        self._agent = None
     
+    @property
+    def agent(self):
+        """DataFrame agent, created on first use"""
+        if self._agent is None:
+            self._agent = self._create_df_agent()
+        return self._agent
+
     def _create_detailed_text(self):
         """Create detailed text descriptions"""
         texts = []
-        for index, row in self.df.iterrows():
-            text = f"Product Details - "
-            for col in self.df.columns:
-                text += f"{col}: {row[col]}. "
-            texts.append(text)
+        for chunk in iter_detailed_texts(self.df):
+            texts.extend(chunk)
         return texts
+
+    def _row_ids(self):
+        """Stable per-row identifiers used as the diff key against the stored collection"""
+        if self.id_column:
+            return self.df[self.id_column].astype(str).tolist()
+        return [str(i) for i in range(len(self.df))]
+
+    def _stored_rows(self, page_size=50000):
+        """
+        Read the row hashes already stored in the collection
+        Returns:
+            Dictionary mapping row_id to (row_hash, list of document ids)
+        """
+        stored = {}
+        offset = 0
+        while True:
+            page = self.vectorstore.get(include=["metadatas"], limit=page_size, offset=offset)
+            for doc_id, metadata in zip(page["ids"], page["metadatas"]):
+                metadata = metadata or {}
+                _, ids = stored.setdefault(metadata.get("row_id"), (metadata.get("row_hash"), []))
+                ids.append(doc_id)
+            if len(page["ids"]) < page_size:
+                return stored
+            offset += page_size
+
+    def _sync_vectorstore(self, text_chunks, batch_size=5000):
+        """
+        Bring the persisted collection in line with the current rows
+        Args:
+            text_chunks: Iterable of lists of product descriptions, in row order of self.df
+            batch_size: Number of rows per embedding flush and documents per Chroma call
+        Returns:
+            Dictionary with the number of added, changed, removed and unchanged rows, and
+            the documents embedded and seconds spent in the embedding pipeline
+        """
+        stored = self._stored_rows()
+        stale_ids, new_texts, new_metadatas = [], [], []
+        stats = {"added": 0, "changed": 0, "removed": 0, "unchanged": 0,
+                 "embedded_documents": 0, "embedding_seconds": 0.0}
+
+        def flush():
+            # Stale ids go first: a changed row is re-added under the same document ids
+            for start in range(0, len(stale_ids), batch_size):
+                self.vectorstore.delete(ids=stale_ids[start:start + batch_size])
+            stale_ids.clear()
+            if not new_texts:
+                return
+            splits = self.text_splitter.create_documents(new_texts, metadatas=new_metadatas)
+            chunk_numbers = {}
+            ids = []
+            for doc in splits:
+                row_id = doc.metadata["row_id"]
+                chunk_numbers[row_id] = chunk_numbers.get(row_id, -1) + 1
+                ids.append(f"{row_id}:{chunk_numbers[row_id]}")
+            documents = ((doc_id, doc.page_content, doc.metadata) for doc_id, doc in zip(ids, splits))
+            ingested = ingest_batches(
+                self.vectorstore, self.embeddings, iter_batches(documents, self.embed_batch_size),
+                batch_size=self.embed_batch_size, workers=self.embed_workers, upsert_size=batch_size
+            )
+            stats["embedded_documents"] += ingested["rows"]
+            stats["embedding_seconds"] += ingested["seconds"]
+            new_texts.clear()
+            new_metadatas.clear()
+
+        row_ids = iter(self._row_ids())
+        for texts in text_chunks:
+            for text, row_id in zip(texts, row_ids):
+                row_hash = hashlib.sha1(text.encode("utf-8")).hexdigest()
+                previous = stored.pop(row_id, None)
+                if previous is not None and previous[0] == row_hash:
+                    stats["unchanged"] += 1
+                    continue
+                if previous is not None:
+                    stale_ids.extend(previous[1])
+                    stats["changed"] += 1
+                else:
+                    stats["added"] += 1
+                new_texts.append(text)
+                new_metadatas.append({"row_id": row_id, "row_hash": row_hash})
+                if len(new_texts) >= batch_size:
+                    flush()
+
+        # Whatever is left in `stored` no longer exists in the CSV
+        for _, ids in stored.values():
+            stale_ids.extend(ids)
+        stats["removed"] = len(stored)
+        flush()
+
+        return stats
        
     def _setup_qa_chain(self):
         """Set up the QA chain"""
@@ -78,6 +248,7 @@ class ProductAnalyzer:
             input_variables=["context", "question"]
         )
         
+        from langchain.chains import RetrievalQA
         return RetrievalQA.from_chain_type(
             llm=self.llm,
             chain_type="stuff",
@@ -88,6 +259,7 @@ class ProductAnalyzer:
 
     def _create_df_agent(self):
         """Create DataFrame agent"""
+        from langchain_experimental.agents import create_pandas_dataframe_agent
         return create_pandas_dataframe_agent(
             self.llm,
             self.df,
@@ -97,6 +269,21 @@ class ProductAnalyzer:
             allow_dangerous_code=True
         )
     
+    def refresh_dataframe_version(self):
+        """
+        Recompute the DataFrame fingerprint that cached answers are keyed on.
+        Call it after modifying self.df in place; answers cached for the old data are then ignored.
+        """
+        self.df_version = dataframe_fingerprint(self.df)
+        self._df_identity = (id(self.df), self.df.shape)
+        return self.df_version
+
+    def _dataframe_version(self):
+        """Fingerprint of self.df, recomputed when the frame is replaced or reshaped"""
+        if self._df_identity != (id(self.df), self.df.shape):
+            self.refresh_dataframe_version()
+        return self.df_version
+
     def query_data(self, query_text):
         """
         Query the data with caching
@@ -106,8 +293,10 @@ class ProductAnalyzer:
             Dictionary containing answer and context or error information
         """
         # Add query caching
-        if query_text in self.query_cache:
-            return self.query_cache[query_text]
+        df_version = self._dataframe_version()
+        cached = self.query_cache.get(query_text, df_version)
+        if cached is not None:
+            return cached
 
         try:
             context = self.qa_chain.invoke({"query": query_text})
@@ -125,7 +314,7 @@ class ProductAnalyzer:
             }
             
             # Store in cache
-            self.query_cache[query_text] = result
+            self.query_cache.set(query_text, df_version, result)
             return result
             
         except Exception as e:
@@ -140,12 +329,19 @@ class ProductAnalyzer:
         Args:
             query_text: User's query question
         """
+        self._print_query_result(query_text, self.query_data(query_text))
+
+    def _print_query_result(self, query_text, result):
+        """
+        Print one query result
+        Args:
+            query_text: User's query question
+            result: Dictionary returned by query_data
+        """
         print("\n" + "="*50)
         print(f"📝 Query: {query_text}")
         print("="*50)
         
-        result = self.query_data(query_text)
-        
         if "error" in result:
             print(f"❌ Error: {result['error']}")
             print(f"💡 Suggestion: {result['suggestion']}")
@@ -159,13 +355,30 @@ class ProductAnalyzer:
                 print(f"{i}. {doc.page_content}\n")
         print("="*50 + "\n")
 
-    def display_batch_query_result(self, queries, delay=0.1):
+    def display_batch_query_result(self, queries, delay=0.1, max_workers=4, timeout=None):
         """
-        Perform batch queries
+        Perform batch queries concurrently and display the results in input order
         Args:
             queries: List of query strings
-            delay: Time delay between queries in seconds
+            delay: Minimum interval between query starts in seconds, enforced by a
+                token bucket shared by all workers (None or 0 disables rate limiting)
+            max_workers: Maximum number of queries in flight at once
+            timeout: Time limit in seconds for each query, counted from when that query starts
         """
-        for query in queries:
-            self.display_query_result(query)
-            time.sleep(delay)
\ No newline at end of file
+        limiter = batching.TokenBucket(rate=1 / delay, capacity=1) if delay else None
+        results = {}
+        next_index = 0
+        for index, result, error in batching.iter_batch(self.query_data, queries, max_workers=max_workers,
+                                                        timeout=timeout, rate_limiter=limiter):
+            if isinstance(error, TimeoutError):
+                result = {
+                    "error": f"No answer within {timeout} seconds",
+                    "suggestion": "Please try a more specific question"
+                }
+            elif error is not None:
+                raise error
+            results[index] = result
+            # print in input order as soon as every earlier query has finished
+            while next_index in results:
+                self._print_query_result(queries[next_index], results.pop(next_index))
+                next_index += 1
@@ -3,5 +3,6 @@ DataFrame query agent module for Amazon products data analysis
 """
 
 from .df_agent import DataFrameQueryAgent
+from .batching import TokenBucket, iter_batch, run_batch
 
-__all__ = ['DataFrameQueryAgent']
\ No newline at end of file
+__all__ = ['DataFrameQueryAgent', 'TokenBucket', 'iter_batch', 'run_batch']
\ No newline at end of file
@@ -0,0 +1,134 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Tuple
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens per second, bursts up to `capacity`"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        """
+        Initialize the bucket (it starts full)
+
+        Args:
+            rate: Tokens added per second
+            capacity: Maximum number of stored tokens. Defaults to max(1, rate)
+        """
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1.0) -> float:
+        """
+        Block until `tokens` are available and take them
+
+        Args:
+            tokens: Number of tokens to take
+
+        Returns:
+            float: Seconds spent waiting
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return waited
+                delay = (tokens - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+def iter_batch(
+    func: Callable[[Any], Any],
+    items: Iterable[Any],
+    max_workers: int = 4,
+    max_in_flight: Optional[int] = None,
+    timeout: Optional[float] = None,
+    rate_limiter: Optional[TokenBucket] = None
+) -> Iterator[Tuple[int, Any, Optional[BaseException]]]:
+    """
+    Run `func` over `items` on a bounded thread pool, yielding results as they complete
+
+    Args:
+        func: Function called with one item
+        items: Items to process
+        max_workers: Number of worker threads
+        max_in_flight: Maximum number of submitted but unfinished calls. Defaults to max_workers
+        timeout: Per-call wall-clock limit in seconds, counted from when the call starts.
+            A call that exceeds it is reported as a TimeoutError; its thread is left to finish
+            in the background because Python threads cannot be interrupted
+        rate_limiter: Optional token bucket every call takes one token from before starting
+
+    Yields:
+        Tuple[int, Any, Optional[BaseException]]: (input index, result, error), in completion order
+    """
+    items = list(items)
+    max_in_flight = max_in_flight or max_workers
+    started = {}
+
+    def call(index):
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        started[index] = time.monotonic()
+        return func(items[index])
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    pending = {}
+    next_index = 0
+    try:
+        while next_index < len(items) or pending:
+            while next_index < len(items) and len(pending) < max_in_flight:
+                pending[executor.submit(call, next_index)] = next_index
+                next_index += 1
+
+            wait_for = None
+            if timeout is not None:
+                deadlines = [started[i] + timeout for i in pending.values() if i in started]
+                wait_for = max(0.0, min(deadlines) - time.monotonic()) if deadlines else timeout
+            done, _ = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                index = pending.pop(future)
+                error = future.exception()
+                yield index, None if error else future.result(), error
+
+            if timeout is not None:
+                now = time.monotonic()
+                for future, index in list(pending.items()):
+                    if index in started and now - started[index] >= timeout:
+                        del pending[future]
+                        yield index, None, TimeoutError(f"No result after {timeout}s")
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def run_batch(
+    func: Callable[[Any], Any],
+    items: Iterable[Any],
+    **kwargs
+) -> List[Tuple[Any, Optional[BaseException]]]:
+    """
+    Run `func` over `items` concurrently and collect the outcomes in input order
+
+    Args:
+        func: Function called with one item
+        items: Items to process
+        **kwargs: Passed to iter_batch (max_workers, max_in_flight, timeout, rate_limiter)
+
+    Returns:
+        List[Tuple[Any, Optional[BaseException]]]: (result, error) per item, in input order
+    """
+    items = list(items)
+    outcomes = [None] * len(items)
+    for index, result, error in iter_batch(func, items, **kwargs):
+        outcomes[index] = (result, error)
+    return outcomes
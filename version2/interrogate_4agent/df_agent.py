@@ -1,8 +1,10 @@
 from langchain_experimental.agents import create_pandas_dataframe_agent
 from langchain.base_language import BaseLanguageModel
-from typing import Optional, List
+from typing import Iterator, Optional, List, Tuple
 import pandas as pd
 
+from .batching import TokenBucket, iter_batch, run_batch
+
 
 
 class DataFrameQueryAgent:
@@ -46,14 +48,58 @@ class DataFrameQueryAgent:
         except Exception as e:
             return f"Query error: {str(e)}"
     
-    def batch_query(self, questions: List[str]) -> List[str]:
+    def batch_query(
+        self,
+        questions: List[str],
+        max_workers: int = 4,
+        max_in_flight: Optional[int] = None,
+        timeout: Optional[float] = None,
+        rate_limiter: Optional[TokenBucket] = None
+    ) -> List[str]:
         """
-        Batch query multiple questions
+        Batch query multiple questions concurrently
         
         Args:
             questions: List of questions to query
+            max_workers: Number of questions answered in parallel
+            max_in_flight: Maximum number of submitted but unanswered questions
+            timeout: Per-question time limit in seconds
+            rate_limiter: Optional token bucket limiting how fast questions are started
             
         Returns:
-            List[str]: List of corresponding answers
+            List[str]: List of corresponding answers, in the order of `questions`
+        """
+        outcomes = run_batch(
+            self.query, questions,
+            max_workers=max_workers, max_in_flight=max_in_flight,
+            timeout=timeout, rate_limiter=rate_limiter
+        )
+        return [f"Query error: {str(error)}" if error else result for result, error in outcomes]
+
+    def iter_batch_query(
+        self,
+        questions: List[str],
+        max_workers: int = 4,
+        max_in_flight: Optional[int] = None,
+        timeout: Optional[float] = None,
+        rate_limiter: Optional[TokenBucket] = None
+    ) -> Iterator[Tuple[int, str]]:
+        """
+        Answer multiple questions concurrently, yielding each answer as soon as it is ready
+        
+        Args:
+            questions: List of questions to query
+            max_workers: Number of questions answered in parallel
+            max_in_flight: Maximum number of submitted but unanswered questions
+            timeout: Per-question time limit in seconds
+            rate_limiter: Optional token bucket limiting how fast questions are started
+            
+        Yields:
+            Tuple[int, str]: Index of the question in `questions` and its answer
         """
-        return [self.query(q) for q in questions]
\ No newline at end of file
+        for index, result, error in iter_batch(
+            self.query, questions,
+            max_workers=max_workers, max_in_flight=max_in_flight,
+            timeout=timeout, rate_limiter=rate_limiter
+        ):
+            yield index, f"Query error: {str(error)}" if error else result
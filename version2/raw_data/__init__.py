@@ -2,6 +2,6 @@
 Raw data loading module for Amazon products
 """
 
-from .data_loader import load_amazon_data
+from .data_loader import load_amazon_data, ingest_amazon_data
 
-__all__ = ['load_amazon_data']
+__all__ = ['load_amazon_data', 'ingest_amazon_data']
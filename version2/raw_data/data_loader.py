@@ -1,27 +1,274 @@
+import hashlib
+import json
+import warnings
+import numpy as np
 import pandas as pd
 from pathlib import Path
+from typing import Dict, List, Optional, Tuple
 
 
+PRODUCTS_FILE = "amazon_products.csv"
+CATEGORIES_FILE = "amazon_categories.csv"
+CACHE_FILE = "amazon_data.feather"
+MANIFEST_FILE = "amazon_data.json"
 
-def load_amazon_data(data_dir: str = None) -> pd.DataFrame:
+# Explicit dtypes of the Kaggle Amazon products export; columns missing from a CSV are ignored.
+# The integer columns (reviews, category_id, boughtInLastMonth) and isBestSeller are inferred:
+# forcing int64 or bool fails the whole load on one empty cell, inference gives float64/object.
+PRODUCT_DTYPES = {
+    "asin": "object",
+    "title": "object",
+    "imgUrl": "object",
+    "productURL": "object",
+    "stars": "float64",
+    "price": "float64",
+    "listPrice": "float64",
+}
+CATEGORY_DTYPES = {"id": "int64", "category_name": "object"}
+# Low-cardinality string columns stored as pandas categoricals
+CATEGORICAL_COLUMNS = ["category_name"]
+# Compact dtypes used by the streaming ingest; other columns get an inferred plan.
+# "int" downcasts each chunk to the smallest integer type that holds it (concat then widens
+# to the largest), so unexpected large values or missing values never overflow.
+COMPACT_DTYPES = {
+    "stars": "float32",
+    "reviews": "int",
+    "price": "float32",
+    "listPrice": "float32",
+    "category_id": "int",
+    "isBestSeller": "bool",
+    "boughtInLastMonth": "int",
+}
+# Object columns whose first chunk has at most this share of distinct values become categoricals
+CATEGORICAL_RATIO = 0.5
+
+
+def _source_state(paths, hash_sources: bool) -> Dict[str, dict]:
+    """Size and mtime (and optionally sha256) of each source file"""
+    state = {}
+    for path in paths:
+        stat = path.stat()
+        entry = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+        if hash_sources:
+            digest = hashlib.sha256()
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(block)
+            entry["sha256"] = digest.hexdigest()
+        state[path.name] = entry
+    return state
+
+
+def _dtype_plan() -> dict:
+    """Dtypes the cached frame was built with, part of the cache key"""
+    return {"products": PRODUCT_DTYPES, "categories": CATEGORY_DTYPES, "categorical": CATEGORICAL_COLUMNS}
+
+
+def _read_and_merge(data_dir: Path) -> pd.DataFrame:
+    """Read both CSVs with explicit dtypes and merge categories into products"""
+    df1 = pd.read_csv(data_dir / PRODUCTS_FILE, dtype=PRODUCT_DTYPES)
+    df2 = pd.read_csv(data_dir / CATEGORIES_FILE, dtype=CATEGORY_DTYPES)
+    df = df1.merge(df2, left_on="category_id", right_on="id", how="left")
+    df.drop(columns=["id"], inplace=True)
+    for col in CATEGORICAL_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype("category")
+    return df
+
+
+def _infer_dtype(series: pd.Series) -> str:
+    """Compact dtype for a column not covered by COMPACT_DTYPES, judged on one chunk"""
+    if pd.api.types.is_bool_dtype(series):
+        return "bool"
+    if pd.api.types.is_integer_dtype(series):
+        return "int"
+    if pd.api.types.is_float_dtype(series):
+        return "float32"
+    if series.nunique(dropna=True) <= CATEGORICAL_RATIO * max(len(series), 1):
+        return "category"
+    return "object"
+
+
+def _apply_dtype(series: pd.Series, dtype: str, categories: Dict[str, pd.Index]) -> pd.Series:
+    if dtype == "int":
+        return pd.to_numeric(series, downcast="integer")
+    if dtype == "category":
+        # Codes against the categories seen so far, extended by this chunk's new values, so
+        # no chunk is kept as object strings; earlier chunks are widened before concatenation
+        known = categories.get(series.name, pd.Index([], dtype="object"))
+        new = pd.Index(series.dropna().unique()).difference(known, sort=False)
+        categories[series.name] = known = known.append(new) if len(new) else known
+        return pd.Series(pd.Categorical(series, categories=known), index=series.index, name=series.name)
+    return series.astype(dtype)
+
+
+def ingest_amazon_data(
+    data_dir: str = None,
+    columns: Optional[List[str]] = None,
+    chunksize: int = 200_000,
+    dtypes: Optional[Dict[str, str]] = None
+) -> Tuple[pd.DataFrame, Dict[str, int]]:
+    """
+    Stream amazon_products.csv in chunks with column projection and compact dtypes
+
+    Each chunk is read with only the requested columns, converted to the dtype plan
+    (COMPACT_DTYPES, then `dtypes`, then a plan inferred from the first chunk) and joined
+    to the category names by an array lookup on category_id instead of a full merge.
+
+    Args:
+        data_dir (str, optional): Data directory path. If None, uses current directory
+        columns (List[str], optional): Columns to keep, may include "category_name".
+            If None, all product columns plus category_name
+        chunksize (int): Rows per chunk
+        dtypes (Dict[str, str], optional): Dtype overrides; "int" downcasts integers per chunk
+
+    Returns:
+        Tuple[pd.DataFrame, Dict[str, int]]: The frame and a memory report with
+            default_bytes (projected chunks at pandas default dtypes), compact_bytes
+            (final frame), largest_chunk_bytes and rows
+    """
+    data_dir = Path(data_dir) if data_dir else Path(__file__).parent
+    with_category = columns is None or "category_name" in columns
+    usecols = None
+    if columns is not None:
+        usecols = [col for col in columns if col != "category_name"]
+        if with_category and "category_id" not in usecols:
+            usecols.append("category_id")
+
+    if with_category:
+        categories = pd.read_csv(data_dir / CATEGORIES_FILE, dtype=CATEGORY_DTYPES)
+        category_dtype = pd.CategoricalDtype(categories["category_name"].drop_duplicates())
+        code_by_id = np.full(int(categories["id"].max()) + 2, -1, dtype=np.int32)
+        code_by_id[categories["id"].to_numpy()] = category_dtype.categories.get_indexer(categories["category_name"])
+
+    plan = {**COMPACT_DTYPES, **(dtypes or {})}
+    seen_categories = {}  # column -> categories of the "category" columns so far
+    report = {"rows": 0, "default_bytes": 0, "compact_bytes": 0, "largest_chunk_bytes": 0}
+    chunks = []
+    for chunk in pd.read_csv(data_dir / PRODUCTS_FILE, usecols=usecols, chunksize=chunksize):
+        chunk_bytes = int(chunk.memory_usage(deep=True).sum())
+        report["default_bytes"] += chunk_bytes
+        report["largest_chunk_bytes"] = max(report["largest_chunk_bytes"], chunk_bytes)
+        report["rows"] += len(chunk)
+
+        for col in chunk.columns:
+            if col not in plan:
+                plan[col] = _infer_dtype(chunk[col])
+            chunk[col] = _apply_dtype(chunk[col], plan[col], seen_categories)
+
+        if with_category:
+            # Per-chunk lookup instead of a merge: missing ids and ids outside the table map
+            # to NaN (code -1); a missing id makes the column float, so look up on a filled copy
+            ids = chunk["category_id"]
+            valid = (ids.notna() & (ids >= 0) & (ids < len(code_by_id))).to_numpy()
+            ids = ids.fillna(-1).to_numpy().astype(np.int64)
+            codes = np.where(valid, code_by_id[np.where(valid, ids, 0)], -1)
+            chunk["category_name"] = pd.Categorical.from_codes(codes, dtype=category_dtype)
+            if columns is not None and "category_id" not in columns:
+                chunk.drop(columns=["category_id"], inplace=True)
+        chunks.append(chunk)
+
+    for chunk in chunks:
+        for col, known in seen_categories.items():
+            if col in chunk.columns and len(chunk[col].cat.categories) < len(known):
+                chunk[col] = chunk[col].cat.set_categories(known)
+    df = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame(columns=columns)
+    del chunks
+    if "category_name" in df.columns:
+        df["category_name"] = df["category_name"].cat.remove_unused_categories()
+
+    report["compact_bytes"] = int(df.memory_usage(deep=True).sum())
+    return df, report
+
+
+def load_amazon_data(
+    data_dir: str = None,
+    use_cache: bool = True,
+    cache_dir: Optional[str] = None,
+    hash_sources: bool = False,
+    arrow_backed: bool = False,
+    memory_map: bool = False,
+    columns: Optional[List[str]] = None,
+    chunksize: Optional[int] = None
+) -> pd.DataFrame:
     """
     Load and merge Amazon products and categories data
-    
+
+    The merged frame is cached as an uncompressed Feather (Arrow IPC) file next to the
+    CSVs, and later calls memory-map it instead of re-reading and re-merging the CSVs.
+    The cache is rebuilt when the size or mtime (or, with hash_sources, the content
+    hash) of either CSV changes, or when the dtype plan it was built with does.
+
     Args:
         data_dir (str, optional): Data directory path. If None, uses current directory
-        
+        use_cache (bool): Read/write the columnar cache. Requires pyarrow; without it
+            the CSVs are read every time
+        cache_dir (str, optional): Directory of the cache files. Defaults to data_dir/.cache
+        hash_sources (bool): Also compare sha256 of the CSVs, not only size and mtime
+        arrow_backed (bool): Return pyarrow-backed columns (pd.ArrowDtype) that stay
+            memory-mapped, instead of converting the cache to NumPy/object columns.
+            Near-instant, but string columns become string[pyarrow]
+        memory_map (bool): Keep numeric columns without nulls as read-only views of the
+            memory-mapped cache instead of copying them; other columns are converted.
+            Opt-in: assigning into such a column in place (df.loc[...] = ..., *=) raises
+        columns (List[str], optional): Load only these columns through the streaming
+            ingest (ingest_amazon_data). The columnar cache is not used in this mode
+        chunksize (int, optional): Use the streaming ingest with this many rows per chunk.
+            Its memory report is stored in df.attrs["memory_report"]
+
     Returns:
         pd.DataFrame: Merged product data with categories
     """
     # Set data directory
     data_dir = Path(data_dir) if data_dir else Path(__file__).parent
-    
-    # Load and merge data
-    df1 = pd.read_csv(data_dir / "amazon_products.csv")
-    df2 = pd.read_csv(data_dir / "amazon_categories.csv")
-    df = df1.merge(df2, left_on="category_id", right_on="id", how="left")
-    df.drop(columns=["id"], inplace=True)
-    
+    if columns is not None or chunksize is not None:
+        df, report = ingest_amazon_data(data_dir, columns=columns, chunksize=chunksize or 200_000)
+        df.attrs["memory_report"] = report
+        return df
+    if not use_cache:
+        return _read_and_merge(data_dir)
+
+    try:
+        import pyarrow.feather as feather
+    except ImportError:
+        warnings.warn("pyarrow is not installed, loading Amazon data without the columnar cache")
+        return _read_and_merge(data_dir)
+
+    cache_dir = Path(cache_dir) if cache_dir else data_dir / ".cache"
+    cache_path = cache_dir / CACHE_FILE
+    manifest_path = cache_dir / MANIFEST_FILE
+    state = _source_state([data_dir / PRODUCTS_FILE, data_dir / CATEGORIES_FILE], hash_sources)
+
+    plan = _dtype_plan()
+
+    def read_cache() -> pd.DataFrame:
+        table = feather.read_table(cache_path, memory_map=True)
+        if arrow_backed:
+            return table.to_pandas(types_mapper=pd.ArrowDtype)
+        if memory_map:
+            # one block per column: numeric columns without nulls are not copied
+            return table.to_pandas(split_blocks=True, self_destruct=True)
+        return table.to_pandas()
+
+    if cache_path.exists() and manifest_path.exists():
+        manifest = json.loads(manifest_path.read_text())
+        stored = manifest.get("sources", {})
+        if manifest.get("dtypes") == plan and all(
+                stored.get(name, {}).get(key) == value for name, entry in state.items() for key, value in entry.items()):
+            return read_cache()
+
+    # Load and merge data, then refresh the cache. One record batch, so every column is a
+    # single contiguous buffer that can be mapped without copying.
+    df = _read_and_merge(data_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    tmp_path = cache_path.with_suffix(".tmp")
+    feather.write_feather(df, tmp_path, compression="uncompressed", chunksize=max(len(df), 1))
+    tmp_path.replace(cache_path)
+    manifest_path.write_text(json.dumps({"sources": state, "dtypes": plan}, indent=2))
+
+    if arrow_backed or memory_map:
+        del df
+        return read_cache()
     return df
 
 
@@ -30,4 +277,10 @@ def load_amazon_data(data_dir: str = None) -> pd.DataFrame:
 # Example usage
 if __name__ == "__main__":
     df = load_amazon_data()
-    print(f"Loaded {len(df)} products")
\ No newline at end of file
+    print(f"Loaded {len(df)} products")
+
+    compact_df, report = ingest_amazon_data()
+    print(f"Streaming ingest: {report['rows']} rows, "
+          f"{report['default_bytes'] / 2**20:.1f} MiB at default dtypes -> "
+          f"{report['compact_bytes'] / 2**20:.1f} MiB compact "
+          f"(largest chunk {report['largest_chunk_bytes'] / 2**20:.1f} MiB)")
@@ -1,30 +1,246 @@
-from execute import extract_code_and_execute, format_llm_output
+import asyncio
+import contextvars
+import logging
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from execute import extract_code, format_llm_output, iter_formatted_sections, run_answer
+from fingerprint import schema_fingerprint
+from prompts import retry_feedback_template
+from results import MAX_RESULT_ROWS, bounded_context, shape_result
+from router import routed_answer
+from semantic_cache import cell_values
+from telemetry import REGISTRY, span, trace
+
+
+logger = logging.getLogger('tfm.agent')
 
 
 class RAGAgent:
-    def __init__(self, retriever, prompt, model, df):
+    # candidates > 1 samples that many answers per round concurrently and keeps the first
+    # one that runs (and passes `validator`), cancelling the rest. Each later round carries
+    # the failing code and its error in the prompt. With candidates > 1, max_attempts=1
+    # bounds a question to about one model round trip. An optional semantic_cache.SemanticCache
+    # answers paraphrases of earlier questions by re-running their code, without a model call,
+    # and an optional router.QueryRouter answers simple aggregates before either is consulted.
+    # Results longer than max_result_rows are returned as results.ResultHandle (None: never).
+    def __init__(self, retriever, prompt, model, df, executor=None, max_attempts=3, candidates=1, validator=None,
+                 semantic_cache=None, router=None, max_result_rows=MAX_RESULT_ROWS):
         self.retriever = retriever
         self.prompt = prompt
         self.model = model
         self.df = df
+        # optional sandbox.SandboxExecutor holding the same df
+        self.executor = executor
+        self.max_attempts = max_attempts
+        self.candidates = candidates
+        # optional validator(result) -> error message, or None when the result is acceptable
+        self.validator = validator
+        self.semantic_cache = semantic_cache
+        self.router = router
+        self.max_result_rows = max_result_rows
+
+    def format_prompt(self, context, query, feedback=None):
+        with span('prompt') as attributes:
+            prompt_output = self.prompt.format(context=context, question=query)
+            if feedback is not None:
+                prompt_output += retry_feedback_template.format(code=feedback[0], error=feedback[1])
+            attributes['chars'] = len(prompt_output)
+        return prompt_output
+
+    def build_prompt(self, query, feedback=None):
+        with span('retrieve'):
+            context = self.retriever.retrieve_schema(query, self.df)
+        return self.format_prompt(context, query, feedback)
+
+    async def abuild_prompt(self, query, feedback=None):
+        with span('retrieve'):
+            context = await self.retriever.aretrieve_schema(query, self.df)
+        return self.format_prompt(context, query, feedback)
+
+    def processor(self, query, feedback=None, **kwargs):
+        return self.model.invoke(self.build_prompt(query, feedback), **kwargs)
+
+    async def aprocessor(self, query, feedback=None, **kwargs):
+        return await self.model.ainvoke(await self.abuild_prompt(query, feedback), **kwargs)
+
+    def check(self, answer):
+        # (result, error) of one generated answer, with the validator applied
+        result, error = run_answer(answer, self.df, self.executor)
+        if error is None and self.validator is not None:
+            error = self.validator(result)
+            if error is not None:
+                result = None
+        return result, error
+
+    def candidate(self, prompt_output, stop=None, **kwargs):
+        answer = self.model.invoke(prompt_output, **kwargs)
+        if stop is not None and stop.is_set():
+            # another candidate already won, skip the exec
+            return answer, None, 'cancelled'
+        return (answer, *self.check(answer))
+
+    async def acandidate(self, prompt_output, **kwargs):
+        answer = await self.model.ainvoke(prompt_output, **kwargs)
+        # exec of generated pandas code is CPU-bound, keep it off the event loop
+        return (answer, *await asyncio.to_thread(self.check, answer))
+
+    def first_success(self, prompt_output, **kwargs):
+        pool = ThreadPoolExecutor(max_workers=self.candidates)
+        stop = threading.Event()
+        pending = {pool.submit(contextvars.copy_context().run, self.candidate, prompt_output, stop, **kwargs)
+                   for _ in range(self.candidates)}
+        outcome = None
+        try:
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    outcome = future.result()
+                    self.record_candidate('failed' if outcome[2] is not None else 'won')
+                    if outcome[2] is None:
+                        return outcome
+            return outcome
+        finally:
+            # in-flight HTTP calls cannot be interrupted from another thread; their
+            # answers are dropped when they arrive
+            stop.set()
+            for _ in pending:
+                self.record_candidate('cancelled')
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    async def afirst_success(self, prompt_output, **kwargs):
+        pending = {asyncio.ensure_future(self.acandidate(prompt_output, **kwargs)) for _ in range(self.candidates)}
+        outcome = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    outcome = task.result()
+                    self.record_candidate('failed' if outcome[2] is not None else 'won')
+                    if outcome[2] is None:
+                        return outcome
+            return outcome
+        finally:
+            for task in pending:
+                task.cancel()
+                self.record_candidate('cancelled')
+
+    def route(self, query):
+        # {'code', 'result', 'answer'} from the router's fast path, or None to use the LLM
+        if self.router is None:
+            return None
+        try:
+            plan = self.router.plan(query, self.df)
+        except Exception:
+            # a planner bug must cost a model call, not the question
+            logger.exception('router failed to plan %r, falling back to the LLM', query)
+            plan = None
+        ctx = None
+        if plan is not None:
+            expression, answer = plan
+            code = f"```python\n{expression}\n```"
+            result, error = self.check(code)
+            if error is None:
+                ctx = {'code': code, 'result': result, 'answer': answer}
+        self.router.record(ctx is not None)
+        if ctx is not None:
+            REGISTRY.inc('rag_questions_total', 1, 'Questions answered by RAGAgent, by outcome', outcome='routed')
+        return ctx
+
+    def cached_answer(self, query):
+        # {'code', 'result'} from the semantic cache, or None. Cached code is re-executed and
+        # validated like a fresh answer; code that no longer runs is dropped from the cache.
+        if self.semantic_cache is None:
+            return None
+        schema = schema_fingerprint(self.df)
+        hit = self.semantic_cache.lookup(query, schema, self.df.columns, cell_values(self.df))
+        if hit is None:
+            return None
+        cached_question, code = hit
+        answer = f"```python\n{code}\n```"
+        result, error = self.check(answer)
+        if error is not None:
+            self.semantic_cache.invalidate(cached_question, schema)
+            return None
+        REGISTRY.inc('rag_questions_total', 1, 'Questions answered by RAGAgent, by outcome', outcome='cached')
+        return {'code': answer, 'result': result}
+
+    def remember(self, query, answer, result):
+        if self.semantic_cache is not None and result is not None:
+            code = extract_code(answer)
+            if code:
+                self.semantic_cache.store(query, schema_fingerprint(self.df), list(self.df.columns), code,
+                                          cell_values(self.df))
+
+    def shape(self, ctx):
+        if self.max_result_rows is not None:
+            ctx['result'] = shape_result(ctx['result'], self.max_result_rows)
+        return ctx
+
+    @staticmethod
+    def record_candidate(outcome):
+        REGISTRY.inc('rag_candidates_total', 1, 'Sampled code candidates by outcome', outcome=outcome)
+
+    @staticmethod
+    def record_attempts(attributes, attempts, result):
+        attributes['attempts'] = attempts
+        REGISTRY.inc('rag_questions_total', 1, 'Questions answered by RAGAgent, by outcome',
+                     outcome='failed' if result is None else 'ok')
+        REGISTRY.inc('rag_retries_total', attempts - 1, 'Extra code-generation attempts after a failed execution')
 
-    def processor(self, query, **kwargs):
-        context = self.retriever.retrieve_schema(query, self.df)
-        prompt_output = self.prompt.format(context=context, question=query)
-        model_output = self.model.invoke(prompt_output, **kwargs)
-        return model_output
-    
     def invoke(self, query, **kwargs):
         result = None
-        max_attempts = 3  
+        feedback = None
+        attempts = 0
+
+        with trace('rag', question_chars=len(query)) as attributes:
+            routed = self.route(query)
+            attributes['routed'] = routed is not None
+            if routed is not None:
+                return self.shape(routed)
+            cached = self.cached_answer(query)
+            attributes['semantic_hit'] = cached is not None
+            if cached is not None:
+                return self.shape(cached)
+            while result is None and attempts < self.max_attempts:
+                prompt_output = self.build_prompt(query, feedback)
+                if self.candidates > 1:
+                    code, result, error = self.first_success(prompt_output, **kwargs)
+                else:
+                    code, result, error = self.candidate(prompt_output, **kwargs)
+                feedback = (extract_code(code) or code, error)
+                attempts += 1
+            self.record_attempts(attributes, attempts, result)
+            self.remember(query, code, result)
+
+        return self.shape({'code': code, 'result': result})
+
+    async def ainvoke(self, query, **kwargs):
+        result = None
+        feedback = None
         attempts = 0
-        
-        while result is None and attempts < max_attempts:
-            code = self.processor(query, **kwargs)
-            result = extract_code_and_execute(code, self.df)
-            attempts += 1  
-        
-        return {'code': code, 'result': result}
+
+        with trace('rag', question_chars=len(query)) as attributes:
+            routed = await asyncio.to_thread(self.route, query)
+            attributes['routed'] = routed is not None
+            if routed is not None:
+                return self.shape(routed)
+            cached = await asyncio.to_thread(self.cached_answer, query)
+            attributes['semantic_hit'] = cached is not None
+            if cached is not None:
+                return self.shape(cached)
+            while result is None and attempts < self.max_attempts:
+                prompt_output = await self.abuild_prompt(query, feedback)
+                if self.candidates > 1:
+                    code, result, error = await self.afirst_success(prompt_output, **kwargs)
+                else:
+                    code, result, error = await self.acandidate(prompt_output, **kwargs)
+                feedback = (extract_code(code) or code, error)
+                attempts += 1
+            self.record_attempts(attributes, attempts, result)
+            await asyncio.to_thread(self.remember, query, code, result)
+
+        return self.shape({'code': code, 'result': result})
 
     
 class InterpAgent:
@@ -32,8 +248,30 @@ class InterpAgent:
         self.prompt = prompt
         self.model = model
 
+    # A context answered by RAGAgent's router carries its own one-sentence answer and is
+    # formatted without a model call.
     def invoke(self, context, query, **kwargs):
-        prompt_output = self.prompt.format(context=context, question=query)
-        model_output = self.model.invoke(prompt_output, **kwargs)
-        return format_llm_output(model_output)
-  
\ No newline at end of file
+        if isinstance(context, dict) and 'answer' in context:
+            return format_llm_output(routed_answer(context, query))
+        with trace('interpret'):
+            prompt_output = self.prompt.format(context=bounded_context(context), question=query)
+            model_output = self.model.invoke(prompt_output, **kwargs)
+            return format_llm_output(model_output)
+
+    async def ainvoke(self, context, query, **kwargs):
+        if isinstance(context, dict) and 'answer' in context:
+            return format_llm_output(routed_answer(context, query))
+        with trace('interpret'):
+            prompt_output = self.prompt.format(context=bounded_context(context), question=query)
+            model_output = await self.model.ainvoke(prompt_output, **kwargs)
+            return format_llm_output(model_output)
+
+    def stream(self, context, query, **kwargs):
+        # Yields formatted sections (question, relative result, concluding response) as
+        # soon as each is complete, instead of after the whole answer
+        if isinstance(context, dict) and 'answer' in context:
+            yield from iter_formatted_sections([routed_answer(context, query)])
+            return
+        with span('interpret', streamed=True):
+            prompt_output = self.prompt.format(context=bounded_context(context), question=query)
+            yield from iter_formatted_sections(self.model.stream(prompt_output, **kwargs))
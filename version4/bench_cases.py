@@ -0,0 +1,123 @@
+import numpy as np
+import pandas as pd
+
+
+# Question sets from test.ipynb with the pandas code that answers them. The frames below
+# are deterministic stand-ins for random_sample.csv and product_sample.csv.
+STUDENT_CASES = [
+    {'query': "What is the highest math score?", 'pandas_code': "df['math score'].max()"},
+    {'query': "What is the lowest reading score?", 'pandas_code': "df['reading score'].min()"},
+    {'query': "What are the two lowest writing scores?", 'pandas_code': "df['writing score'].nsmallest(2)"},
+    {'query': "How many students whoes reading score more than 80?", 'pandas_code': "(df['reading score'] > 80).sum()"},
+    {'query': "Which gender has a better math score?", 'pandas_code': "df.groupby('gender')['math score'].mean()"},
+    {'query': "If parental level of education has the impact for reading score?", 'pandas_code': "df.groupby('parental level of education')['reading score'].mean()"},
+    {'query': "What's the best comprehensive score?", 'pandas_code': "df[['reading score', 'writing score', 'math score']].sum(axis=1).max()"},
+    {'query': "What're the features of the student who has the best writing score?", 'pandas_code': "df.iloc[df['writing score'].idxmax()]"},
+    {'query': "What're the features of the student who has the best total score?", 'pandas_code': "df.iloc[df[['reading score', 'writing score', 'math score']].sum(axis=1).idxmax()]"},
+    {'query': "If food impacts writing score?", 'pandas_code': "df.groupby('lunch')['writing score'].mean()"},
+    {'query': "If students who completed preparation have a better writing score?", 'pandas_code': "df.groupby('test preparation course')['writing score'].mean()"},
+    {'query': "Which racial has the best writing score?", 'pandas_code': "df.groupby('race/ethnicity')['writing score'].mean().idxmax()"},
+]
+
+PRODUCT_CASES = [
+    {'query': "What's the worst average rating?", 'pandas_code': "df['average_rating'].min()"},
+    {'query': "What's the best satisfaction?", 'pandas_code': "df['customer_satisfaction'].max()"},
+    {'query': "What's the average inventory?", 'pandas_code': "df['stock_quantity'].mean()"},
+    {'query': "Which product has the highest sales volume?", 'pandas_code': "df.loc[df['sales_volume'].idxmax(), 'product_name']"},
+    {'query': "How many products are currently on promotion?", 'pandas_code': "df['on_promotion'].sum()"},
+    {'query': "What're the features of product which has the best market feedback?", 'pandas_code': "df.loc[df['average_rating'].idxmax()]"},
+    {'query': "How many different product categories are there?", 'pandas_code': "df['category'].nunique()"},
+    {'query': "The product_name where stock_quantity is less than 100?", 'pandas_code': "df[df['stock_quantity'] < 100]['product_name']"},
+]
+
+# Rephrasings of STUDENT_CASES that should reuse their code ('paraphrase_of'), and near misses
+# that look alike but need different code (paraphrase_of None), for the semantic cache.
+SEMANTIC_CASES = [
+    {'query': "What's the max math score?", 'pandas_code': "df['math score'].max()",
+     'paraphrase_of': "What is the highest math score?"},
+    {'query': "Show me the maximum math score", 'pandas_code': "df['math score'].max()",
+     'paraphrase_of': "What is the highest math score?"},
+    {'query': "Show me the minimum reading score", 'pandas_code': "df['reading score'].min()",
+     'paraphrase_of': "What is the lowest reading score?"},
+    {'query': "How many students whose reading score is above 80?", 'pandas_code': "(df['reading score'] > 80).sum()",
+     'paraphrase_of': "How many students whoes reading score more than 80?"},
+    {'query': "Which gender has better math scores?", 'pandas_code': "df.groupby('gender')['math score'].mean()",
+     'paraphrase_of': "Which gender has a better math score?"},
+    {'query': "What is the lowest math score?", 'pandas_code': "df['math score'].min()", 'paraphrase_of': None},
+    {'query': "What is the highest reading score?", 'pandas_code': "df['reading score'].max()", 'paraphrase_of': None},
+    {'query': "How many students whoes reading score more than 90?", 'pandas_code': "(df['reading score'] > 90).sum()",
+     'paraphrase_of': None},
+    {'query': "How many students whoes reading score less than 80?", 'pandas_code': "(df['reading score'] < 80).sum()",
+     'paraphrase_of': None},
+    {'query': "Which gender has a better reading score?", 'pandas_code': "df.groupby('gender')['reading score'].mean()",
+     'paraphrase_of': None},
+    {'query': "What's the worst comprehensive score?", 'pandas_code': "df[['reading score', 'writing score', 'math score']].sum(axis=1).min()",
+     'paraphrase_of': None},
+]
+
+# Student questions with a filter the router's intents cannot express; it must leave them to
+# the LLM instead of answering the unfiltered aggregate
+ROUTER_FALLBACK_CASES = [
+    "What is the average math score of girls?",
+    "What is the highest math score for boys?",
+    "How many girls have a math score above 80?",
+    "What is the lowest reading score of male students?",
+    "How many students who completed the course have a writing score above 50?",
+]
+
+
+def make_students(n_rows=1000, seed=0):
+    # Same columns as the student performance sample used in test.ipynb
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'gender': rng.choice(['female', 'male'], n_rows),
+        'race/ethnicity': rng.choice([f'group {g}' for g in 'ABCDE'], n_rows),
+        'parental level of education': rng.choice(["some college", "associate's degree", "high school",
+                                                   "some high school", "bachelor's degree", "master's degree"], n_rows),
+        'lunch': rng.choice(['standard', 'free/reduced'], n_rows),
+        'test preparation course': rng.choice(['none', 'completed'], n_rows),
+        'math score': rng.integers(0, 101, n_rows),
+        'reading score': rng.integers(0, 101, n_rows),
+        'writing score': rng.integers(0, 101, n_rows),
+    })
+
+
+def make_products(n_rows=1000, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'product_id': np.arange(n_rows),
+        'product_name': [f'Product {i}' for i in range(n_rows)],
+        'category': rng.choice(['Electronics', 'Clothing', 'Home & Kitchen', 'Books', 'Toys'], n_rows),
+        'price': rng.uniform(1, 500, n_rows).round(2),
+        'stock_quantity': rng.integers(0, 1000, n_rows),
+        'sales_volume': rng.integers(0, 5000, n_rows),
+        'average_rating': rng.uniform(1, 5, n_rows).round(2),
+        'customer_satisfaction': rng.uniform(0, 100, n_rows).round(1),
+        'on_promotion': rng.random(n_rows) < 0.2,
+    })
+
+
+DATASETS = {
+    'students': (make_students, STUDENT_CASES),
+    'products': (make_products, PRODUCT_CASES),
+}
+
+
+def results_match(actual, expected):
+    if isinstance(expected, (pd.DataFrame, pd.Series)):
+        if type(actual) is not type(expected):
+            return False
+        try:
+            if isinstance(expected, pd.DataFrame):
+                pd.testing.assert_frame_equal(actual, expected, check_names=False, check_dtype=False)
+            else:
+                pd.testing.assert_series_equal(actual, expected, check_names=False, check_dtype=False)
+            return True
+        except AssertionError:
+            return False
+    if isinstance(expected, (float, np.floating)):
+        return isinstance(actual, (int, float, np.number)) and bool(np.isclose(actual, expected))
+    try:
+        return bool(actual == expected)
+    except (TypeError, ValueError):
+        return False
@@ -0,0 +1,813 @@
+"""Benchmarks for the version4 pipeline that run without network access.
+
+A local StubModelServer stands in for Ollama and answers every prompt with a canned
+code block after a fixed delay, so the numbers measure our own overhead and concurrency.
+
+Usage:
+    python benchmark.py suite --repeat 5 --fail-first 0.2 --max-overhead-ms 50
+    python benchmark.py suite --model mistral --base-url http://localhost:11434
+    python benchmark.py suite --model mistral --profiles
+    python benchmark.py suite --delay 1 --router
+    python benchmark.py retriever --mode hybrid
+    python benchmark.py semantic --threshold 0.9
+    python benchmark.py stream --delay 0.5 --chunk-delay 0.02
+    python benchmark.py async --questions 50 --delay 0.5 --concurrency 25
+    python benchmark.py indexes --rows 1400000
+    python benchmark.py datasets --datasets 40 --budget-mb 256
+    python benchmark.py imports --budget-ms 1500 --forbid-heavy
+    python benchmark.py imports --cwd ../version1 --modules main
+    python benchmark.py sandbox --rows 2000000 --workers 1 2 4
+    python benchmark.py ratelimit --quota 10 --window 1 --threads 16 --processes 4
+"""
+import argparse
+import ast
+import asyncio
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from agent import RAGAgent, InterpAgent
+from bench_cases import (DATASETS, ROUTER_FALLBACK_CASES, SEMANTIC_CASES, STUDENT_CASES, make_products, make_students,
+                         results_match)
+from df_index import INDEX_NAME, FrameIndex, rewrite
+from execute import execute_code
+from model import PROVIDERS, Model
+from column_profile import ColumnProfiles
+from prompts import get_prompt, combined_template, interp_template, profile_template
+from rate_limit import AdaptiveLimiter, FileTokenBucket, TokenBucket
+from registry import DatasetRegistry
+from results import unwrap
+from retriever import Retriever
+from router import QueryRouter
+from sandbox import SandboxExecutor
+from semantic_cache import SemanticCache
+from stub_server import StubModelServer, stub_gemini_sdk
+from telemetry import REGISTRY
+
+
+STUDENT_QUESTIONS = [case['query'] for case in STUDENT_CASES[:5]]
+
+
+def build_agent(base_url, df):
+    model = Model('stub', base_url=base_url)
+    retriever = Retriever('bm25', embed_model_name=None)
+    return RAGAgent(retriever, get_prompt(combined_template), model, df)
+
+
+def bench_sync(agent, questions):
+    start = time.perf_counter()
+    for question in questions:
+        agent.invoke(question)
+    return time.perf_counter() - start
+
+
+async def bench_async(agent, questions, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(question):
+        async with semaphore:
+            return await agent.ainvoke(question)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(question) for question in questions))
+    return time.perf_counter() - start
+
+
+def run_async_benchmark(args):
+    questions = [STUDENT_QUESTIONS[i % len(STUDENT_QUESTIONS)] for i in range(args.questions)]
+    df = make_students()
+    with StubModelServer(delay=args.delay) as server:
+        agent = build_agent(server.url, df)
+        agent.invoke(questions[0])  # warm up the schema index and HTTP client
+        sync_seconds = bench_sync(agent, questions) if not args.skip_sync else None
+        async_seconds = asyncio.run(bench_async(agent, questions, args.concurrency))
+
+    print(f'{args.questions} questions, model delay {args.delay}s, concurrency {args.concurrency}')
+    if sync_seconds is not None:
+        print(f'  invoke  : {sync_seconds:8.2f}s  {args.questions / sync_seconds:8.2f} questions/s')
+    print(f'  ainvoke : {async_seconds:8.2f}s  {args.questions / async_seconds:8.2f} questions/s')
+
+
+# --- accuracy and per-stage latency suite -------------------------------------------
+
+def stub_responder(cases, fail_first=0.0):
+    # Deterministic stand-in for the LLM: answers a code prompt with the ground-truth code of
+    # the question it contains, and an interpretation prompt with the three expected sections.
+    # Questions selected by `fail_first` get broken code on their first request, which
+    # exercises the retry loop in RAGAgent.invoke.
+    codes = {case['query']: case['pandas_code'] for case in cases}
+    requests = Counter()
+
+    def respond(prompt):
+        # templates carry example questions of their own, so take the one the prompt asks
+        question = next((q for q in codes if f'question is: {q}' in prompt or f'question: {q}' in prompt), None)
+        if 'information analysis and summary assistant' in prompt:
+            return (f"**The question:** {question}\n\n"
+                    f"**The relative result:** see the computed result\n\n"
+                    f"**The concluding response:** The data answers the question.")
+        if question is None:
+            return "```python\ndf.describe()\n```"
+        requests[question] += 1
+        if requests[question] == 1 and zlib.crc32(question.encode('utf-8')) % 100 < fail_first * 100:
+            return "```python\ndf['no such column'].max()\n```"
+        return f"```python\n{codes[question]}\n```"
+
+    return respond
+
+
+class StageTimes:
+    def __init__(self):
+        self.samples = defaultdict(list)
+        # wall time with at least one model call in flight; parallel candidates overlap
+        self.llm_busy = 0.0
+        self._in_flight = 0
+        self._busy_since = 0.0
+        self._lock = threading.Lock()
+        self.prompt_chars = []
+
+    def timed(self, stage, func, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.samples[stage].append(time.perf_counter() - start)
+
+    def timed_llm(self, stage, func, *args, **kwargs):
+        with self._lock:
+            if self._in_flight == 0:
+                self._busy_since = time.perf_counter()
+            self._in_flight += 1
+        try:
+            return self.timed(stage, func, *args, **kwargs)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+                if self._in_flight == 0:
+                    self.llm_busy += time.perf_counter() - self._busy_since
+
+    def summary(self):
+        return {
+            stage: {
+                'n': len(values),
+                'p50_ms': float(np.percentile(values, 50) * 1000),
+                'p95_ms': float(np.percentile(values, 95) * 1000),
+                'p99_ms': float(np.percentile(values, 99) * 1000),
+            }
+            for stage, values in self.samples.items()
+        }
+
+
+class TimedRetriever:
+    def __init__(self, retriever, times):
+        self.retriever = retriever
+        self.times = times
+
+    def retrieve_schema(self, query, df):
+        return self.times.timed('retrieve', self.retriever.retrieve_schema, query, df)
+
+
+class TimedPrompt:
+    def __init__(self, prompt, times):
+        self.prompt = prompt
+        self.times = times
+
+    def format(self, **kwargs):
+        prompt_output = self.times.timed('prompt', self.prompt.format, **kwargs)
+        self.times.prompt_chars.append(len(prompt_output))
+        return prompt_output
+
+
+class TimedModel:
+    def __init__(self, model, times, stage):
+        self.model = model
+        self.times = times
+        self.stage = stage
+
+    def invoke(self, prompt, **kwargs):
+        return self.times.timed_llm(self.stage, self.model.invoke, prompt, **kwargs)
+
+
+class TimedExecutor:
+    # Plugs into RAGAgent's executor hook so exec time is measured without touching agent.py
+    def __init__(self, df, times):
+        self.df = df
+        self.times = times
+
+    def run(self, code):
+        return self.times.timed('exec', execute_code, code, self.df)
+
+
+def run_suite(model, retriever, datasets, rows, repeat, max_attempts=3, candidates=1, template=combined_template,
+              router=None):
+    times = StageTimes()
+    report = {'datasets': {}}
+    interp = InterpAgent(get_prompt(interp_template), TimedModel(model, times, 'interpret_llm'))
+    questions = routed = 0
+    start = time.perf_counter()
+    for name in datasets:
+        make_frame, cases = DATASETS[name]
+        df = make_frame(rows)
+        agent = RAGAgent(TimedRetriever(retriever, times), TimedPrompt(get_prompt(template), times),
+                         TimedModel(model, times, 'llm'), df, executor=TimedExecutor(df, times),
+                         max_attempts=max_attempts, candidates=candidates, router=router)
+        correct = 0
+        for _ in range(repeat):
+            for case in cases:
+                llm_before = times.llm_busy
+                question_start = time.perf_counter()
+                ctx = agent.invoke(case['query'])
+                times.timed('interpret', interp.invoke, ctx, case['query'])
+                total = time.perf_counter() - question_start
+                llm_spent = times.llm_busy - llm_before
+                times.samples['total'].append(total)
+                times.samples['overhead'].append(total - llm_spent)
+                correct += results_match(unwrap(ctx['result']), eval(case['pandas_code'], {}, {'df': df}))
+                routed += 'answer' in ctx
+                questions += 1
+        report['datasets'][name] = {'questions': len(cases) * repeat, 'accuracy': correct / (len(cases) * repeat)}
+    seconds = time.perf_counter() - start
+    report['throughput_qps'] = questions / seconds
+    report['stages'] = times.summary()
+    report['llm_calls'] = len(times.samples['llm'])
+    # first-round prompts only; retry prompts also carry the failed code
+    report['prompt_chars_mean'] = float(np.mean(times.prompt_chars)) if times.prompt_chars else 0.0
+    report['fast_path_share'] = routed / questions if questions else 0.0
+    llm_questions = questions - routed
+    report['retry_rate'] = (report['llm_calls'] / candidates - llm_questions) / llm_questions if llm_questions else 0.0
+    return report
+
+
+def print_suite_report(report):
+    for name, result in report['datasets'].items():
+        print(f"{name:10s} accuracy {result['accuracy']:6.1%} over {result['questions']} questions")
+    print(f"throughput {report['throughput_qps']:.2f} questions/s, {report['llm_calls']} code-generation calls")
+    print(f"prompt {report['prompt_chars_mean']:.0f} chars on average, {report['retry_rate']:.1%} retried questions, "
+          f"{report['fast_path_share']:.1%} answered without the LLM")
+    print(f"{'stage':14s} {'n':>5s} {'p50 ms':>9s} {'p95 ms':>9s} {'p99 ms':>9s}")
+    for stage, values in report['stages'].items():
+        print(f"{stage:14s} {values['n']:5d} {values['p50_ms']:9.2f} {values['p95_ms']:9.2f} {values['p99_ms']:9.2f}")
+
+
+def run_suite_benchmark(args):
+    cases = [case for name in args.datasets for case in DATASETS[name][1]]
+    retriever = Retriever(args.retriever_mode, embed_model_name=args.embed_model, **db_option(args.db),
+                          column_profiles=ColumnProfiles() if args.profiles else None)
+    template = profile_template if args.profiles else combined_template
+    router = QueryRouter(retriever) if args.router else None
+    if args.model:
+        report = run_suite(Model(args.model, base_url=args.base_url), retriever, args.datasets,
+                           args.rows, args.repeat, args.max_attempts, args.candidates, template, router)
+    else:
+        with StubModelServer(stub_responder(cases, args.fail_first), delay=args.delay) as server:
+            report = run_suite(Model('stub', base_url=server.url), retriever, args.datasets,
+                               args.rows, args.repeat, args.max_attempts, args.candidates, template, router)
+    print_suite_report(report)
+    misrouted = []
+    if router is not None:
+        students = make_students(args.rows)
+        misrouted = [query for query in ROUTER_FALLBACK_CASES if router.plan(query, students) is not None]
+        print(f'router: {len(ROUTER_FALLBACK_CASES) - len(misrouted)}/{len(ROUTER_FALLBACK_CASES)} '
+              f'filtered questions left to the LLM')
+        for query in misrouted:
+            print(f'  ROUTED {query}')
+    if args.metrics:
+        print(REGISTRY.render())
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    failed = bool(misrouted)
+    if args.min_accuracy is not None:
+        failed |= any(result['accuracy'] < args.min_accuracy for result in report['datasets'].values())
+    if args.max_overhead_ms is not None:
+        failed |= report['stages']['overhead']['p95_ms'] > args.max_overhead_ms
+    if failed:
+        print('FAILED: accuracy, overhead budget or router fallback not met')
+        sys.exit(1)
+
+
+def run_semantic_benchmark(args):
+    # Seeds the cache with STUDENT_CASES, then asks SEMANTIC_CASES: paraphrases should be
+    # answered from the cache, near misses must go to the model, and no hit may be wrong.
+    df = make_students(args.rows)
+    cache = SemanticCache(threshold=args.threshold, max_entries=args.max_entries)
+    times = StageTimes()
+    with StubModelServer(stub_responder(STUDENT_CASES + SEMANTIC_CASES), delay=args.delay) as server:
+        agent = RAGAgent(Retriever('bm25', embed_model_name=None, db='numpy'), get_prompt(combined_template),
+                         TimedModel(Model('stub', base_url=server.url), times, 'llm'), df, semantic_cache=cache)
+        for case in STUDENT_CASES:
+            agent.invoke(case['query'])
+        seeded_calls = len(times.samples['llm'])
+
+        outcomes = Counter()
+        for case in SEMANTIC_CASES:
+            hits_before = cache.stats['hits']
+            start = time.perf_counter()
+            ctx = agent.invoke(case['query'])
+            seconds = time.perf_counter() - start
+            hit = cache.stats['hits'] > hits_before
+            correct = results_match(unwrap(ctx['result']), eval(case['pandas_code'], {}, {'df': df}))
+            kind = 'paraphrase' if case['paraphrase_of'] else 'near miss'
+            outcomes[kind, 'hit' if hit else 'miss'] += 1
+            if hit and not correct:
+                outcomes['false hit'] += 1
+            times.samples['hit' if hit else 'miss'].append(seconds)
+            print(f"  {'HIT ' if hit else 'miss'} {'ok ' if correct else 'BAD'} {case['query']}")
+
+    paraphrases = sum(1 for case in SEMANTIC_CASES if case['paraphrase_of'])
+    print(f"paraphrases answered from cache: {outcomes['paraphrase', 'hit']}/{paraphrases}")
+    print(f"near misses sent to the model:   {outcomes['near miss', 'miss']}/{len(SEMANTIC_CASES) - paraphrases}")
+    print(f"false hits: {outcomes['false hit']}, "
+          f"LLM calls saved: {len(SEMANTIC_CASES) - (len(times.samples['llm']) - seeded_calls)}")
+    print(f"cache: {cache.info()}")
+    for stage, values in times.summary().items():
+        if stage in ('hit', 'miss'):
+            print(f"  {stage:5s} n={values['n']:3d} p50 {values['p50_ms']:8.2f} ms  p95 {values['p95_ms']:8.2f} ms")
+    if outcomes['false hit'] > args.max_false_hits:
+        print('FAILED: the semantic cache returned wrong answers')
+        sys.exit(1)
+
+
+# Generated-code shapes over the product frame; {v} varies per repeat so no two runs share a
+# memoized result and the indexes, not execute's result cache, are what gets reused
+INDEXED_EXPRESSIONS = [
+    "df[df['stock_quantity'] < {v}]['product_name']",
+    "df[df['price'] > {v}]",
+    "(df['sales_volume'] > {w}).sum()",
+    "df['average_rating'].nsmallest({n})",
+    "df['sales_volume'].nlargest({n})",
+    "df.loc[df['sales_volume'].idxmax(), 'product_name']",
+    "df[df['category'] == 'Books']['price'].mean()",
+    "df.groupby('category')['price'].mean()",
+    "df.groupby('category')['sales_volume'].sum().idxmax()",
+    "df.groupby('category')['average_rating'].mean().sort_values()",
+]
+
+
+# Shapes the rewriter handles, over the dtypes that must keep pandas' semantics: datetime,
+# timedelta and period columns compared with string literals, categoricals, and NaN
+PARITY_EXPRESSIONS = [
+    "df[df['date'] == '2020-01-01']", "(df['date'] == '2020-01-01').sum()", "df[df['date'] > '2020-01-02']",
+    "(df['date'] >= '2020-01-02').sum()", "df['date'].nsmallest(3)", "df['date'].nlargest(3)",
+    "df['date'].idxmin()", "df['date'].idxmax()", "df.groupby('date')['qty'].sum()",
+    "df[df['delta'] == '1 days']", "(df['delta'] > '1 days').sum()", "df['delta'].nlargest(2)",
+    "df[df['period'] == '2020-01']", "(df['period'] == '2020-01').sum()",
+    "df[df['label'] == 'b']", "(df['label'] == 'b').sum()", "df[df['label'] == 'missing']",
+    "df.groupby('label')['score'].mean()",
+    "df[df['name'] == 'x']", "(df['name'] == 'y').sum()", "df.loc[df['name'] == 'y']", "df.groupby('name')['qty'].sum()",
+    "df[df['text'] == 'x']", "(df['text'] == 'y').sum()",
+    "df[df['score'] > 0.5]", "(df['score'] <= 0.5).sum()", "df[df['score'] == 0.25]", "df['score'].nsmallest(3)",
+    "df['score'].nlargest(3)", "df['score'].idxmin()", "df['score'].idxmax()", "df.groupby('name')['score'].mean()",
+    "df[df['qty'] == 3]", "(df['qty'] < 3).sum()", "df['qty'].nlargest(4)", "df.loc[df['qty'].idxmax(), 'name']",
+    "df['score'].nsmallest(10)", "df['score'].nlargest(10)", "df['price'].nsmallest(10)",
+    "df[df['price'] == 9.99]", "(df['price'] == 9.99).sum()", "(df['price'] <= 0.1).sum()", "df[df['price'] > 0.1]",
+]
+
+
+def make_parity_frame():
+    dates = pd.to_datetime(['2020-01-01', '2020-01-02', '2020-01-01', None, '2020-01-03', '2020-01-02'])
+    return pd.DataFrame({
+        'date': dates,
+        'delta': dates - pd.Timestamp('2019-12-31'),
+        'period': pd.PeriodIndex(['2020-01', '2020-02', '2020-01', '2020-03', '2020-01', '2020-02'], freq='M'),
+        'label': pd.Categorical(['a', 'b', None, 'b', 'c', 'a'], categories=['a', 'b', 'c', 'missing']),
+        'name': ['x', 'y', np.nan, 'y', 'x', None],
+        'text': pd.array(['x', 'y', None, 'x', 'y', 'y'], dtype='string'),
+        'score': [0.25, np.nan, 0.75, 0.25, 1.0, np.nan],
+        'qty': [3, 1, 4, 1, 5, 9],
+        # float32, as the Amazon ingest stores prices: literals compare at float32
+        'price': np.array([9.99, 0.1, 9.99, np.nan, 5.0, 0.5], dtype='float32'),
+    })
+
+
+def index_parity_mismatches():
+    # Expressions whose rewritten form returns something else than (or raises where) pandas
+    df = make_parity_frame()
+    index = FrameIndex(df)
+    mismatches = []
+    for expression in PARITY_EXPRESSIONS:
+        tree = ast.parse(expression, mode='eval')
+        outcomes = []
+        for code, names in ((compile(tree, '<generated>', 'eval'), {'df': df, 'pd': pd}),
+                            (rewrite(tree), {'df': df, 'pd': pd, INDEX_NAME: index})):
+            try:
+                outcomes.append(eval(code, None, names))
+            except Exception as e:
+                outcomes.append(type(e))
+        expected, actual = outcomes
+        if not (same_result(actual, expected) if not isinstance(expected, type) else actual is expected):
+            mismatches.append(expression)
+    return mismatches
+
+
+def same_result(actual, expected):
+    # stricter than results_match: exact values, dtypes and index labels
+    try:
+        if isinstance(expected, pd.DataFrame):
+            pd.testing.assert_frame_equal(actual, expected, check_exact=True)
+        elif isinstance(expected, pd.Series):
+            pd.testing.assert_series_equal(actual, expected, check_exact=True)
+        else:
+            return type(actual) is type(expected) and bool(actual == expected)
+        return True
+    except AssertionError:
+        return False
+
+
+def run_index_benchmark(args):
+    parity = index_parity_mismatches()
+    print(f'parity: {len(PARITY_EXPRESSIONS) - len(parity)}/{len(PARITY_EXPRESSIONS)} expressions over '
+          f'datetime, timedelta, period, categorical, string, float32 and NaN columns match pandas')
+    for expression in parity:
+        print(f'  MISMATCH {expression}')
+    df = make_products(args.rows)
+    index = FrameIndex(df)
+    plain_seconds = first_pass_seconds = indexed_seconds = 0.0
+    mismatches = 0
+    for repeat in range(args.repeat):
+        for template in INDEXED_EXPRESSIONS:
+            expression = template.format(v=100 + 37 * repeat, w=1000 + 370 * repeat, n=3 + repeat)
+            tree = ast.parse(expression, mode='eval')
+            plain_code, indexed_code = compile(tree, '<generated>', 'eval'), rewrite(tree)
+
+            start = time.perf_counter()
+            expected = eval(plain_code, None, {'df': df, 'pd': pd})
+            plain_seconds += time.perf_counter() - start
+            start = time.perf_counter()
+            actual = eval(indexed_code, None, {'df': df, 'pd': pd, INDEX_NAME: index})
+            seconds = time.perf_counter() - start
+            if repeat == 0:
+                # the first pass builds the column indexes and aggregates it needs
+                first_pass_seconds += seconds
+            else:
+                indexed_seconds += seconds
+            if not same_result(actual, expected):
+                mismatches += 1
+                print(f'  MISMATCH {expression}')
+
+    shapes = len(INDEXED_EXPRESSIONS)
+    print(f'{shapes} expression shapes x {args.repeat} repeats over {args.rows} rows')
+    print(f'  pandas     : {plain_seconds / (shapes * args.repeat) * 1000:8.2f} ms per expression')
+    print(f'  first pass : {first_pass_seconds * 1000:8.2f} ms for all shapes, building the indexes')
+    if args.repeat > 1:
+        print(f'  indexed    : {indexed_seconds / (shapes * (args.repeat - 1)) * 1000:8.2f} ms per expression')
+    print(f'  mismatches: {mismatches}')
+    if mismatches or parity:
+        print('FAILED: indexed results differ from pandas')
+        sys.exit(1)
+
+
+def run_dataset_benchmark(args):
+    # Questions spread over many student-sized frames with a Zipf-like popularity, all
+    # served by one registry, one stub model and one retriever under a memory budget
+    rng = np.random.default_rng(0)
+    weights = 1 / np.arange(1, args.datasets + 1) ** args.skew
+    picks = rng.choice(args.datasets, size=args.questions, p=weights / weights.sum())
+    latencies = defaultdict(list)
+    with StubModelServer(stub_responder(STUDENT_CASES), delay=args.delay) as server:
+        retriever = Retriever('bm25', embed_model_name=None, db='numpy')
+        registry = DatasetRegistry(Model('stub', base_url=server.url), retriever, get_prompt(combined_template),
+                                   memory_budget=args.budget_mb * 2 ** 20)
+        for i in range(args.datasets):
+            registry.register(f'students_{i}', make_students, n_rows=args.rows, seed=i)
+        start = time.perf_counter()
+        for number, pick in enumerate(picks):
+            loads = registry.stats['loads']
+            question_start = time.perf_counter()
+            registry.invoke(f'students_{pick}', STUDENT_QUESTIONS[number % len(STUDENT_QUESTIONS)])
+            latencies['load' if registry.stats['loads'] > loads else 'resident'].append(time.perf_counter() - question_start)
+        seconds = time.perf_counter() - start
+
+    info = registry.info()
+    print(f"{args.questions} questions over {args.datasets} datasets of {args.rows} rows, "
+          f"budget {args.budget_mb} MiB: {args.questions / seconds:.1f} questions/s")
+    print(f"  loads {info['loads']}, evictions {info['evictions']}, resident {len(info['loaded'])} datasets, "
+          f"peak {info['peak_bytes'] / 2 ** 20:.1f} MiB (before eviction)")
+    for kind, values in latencies.items():
+        print(f"  {kind:9s} n={len(values):4d} p50 {np.percentile(values, 50) * 1000:8.2f} ms  "
+              f"p95 {np.percentile(values, 95) * 1000:8.2f} ms")
+    # the registry's budget is soft (see DatasetRegistry); this bounds how far over it may go
+    max_peak_mb = args.max_peak_mb if args.max_peak_mb is not None else args.budget_mb
+    if info['peak_bytes'] > max_peak_mb * 2 ** 20:
+        print(f'FAILED: peak above {max_peak_mb} MiB')
+        sys.exit(1)
+
+
+def db_option(db):
+    # 'langchain' keeps Retriever's default vector store
+    return {} if db == 'langchain' else {'db': db}
+
+
+# --- schema retrieval: NumPy index vs LangChain retrievers ----------------------------
+
+def run_retriever_benchmark(args):
+    df = make_students(args.rows)
+    questions = [case['query'] for case in STUDENT_CASES]
+    results = {}
+    for db in ('langchain', 'numpy'):
+        retriever = Retriever(args.mode, embed_model_name=args.embed_model, **db_option(db))
+        start = time.perf_counter()
+        retriever.retrieve_schema(questions[0], df)
+        build = time.perf_counter() - start
+        timings = []
+        for _ in range(args.repeat):
+            for question in questions:
+                start = time.perf_counter()
+                retriever.retrieve_schema(question, df)
+                timings.append(time.perf_counter() - start)
+        results[db] = [retriever.retrieve_schema(question, df) for question in questions]
+        print(f'{db:10s} build {build * 1000:8.2f} ms  retrieve p50 {np.percentile(timings, 50) * 1e6:8.1f} us  '
+              f'p95 {np.percentile(timings, 95) * 1e6:8.1f} us')
+    print('same results' if results['langchain'] == results['numpy'] else 'results differ')
+
+
+# --- streaming: time to first token / first section ----------------------------------
+
+INTERP_ANSWER = (
+    "**The question:** Which racial group has the best writing score?\n\n"
+    "**The relative result:** group D has the highest mean writing score, 70.2, ahead of group E with 69.8.\n\n"
+    "**The concluding response:** The relative result indicates that group D has achieved the highest writing "
+    "scores on average, making it the racial group with the best writing performance, although the gap to "
+    "group E is small and may not be meaningful for a sample of this size."
+)
+
+
+def run_stream_benchmark(args):
+    context = {'code': "df.groupby('race/ethnicity')['writing score'].mean().idxmax()", 'result': 'group D'}
+    question = 'Which racial has the best writing score?'
+    with StubModelServer(lambda prompt: INTERP_ANSWER, delay=args.delay, chunk_size=args.chunk_size,
+                         chunk_delay=args.chunk_delay) as server:
+        interp = InterpAgent(get_prompt(interp_template), Model('stub', base_url=server.url))
+        interp.invoke(context, question)  # warm up the HTTP client
+        full, first_token, first_section, streamed = [], [], [], []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            answer = interp.invoke(context, question)
+            full.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            for chunk in interp.model.stream(interp.prompt.format(context=context, question=question)):
+                first_token.append(time.perf_counter() - start)
+                break
+
+            start = time.perf_counter()
+            sections = []
+            for section in interp.stream(context, question):
+                if not sections:
+                    first_section.append(time.perf_counter() - start)
+                sections.append(section)
+            streamed.append(time.perf_counter() - start)
+            assert '\n\n'.join(sections) == answer
+
+    print(f'{args.repeat} answers, model delay {args.delay}s, {args.chunk_delay}s per {args.chunk_size}-char chunk')
+    for name, values in [('invoke', full), ('first token', first_token),
+                         ('first section', first_section), ('stream total', streamed)]:
+        print(f'  {name:14s}: p50 {np.percentile(values, 50) * 1000:8.1f} ms  p95 {np.percentile(values, 95) * 1000:8.1f} ms')
+
+
+# --- cold start: import time per entry point ------------------------------------------
+
+# Packages that only some modes need; an entry point importing one of them eagerly is a regression
+HEAVY_PACKAGES = ('vertexai', 'langchain_google_vertexai', 'langchain_huggingface', 'sentence_transformers',
+                  'torch', 'langchain_chroma', 'chromadb', 'faiss', 'langchain_experimental')
+
+
+def import_profile(module, cwd):
+    # Runs `python -X importtime -c "import <module>"` in a fresh interpreter and returns
+    # (total seconds, {top-level package: seconds spent importing its modules})
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                               cwd=cwd, capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(f'import {module} failed:\n{completed.stderr[-2000:]}')
+    packages = defaultdict(float)
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        packages[name.strip().split('.')[0]] += int(self_us) / 1e6
+    return sum(packages.values()), packages
+
+
+def run_import_benchmark(args):
+    failed = False
+    for module in args.modules:
+        seconds, packages = import_profile(module, args.cwd)
+        heavy = sorted(name for name in packages if name in HEAVY_PACKAGES)
+        over = args.budget_ms is not None and seconds * 1000 > args.budget_ms
+        failed |= over or bool(heavy and args.forbid_heavy)
+        print(f'{module:16s} {seconds * 1000:8.1f} ms{"  OVER BUDGET" if over else ""}')
+        for name, cumulative in sorted(packages.items(), key=lambda item: -item[1])[:args.top]:
+            print(f'    {name:30s} {cumulative * 1000:8.1f} ms')
+        if heavy:
+            print(f'    heavy packages imported: {", ".join(heavy)}')
+    if failed:
+        print('FAILED: import budget exceeded')
+        sys.exit(1)
+
+
+# --- Gemini rate limiting against a quota-enforcing stub -------------------------------
+
+def gemini_stub_model(url, limiter=None):
+    # A Gemini Model whose SDK is the stub; provider entries are swapped through PROVIDERS
+    sdk = stub_gemini_sdk(url)
+    PROVIDERS.register('vertexai', sdk)
+    PROVIDERS.register('google', sdk)
+    return Model('gemini-stub', limiter=limiter)
+
+
+def run_limited_calls(model, calls, threads, sleep_per_minute=None):
+    # Latency of each of `calls` model calls made from `threads` threads. sleep_per_minute
+    # reproduces the old rate_limit_per_minute: a 60 / rate sleep in the caller's thread.
+    def call(i):
+        start = time.perf_counter()
+        if sleep_per_minute:
+            time.sleep(60 / sleep_per_minute)
+        model.invoke(f'question {i}')
+        return time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        return list(executor.map(call, range(calls)))
+
+
+def ratelimit_worker(url, state_file, rate_per_minute, calls, threads, max_concurrency):
+    # One worker process of the 'file' strategy: its own limiter, the bucket shared by file
+    limiter = AdaptiveLimiter(FileTokenBucket(state_file, rate_per_minute / 60, 1), max_concurrency=max_concurrency)
+    model = gemini_stub_model(url, limiter)
+    start = time.time()
+    latencies = run_limited_calls(model, calls, threads)
+    return latencies, limiter.info(), (start, time.time())
+
+
+def run_ratelimit_benchmark(args):
+    rate = args.quota * 60 / args.window
+    print(f'{args.calls} calls from {args.threads} threads, quota {args.quota} per {args.window}s '
+          f'({rate:.0f}/min), stub latency {args.delay}s')
+    with StubModelServer(delay=args.delay, quota=args.quota, quota_window=args.window) as server:
+        for strategy in args.strategies:
+            throttled = server.throttled
+            info = {}
+            start = time.perf_counter()
+            seconds = None
+            if strategy == 'none':
+                latencies = run_limited_calls(gemini_stub_model(server.url), args.calls, args.threads)
+            elif strategy == 'sleep':
+                latencies = run_limited_calls(gemini_stub_model(server.url), args.calls, args.threads, sleep_per_minute=rate)
+            elif strategy == 'adaptive':
+                limiter = AdaptiveLimiter(TokenBucket(rate / 60, 1), max_concurrency=args.max_concurrency)
+                latencies = run_limited_calls(gemini_stub_model(server.url, limiter), args.calls, args.threads)
+                info = limiter.info()
+            else:
+                # the same quota split over worker processes that coordinate through one file
+                with tempfile.TemporaryDirectory() as directory:
+                    state_file = os.path.join(directory, 'gemini.bucket')
+                    share = -(-args.calls // args.processes)
+                    with ProcessPoolExecutor(args.processes, mp_context=multiprocessing.get_context('spawn')) as pool:
+                        futures = [pool.submit(ratelimit_worker, server.url, state_file, rate, share,
+                                               max(1, args.threads // args.processes), args.max_concurrency)
+                                   for _ in range(args.processes)]
+                        outcomes = [future.result() for future in futures]
+                latencies = [latency for worker_latencies, _, _ in outcomes for latency in worker_latencies]
+                info = {'throttled': sum(worker_info['throttled'] for _, worker_info, _ in outcomes),
+                        'limit': [worker_info['limit'] for _, worker_info, _ in outcomes]}
+                # from the first worker's first call to the last worker's last, without start-up
+                seconds = max(span[1] for _, _, span in outcomes) - min(span[0] for _, _, span in outcomes)
+            if seconds is None:
+                seconds = time.perf_counter() - start
+            print(f'  {strategy:9s} {seconds:7.2f}s  {len(latencies) / seconds:6.2f} calls/s  '
+                  f'{server.throttled - throttled:4d} x 429  p50 {np.percentile(latencies, 50):6.2f}s  '
+                  f'p95 {np.percentile(latencies, 95):6.2f}s  {info or ""}')
+    if args.metrics:
+        print(REGISTRY.render())
+
+
+def run_sandbox_benchmark(args):
+    df = make_students(args.rows)
+    # distinct expressions so the per-worker memo in execute_code does not hide the work
+    codes = [f"df[df['math score'] > {i % 100}]['reading score'].mean()" for i in range(args.executions)]
+    print(f'{args.executions} executions on {args.rows} rows')
+    for workers in args.workers:
+        with SandboxExecutor(df, workers=workers, timeout=60) as executor:
+            start = time.perf_counter()
+            futures = [executor.submit(code) for code in codes]
+            for future in futures:
+                future.result()
+            seconds = time.perf_counter() - start
+        print(f'  {workers:3d} workers: {seconds:8.2f}s  {args.executions / seconds:8.2f} executions/s')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    suite_parser = subparsers.add_parser('suite', help='accuracy and per-stage latency over the test.ipynb questions')
+    suite_parser.add_argument('--datasets', nargs='+', choices=sorted(DATASETS), default=sorted(DATASETS))
+    suite_parser.add_argument('--rows', type=int, default=1000)
+    suite_parser.add_argument('--repeat', type=int, default=3)
+    suite_parser.add_argument('--delay', type=float, default=0.0, help='stub model latency in seconds')
+    suite_parser.add_argument('--fail-first', type=float, default=0.0,
+                              help='share of questions whose first stub answer is broken code')
+    suite_parser.add_argument('--max-attempts', type=int, default=3, help='code-generation rounds per question')
+    suite_parser.add_argument('--candidates', type=int, default=1, help='concurrent code candidates per round')
+    suite_parser.add_argument('--model', help='run against a real model instead of the stub')
+    suite_parser.add_argument('--base-url', help='Ollama URL for --model')
+    suite_parser.add_argument('--retriever-mode', default='bm25', choices=['bm25', 'embed', 'hybrid'])
+    suite_parser.add_argument('--embed-model', default='all-MiniLM-L6-v2')
+    suite_parser.add_argument('--profiles', action='store_true',
+                              help='describe retrieved columns by their profiles and use profile_template')
+    suite_parser.add_argument('--router', action='store_true',
+                              help='answer simple aggregate questions with QueryRouter before the LLM')
+    suite_parser.add_argument('--db', default='numpy', choices=['numpy', 'langchain'], help='schema index backend')
+    suite_parser.add_argument('--min-accuracy', type=float, help='exit 1 if a dataset scores below this')
+    suite_parser.add_argument('--max-overhead-ms', type=float, help='exit 1 if p95 non-LLM time exceeds this')
+    suite_parser.add_argument('--json', help='write the report to this file')
+    suite_parser.add_argument('--metrics', action='store_true', help='print the telemetry registry afterwards')
+    suite_parser.set_defaults(func=run_suite_benchmark)
+
+    retriever_parser = subparsers.add_parser('retriever', help='schema retrieval latency, NumPy index vs LangChain')
+    retriever_parser.add_argument('--mode', default='bm25', choices=['bm25', 'embed', 'hybrid'])
+    retriever_parser.add_argument('--embed-model', default='all-MiniLM-L6-v2')
+    retriever_parser.add_argument('--rows', type=int, default=1000)
+    retriever_parser.add_argument('--repeat', type=int, default=50)
+    retriever_parser.set_defaults(func=run_retriever_benchmark)
+
+    semantic_parser = subparsers.add_parser('semantic', help='semantic question cache hit rate and false hits')
+    semantic_parser.add_argument('--rows', type=int, default=1000)
+    semantic_parser.add_argument('--delay', type=float, default=0.2, help='stub model latency in seconds')
+    semantic_parser.add_argument('--threshold', type=float, default=0.9, help='minimum cosine similarity of a hit')
+    semantic_parser.add_argument('--max-entries', type=int, default=2048)
+    semantic_parser.add_argument('--max-false-hits', type=int, default=0, help='exit 1 if more hits are wrong')
+    semantic_parser.set_defaults(func=run_semantic_benchmark)
+
+    dataset_parser = subparsers.add_parser('datasets', help='many DataFrames in one DatasetRegistry under a memory budget')
+    dataset_parser.add_argument('--datasets', type=int, default=40)
+    dataset_parser.add_argument('--rows', type=int, default=50_000)
+    dataset_parser.add_argument('--questions', type=int, default=400)
+    dataset_parser.add_argument('--budget-mb', type=int, default=256)
+    dataset_parser.add_argument('--max-peak-mb', type=float,
+                                help='exit 1 if memory peaks above this before eviction (default: the budget)')
+    dataset_parser.add_argument('--skew', type=float, default=1.0, help='Zipf exponent of dataset popularity')
+    dataset_parser.add_argument('--delay', type=float, default=0.0, help='stub model latency in seconds')
+    dataset_parser.set_defaults(func=run_dataset_benchmark)
+
+    index_parser = subparsers.add_parser('indexes', help='df_index rewrites vs plain pandas: latency and identical results')
+    index_parser.add_argument('--rows', type=int, default=1_400_000)
+    index_parser.add_argument('--repeat', type=int, default=5)
+    index_parser.set_defaults(func=run_index_benchmark)
+
+    stream_parser = subparsers.add_parser('stream', help='time to first token/section of InterpAgent.stream vs invoke')
+    stream_parser.add_argument('--repeat', type=int, default=5)
+    stream_parser.add_argument('--delay', type=float, default=0.5, help='stub model latency before the first token')
+    stream_parser.add_argument('--chunk-size', type=int, default=8)
+    stream_parser.add_argument('--chunk-delay', type=float, default=0.02, help='stub model seconds per chunk')
+    stream_parser.set_defaults(func=run_stream_benchmark)
+
+    async_parser = subparsers.add_parser('async', help='invoke vs ainvoke throughput')
+    async_parser.add_argument('--questions', type=int, default=50)
+    async_parser.add_argument('--delay', type=float, default=0.5, help='stub model latency in seconds')
+    async_parser.add_argument('--concurrency', type=int, default=25)
+    async_parser.add_argument('--skip-sync', action='store_true')
+    async_parser.set_defaults(func=run_async_benchmark)
+
+    import_parser = subparsers.add_parser('imports', help='cold-start import time per module (python -X importtime)')
+    import_parser.add_argument('--modules', nargs='+', default=['model', 'retriever', 'agent', 'execute', 'sandbox'])
+    import_parser.add_argument('--cwd', default=os.path.dirname(os.path.abspath(__file__)),
+                               help='directory the modules are imported from, e.g. ../version1')
+    import_parser.add_argument('--top', type=int, default=5, help='heaviest top-level packages to list')
+    import_parser.add_argument('--budget-ms', type=float, help='exit 1 if a module takes longer to import')
+    import_parser.add_argument('--forbid-heavy', action='store_true',
+                               help='exit 1 if a module imports one of HEAVY_PACKAGES eagerly')
+    import_parser.set_defaults(func=run_import_benchmark)
+
+    ratelimit_parser = subparsers.add_parser('ratelimit', help='Gemini calls against a 429-ing quota: no limiter, '
+                                                               'caller sleeps, AdaptiveLimiter, file-shared limiter')
+    ratelimit_parser.add_argument('--strategies', nargs='+', choices=['none', 'sleep', 'adaptive', 'file'],
+                                  default=['none', 'sleep', 'adaptive', 'file'])
+    ratelimit_parser.add_argument('--calls', type=int, default=60)
+    ratelimit_parser.add_argument('--threads', type=int, default=16)
+    ratelimit_parser.add_argument('--processes', type=int, default=4, help='worker processes of the file strategy')
+    ratelimit_parser.add_argument('--quota', type=int, default=10, help='stub requests allowed per window')
+    ratelimit_parser.add_argument('--window', type=float, default=1.0, help='stub quota window in seconds')
+    ratelimit_parser.add_argument('--delay', type=float, default=0.2, help='stub model latency in seconds')
+    ratelimit_parser.add_argument('--max-concurrency', type=int, default=8)
+    ratelimit_parser.add_argument('--metrics', action='store_true', help='print the telemetry registry afterwards')
+    ratelimit_parser.set_defaults(func=run_ratelimit_benchmark)
+
+    sandbox_parser = subparsers.add_parser('sandbox', help='SandboxExecutor throughput by worker count')
+    sandbox_parser.add_argument('--rows', type=int, default=2_000_000)
+    sandbox_parser.add_argument('--executions', type=int, default=200)
+    sandbox_parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    sandbox_parser.set_defaults(func=run_sandbox_benchmark)
+
+    args = parser.parse_args()
+    args.func(args)
@@ -0,0 +1,109 @@
+import json
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+from fingerprint import dataframe_version
+from telemetry import record_cache
+
+
+# Frames longer than this are profiled on a fixed random sample; cardinality, top values and
+# min/max are then estimates, marked with "sampled" in the profile.
+MAX_PROFILE_ROWS = 200_000
+
+
+def _plain(value):
+    # numpy scalars and Timestamps -> JSON-friendly Python values
+    if pd.isna(value):
+        return None
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    return value.item() if hasattr(value, 'item') else value
+
+
+def profile_column(series, top_k=3, samples=3):
+    # One column's dtype, null rate, cardinality, min/max and most frequent values. Each
+    # statistic is a single vectorized pass over the column.
+    counts = series.value_counts(dropna=True, sort=True)
+    profile = {
+        'dtype': str(series.dtype),
+        'null_rate': round(float(series.isna().mean()), 4) if len(series) else 0.0,
+        'distinct': int(len(counts)),
+    }
+    if pd.api.types.is_bool_dtype(series):
+        profile['top'] = [_plain(value) for value in counts.index[:top_k]]
+    elif pd.api.types.is_numeric_dtype(series) or pd.api.types.is_datetime64_any_dtype(series):
+        profile['min'] = _plain(series.min())
+        profile['max'] = _plain(series.max())
+        if len(counts) <= top_k:
+            # low-cardinality codes (ratings, flags stored as ints) are best shown as values
+            profile['top'] = [_plain(value) for value in counts.index]
+    elif len(counts) and counts.iloc[0] == 1:
+        # every value is unique (names, ids): there is nothing frequent, show the format
+        profile['samples'] = [str(value) for value in counts.index[:samples]]
+    else:
+        profile['top'] = [str(value) for value in counts.index[:top_k]]
+        # a few values past the most frequent ones show what the long tail looks like
+        profile['samples'] = [str(value) for value in counts.index[top_k:top_k + samples]]
+    return profile
+
+
+def format_profile(column, profile):
+    # Compact one-line form used as retrieval context
+    fields = {'column_name': str(column), **{key: value for key, value in profile.items() if value not in ([], None)}}
+    if not fields.get('null_rate'):
+        fields.pop('null_rate', None)
+    return json.dumps(fields, ensure_ascii=False, default=str)
+
+
+# Column profiles memoized per DataFrame version (fingerprint.dataframe_version), so a frame
+# is profiled at most once until it is replaced or touched. Columns are profiled on first
+# request: a question only pays for the columns retrieval selected for it.
+class ColumnProfiles:
+    def __init__(self, top_k=3, samples=3, max_rows=MAX_PROFILE_ROWS, max_frames=8, seed=0):
+        self.top_k = top_k
+        self.samples = samples
+        self.max_rows = max_rows
+        self.max_frames = max_frames
+        self.seed = seed
+        self._frames = OrderedDict()  # dataframe_version -> {column: profile}
+        self._lock = threading.Lock()
+
+    def _frame(self, df):
+        version = dataframe_version(df)
+        with self._lock:
+            profiles = self._frames.get(version)
+            if profiles is None:
+                profiles = self._frames[version] = {}
+                while len(self._frames) > self.max_frames:
+                    self._frames.popitem(last=False)
+            else:
+                self._frames.move_to_end(version)
+        return profiles
+
+    def get(self, df, columns=None):
+        # {column: profile} for `columns` (default: all) of `df`
+        profiles = self._frame(df)
+        columns = list(df.columns) if columns is None else columns
+        missing = [column for column in columns if column not in profiles]
+        for column in columns:
+            record_cache('column_profile', column not in missing)
+        if missing:
+            sampled = len(df) > self.max_rows
+            frame = df[missing].sample(n=self.max_rows, random_state=self.seed) if sampled else df[missing]
+            for column in missing:
+                profile = profile_column(frame[column], self.top_k, self.samples)
+                if sampled:
+                    profile['sampled'] = True
+                profiles[column] = profile
+        return {column: profiles[column] for column in columns}
+
+    def describe(self, df, columns):
+        # Context lines for the given columns, in the given order; unknown names are skipped
+        known = [column for column in columns if column in df.columns]
+        return [format_profile(column, profile) for column, profile in self.get(df, known).items()]
+
+    def clear(self):
+        with self._lock:
+            self._frames.clear()
@@ -0,0 +1,361 @@
+import ast
+import copy
+import operator
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from fingerprint import dataframe_version
+from telemetry import record_cache
+
+
+# Name the rewritten expressions use for the FrameIndex of the frame they run on
+INDEX_NAME = '__frame_index__'
+MAX_INDEXED_FRAMES = 4
+MAX_GROUP_AGGREGATES = 256
+GROUP_AGGREGATES = {'mean', 'sum', 'min', 'max', 'count', 'median', 'size', 'nunique', 'std', 'var', 'first', 'last'}
+COMPARISONS = {ast.Gt: '>', ast.GtE: '>=', ast.Lt: '<', ast.LtE: '<=', ast.Eq: '=='}
+OPERATORS = {'>': operator.gt, '>=': operator.ge, '<': operator.lt, '<=': operator.le, '==': operator.eq}
+
+
+def sortable(series):
+    # numpy int/float columns; bool, unsigned, nullable and object columns keep pandas' path
+    return isinstance(series, pd.Series) and isinstance(series.dtype, np.dtype) and series.dtype.kind in 'if'
+
+
+def codable(series):
+    # object, string and categorical-of-strings columns, whose '==' with a string literal is
+    # a plain value lookup. Datetime, timedelta and period columns parse the literal
+    # ('2020-01-01' == Timestamp) and keep pandas' path.
+    if not isinstance(series, pd.Series):
+        return False
+    dtype = series.dtype
+    if isinstance(dtype, pd.CategoricalDtype):
+        dtype = dtype.categories.dtype
+    return isinstance(dtype, pd.StringDtype) or (isinstance(dtype, np.dtype) and dtype.kind == 'O')
+
+
+# Positions of the non-NaN values of one numeric column in ascending order, ties in row
+# order, so every comparison with a constant is a pair of binary searches. `missing` holds
+# the NaN positions in row order, which nsmallest/nlargest append once the values run out.
+class SortedColumn:
+    def __init__(self, series):
+        values = series.to_numpy()
+        nan = np.isnan(values) if values.dtype.kind == 'f' else np.zeros(len(values), dtype=bool)
+        positions = np.flatnonzero(~nan)
+        self.missing = np.flatnonzero(nan)
+        self.order = positions[np.argsort(values[positions], kind='stable')]
+        self.sorted = values[self.order]
+        self._descending = None
+
+    def bounds(self, op, value):
+        if self.sorted.dtype.kind == 'f':
+            # compare at the column's precision, as pandas does: 9.99 is not float32(9.99)
+            value = self.sorted.dtype.type(value)
+        left = lambda: int(np.searchsorted(self.sorted, value, 'left'))
+        right = lambda: int(np.searchsorted(self.sorted, value, 'right'))
+        n = len(self.sorted)
+        return {'>': lambda: (right(), n), '>=': lambda: (left(), n), '<': lambda: (0, left()),
+                '<=': lambda: (0, right()), '==': lambda: (left(), right())}[op]()
+
+    def descending(self):
+        # largest first, ties in row order (the order nlargest keeps them in)
+        if self._descending is None:
+            reverse = self.order[::-1]
+            values = self.sorted[::-1]
+            runs = np.concatenate([[0], np.cumsum(values[1:] != values[:-1])])
+            self._descending = reverse[np.lexsort((reverse, runs))]
+        return self._descending
+
+
+# Row positions of every value of a categorical or object column (pd.factorize codes)
+class CodeColumn:
+    def __init__(self, series):
+        codes, uniques = pd.factorize(series)
+        self.codes = {value: code for code, value in enumerate(uniques)}
+        order = np.argsort(codes, kind='stable')
+        counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+        start = int((codes < 0).sum())  # NaN rows (code -1) sort first
+        self.rows = np.split(order[start:], np.cumsum(counts)[:-1]) if len(uniques) else []
+
+    def positions(self, value):
+        code = self.codes.get(value)
+        return self.rows[code] if code is not None else np.array([], dtype=np.intp)
+
+
+# Indexes of one DataFrame version, built per column on first use: SortedColumn for numeric
+# columns, CodeColumn for object/string/categorical ones, and group-by aggregates computed once by pandas. Every
+# method returns what the pandas expression it replaces returns, and falls back to that
+# expression for columns and values it has no index for.
+class FrameIndex:
+    def __init__(self, df):
+        self.df = df
+        self._sorted = {}
+        self._codes = {}
+        self._groups = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _column(self, store, factory, column):
+        index = store.get(column)
+        record_cache('column_index', index is not None)
+        if index is None:
+            with self._lock:
+                index = store.get(column)
+                if index is None:
+                    index = store[column] = factory(self.df[column])
+        return index
+
+    def nbytes(self):
+        # Memory held by the column indexes and cached aggregates
+        total = sum(index.order.nbytes + index.sorted.nbytes + index.missing.nbytes + (index._descending.nbytes if index._descending is not None else 0)
+                    for index in list(self._sorted.values()))
+        total += sum(sum(rows.nbytes for rows in index.rows) for index in list(self._codes.values()))
+        total += sum(int(result.memory_usage(deep=True).sum()) if isinstance(result, pd.DataFrame)
+                     else int(result.memory_usage(deep=True)) for result in list(self._groups.values()))
+        return total
+
+    def sorted_column(self, column):
+        return self._column(self._sorted, SortedColumn, column)
+
+    def code_column(self, column):
+        return self._column(self._codes, CodeColumn, column)
+
+    def numeric_range(self, column, value):
+        # (SortedColumn, series) when `df[column] <op> value` can be answered by the index
+        series = self.df[column]
+        if sortable(series) and isinstance(value, (int, float)) and not isinstance(value, bool):
+            return self.sorted_column(column), series
+        return None, series
+
+    def positions(self, column, op, value):
+        # Ascending row positions where `df[column] <op> value`, or None without an index
+        index, series = self.numeric_range(column, value)
+        if index is not None:
+            start, stop = index.bounds(op, value)
+            selected = index.order[start:stop]
+            if len(selected) > len(series) // 16:
+                # wide ranges: scattering into a mask beats sorting the positions
+                mask = np.zeros(len(series), dtype=bool)
+                mask[selected] = True
+                return np.flatnonzero(mask)
+            return np.sort(selected)
+        if op == '==' and isinstance(value, str) and codable(series):
+            return self.code_column(column).positions(value)
+        return None
+
+    def filter(self, column, op, value):
+        # df[df[column] <op> value]
+        positions = self.positions(column, op, value)
+        if positions is None:
+            return self.df[OPERATORS[op](self.df[column], value)]
+        return self.df.take(positions)
+
+    def count(self, column, op, value):
+        # (df[column] <op> value).sum()
+        index, _ = self.numeric_range(column, value)
+        if index is not None:
+            start, stop = index.bounds(op, value)
+            return np.int64(stop - start)
+        positions = self.positions(column, op, value)
+        if positions is None:
+            return OPERATORS[op](self.df[column], value).sum()
+        return np.int64(len(positions))
+
+    def nsmallest(self, column, n):
+        series = self.df[column]
+        if not sortable(series):
+            return series.nsmallest(n)
+        index = self.sorted_column(column)
+        return series.take(self._top(index.order, index.missing, n))
+
+    def nlargest(self, column, n):
+        series = self.df[column]
+        if not sortable(series):
+            return series.nlargest(n)
+        index = self.sorted_column(column)
+        return series.take(self._top(index.descending(), index.missing, n))
+
+    @staticmethod
+    def _top(order, missing, n):
+        # first n positions of `order`; like pandas, NaN rows fill up an n beyond the values
+        n = max(n, 0)
+        if n <= len(order):
+            return order[:n]
+        return np.concatenate([order, missing[:n - len(order)]])
+
+    def idxmin(self, column):
+        series = self.df[column]
+        if not sortable(series) or not len(self.sorted_column(column).order):
+            return series.idxmin()
+        return series.index[self.sorted_column(column).order[0]]
+
+    def idxmax(self, column):
+        series = self.df[column]
+        if not sortable(series) or not len(self.sorted_column(column).order):
+            return series.idxmax()
+        index = self.sorted_column(column)
+        # first row holding the maximum: ties are in row order within the sorted run
+        first = np.searchsorted(index.sorted, index.sorted[-1], 'left')
+        return series.index[index.order[first]]
+
+    def group(self, by, selection, aggregate):
+        # df.groupby(by)[selection].<aggregate>(), computed once per frame version
+        key = (by, selection, aggregate)
+        with self._lock:
+            result = self._groups.get(key)
+            if result is not None:
+                self._groups.move_to_end(key)
+        record_cache('group_aggregate', result is not None)
+        if result is None:
+            # observed=False is what df.groupby(by) does today; explicit, so categorical keys
+            # do not raise pandas' FutureWarning about the default changing
+            grouped = self.df.groupby(list(by) if isinstance(by, tuple) else by, observed=False)
+            grouped = grouped[list(selection) if isinstance(selection, tuple) else selection]
+            result = getattr(grouped, aggregate)()
+            with self._lock:
+                self._groups[key] = result
+                while len(self._groups) > MAX_GROUP_AGGREGATES:
+                    self._groups.popitem(last=False)
+        # the cached aggregate must not be changed by what the expression does next
+        return result.copy()
+
+
+_indexes = OrderedDict()  # dataframe_version -> FrameIndex
+_lock = threading.Lock()
+
+
+def frame_index(df):
+    version = dataframe_version(df)
+    with _lock:
+        index = _indexes.get(version)
+        if index is not None and index.df is df:
+            _indexes.move_to_end(version)
+            return index
+        index = _indexes[version] = FrameIndex(df)
+        while len(_indexes) > MAX_INDEXED_FRAMES:
+            _indexes.popitem(last=False)
+    return index
+
+
+def drop_index(df):
+    # Forget the indexes of every version of `df`; returns the bytes they held
+    freed = 0
+    with _lock:
+        for version in [version for version, index in _indexes.items() if index.df is df]:
+            freed += _indexes.pop(version).nbytes()
+    return freed
+
+
+def index_nbytes(df):
+    with _lock:
+        indexes = [index for index in _indexes.values() if index.df is df]
+    return sum(index.nbytes() for index in indexes)
+
+
+def clear_indexes():
+    with _lock:
+        _indexes.clear()
+
+
+def _column(node):
+    # 'name' for df['name'], else None
+    if (isinstance(node, ast.Subscript) and isinstance(node.value, ast.Name) and node.value.id == 'df'
+            and isinstance(node.slice, ast.Constant) and isinstance(node.slice.value, str)):
+        return node.slice.value
+    return None
+
+
+def _constant(node):
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub) and isinstance(node.operand, ast.Constant):
+        node = ast.Constant(-node.operand.value) if isinstance(node.operand.value, (int, float)) else None
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float, str)) and not isinstance(node.value, bool):
+        return node
+    return None
+
+
+def _comparison(node):
+    # (column, op, value node) for `df['column'] <op> constant`, else None
+    if isinstance(node, ast.Compare) and len(node.ops) == 1 and type(node.ops[0]) in COMPARISONS:
+        column, value = _column(node.left), _constant(node.comparators[0])
+        if column is not None and value is not None:
+            return column, COMPARISONS[type(node.ops[0])], value
+    return None
+
+
+def _names(node):
+    # 'a' or ('a', 'b') for a string or list-of-strings literal
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return node.value
+    if isinstance(node, ast.List) and node.elts and all(isinstance(e, ast.Constant) and isinstance(e.value, str)
+                                                        for e in node.elts):
+        return tuple(e.value for e in node.elts)
+    return None
+
+
+def _call(method, *args):
+    return ast.Call(func=ast.Attribute(value=ast.Name(INDEX_NAME, ast.Load()), attr=method, ctx=ast.Load()),
+                    args=[arg if isinstance(arg, ast.AST) else ast.Constant(arg) for arg in args], keywords=[])
+
+
+# Replaces the expression shapes generated code is made of with FrameIndex calls:
+#   df[df[c] > v], df.loc[df[c] > v]       -> filter(c, '>', v)   (also >=, <, <=, ==)
+#   (df[c] > v).sum()                      -> count(c, '>', v)
+#   df[c].nsmallest(n) / .nlargest(n)      -> nsmallest / nlargest(c, n)
+#   df[c].idxmin() / .idxmax()             -> idxmin / idxmax(c)
+#   df.groupby(g)[x].mean()                -> group(g, x, 'mean')  (g, x strings or lists)
+class IndexRewriter(ast.NodeTransformer):
+    def __init__(self):
+        self.rewrites = 0
+
+    def visit_Subscript(self, node):
+        self.generic_visit(node)
+        target = node.value
+        is_frame = isinstance(target, ast.Name) and target.id == 'df'
+        is_loc = (isinstance(target, ast.Attribute) and target.attr == 'loc'
+                  and isinstance(target.value, ast.Name) and target.value.id == 'df')
+        comparison = _comparison(node.slice) if is_frame or is_loc else None
+        if comparison is None:
+            return node
+        self.rewrites += 1
+        return _call('filter', *comparison)
+
+    def visit_Call(self, node):
+        self.generic_visit(node)
+        func = node.func
+        if not isinstance(func, ast.Attribute) or node.keywords:
+            return node
+        owner, method = func.value, func.attr
+
+        if method == 'sum' and not node.args and _comparison(owner) is not None:
+            self.rewrites += 1
+            return _call('count', *_comparison(owner))
+        column = _column(owner)
+        if column is not None and method in ('nsmallest', 'nlargest') and len(node.args) == 1:
+            n = node.args[0]
+            if isinstance(n, ast.Constant) and type(n.value) is int:
+                self.rewrites += 1
+                return _call(method, column, n.value)
+        if column is not None and method in ('idxmin', 'idxmax') and not node.args:
+            self.rewrites += 1
+            return _call(method, column)
+        if method in GROUP_AGGREGATES and not node.args and isinstance(owner, ast.Subscript):
+            grouped = owner.value
+            if (isinstance(grouped, ast.Call) and isinstance(grouped.func, ast.Attribute)
+                    and grouped.func.attr == 'groupby' and isinstance(grouped.func.value, ast.Name)
+                    and grouped.func.value.id == 'df' and len(grouped.args) == 1 and not grouped.keywords):
+                by, selection = _names(grouped.args[0]), _names(owner.slice)
+                if by is not None and selection is not None:
+                    self.rewrites += 1
+                    return _call('group', by, selection, method)
+        return node
+
+
+def rewrite(tree):
+    # Code object of the indexed form of a parsed expression, or None if nothing matched
+    rewriter = IndexRewriter()
+    indexed = rewriter.visit(copy.deepcopy(tree))
+    if not rewriter.rewrites:
+        return None
+    return compile(ast.fix_missing_locations(indexed), '<generated:indexed>', 'eval')
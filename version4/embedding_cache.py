@@ -0,0 +1,188 @@
+import atexit
+import hashlib
+import json
+import os
+import threading
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+META_FILE = 'meta.json'
+INDEX_FILE = 'index.npy'
+VECTORS_FILE = 'vectors.f32'
+INDEX_DTYPE = np.dtype([('key', 'S40'), ('slot', np.int64)])
+
+
+def embedder_name(embedder):
+    for attr in ('model', 'model_name'):
+        name = getattr(embedder, attr, None)
+        if name:
+            return str(name)
+    return type(embedder).__name__
+
+
+def text_key(kind, text):
+    return hashlib.sha1(f'{kind}\x00{text}'.encode('utf-8')).hexdigest().encode('ascii')
+
+
+# Caches saved at interpreter exit; weak, so a cache the caller dropped is not kept alive
+_open_caches = weakref.WeakSet()
+
+
+@atexit.register
+def _save_open_caches():
+    for cache in list(_open_caches):
+        cache.save()
+
+
+# Content-addressed embedding store in front of any LangChain `Embeddings`.
+# Vectors live in a memory-mapped float32 matrix (one row per slot) and `index.npy` maps
+# sha1(text) -> slot in least-recently-used order. Each model gets its own sub-directory,
+# so entries are keyed on (model name, text hash). A slot freed by eviction is only reused
+# after save() has written an index without it, so a crash never leaves the saved index
+# pointing an old key at a new vector; until then new vectors go to fresh slots (up to
+# autosave_every rows beyond max_entries).
+class CachedEmbeddings(Embeddings):
+    def __init__(self, embedder, cache_dir, model_name=None, max_entries=500_000, autosave_every=4096):
+        self.embedder = embedder
+        self.model_name = model_name or embedder_name(embedder)
+        self.max_entries = max_entries
+        self.autosave_every = autosave_every
+        self.cache_dir = os.path.join(cache_dir, hashlib.sha1(self.model_name.encode('utf-8')).hexdigest()[:16])
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        self.hits = 0
+        self.misses = 0
+        self.dim = None
+        self._capacity = 0
+        self._matrix = None
+        self._slots = OrderedDict()
+        self._free = []
+        self._released = []  # evicted slots the saved index may still reference
+        self._unsaved = 0
+        self._lock = threading.RLock()
+        self._load()
+        _open_caches.add(self)
+
+    def _path(self, name):
+        return os.path.join(self.cache_dir, name)
+
+    def _load(self):
+        if not os.path.exists(self._path(META_FILE)):
+            return
+        with open(self._path(META_FILE)) as f:
+            meta = json.load(f)
+        if meta.get('model') != self.model_name:
+            return
+        self.dim = meta['dim']
+        self._capacity = meta['capacity']
+        self._open_matrix()
+        index = np.load(self._path(INDEX_FILE)) if os.path.exists(self._path(INDEX_FILE)) else np.empty(0, INDEX_DTYPE)
+        for key, slot in index[-self.max_entries:].tolist():
+            self._slots[key] = slot
+        used = set(self._slots.values())
+        self._free = [slot for slot in range(self._capacity - 1, -1, -1) if slot not in used]
+
+    def _open_matrix(self):
+        self._matrix = np.memmap(self._path(VECTORS_FILE), dtype=np.float32, mode='r+', shape=(self._capacity, self.dim))
+
+    def _grow(self, needed):
+        capacity = max(self._capacity, 1024)
+        while capacity < needed:
+            capacity *= 2
+        capacity = min(capacity, self.max_entries + self.autosave_every)
+        if capacity <= self._capacity:
+            return
+        if self._matrix is not None:
+            self._matrix.flush()
+            self._matrix = None
+        with open(self._path(VECTORS_FILE), 'ab') as f:
+            f.truncate(capacity * self.dim * 4)
+        self._free.extend(range(capacity - 1, self._capacity - 1, -1))
+        self._capacity = capacity
+        self._open_matrix()
+
+    def _allocate(self):
+        if len(self._slots) >= self.max_entries:
+            _, slot = self._slots.popitem(last=False)
+            self._released.append(slot)
+        if not self._free:
+            self._grow(self._capacity + 1)
+        if not self._free:
+            # every spare row holds an evicted vector the saved index still references
+            self.save()
+        return self._free.pop()
+
+    def _lookup(self, keys):
+        found = {}
+        with self._lock:
+            for key in keys:
+                slot = self._slots.get(key)
+                if slot is not None:
+                    self._slots.move_to_end(key)
+                    found[key] = self._matrix[slot].tolist()
+        return found
+
+    def _store(self, keys, vectors):
+        with self._lock:
+            if self.dim is None:
+                self.dim = len(vectors[0])
+            for key, vector in zip(keys, vectors):
+                if key in self._slots:
+                    continue
+                slot = self._allocate()
+                self._matrix[slot] = vector
+                self._slots[key] = slot
+            self._unsaved += len(keys)
+            if self._unsaved >= self.autosave_every:
+                self.save()
+
+    def _embed(self, kind, texts, embed_fn):
+        keys = [text_key(kind, text) for text in texts]
+        found = self._lookup(dict.fromkeys(keys))
+        missing = {key: text for key, text in zip(keys, texts) if key not in found}
+        hits = sum(1 for key in keys if key in found)
+        with self._lock:
+            self.hits += hits
+            self.misses += len(keys) - hits
+        if missing:
+            vectors = embed_fn(list(missing.values()))
+            self._store(list(missing), vectors)
+            # Serve this call from the fresh vectors: a batch larger than the cap may evict itself.
+            found.update(zip(missing, (list(map(float, vector)) for vector in vectors)))
+        return [found[key] for key in keys]
+
+    def embed_documents(self, texts):
+        return self._embed('doc', texts, self.embedder.embed_documents)
+
+    def embed_query(self, text):
+        return self._embed('query', [text], lambda texts: [self.embedder.embed_query(texts[0])])[0]
+
+    def save(self):
+        with self._lock:
+            if self._matrix is None:
+                return
+            self._matrix.flush()
+            index = np.array(list(self._slots.items()), dtype=INDEX_DTYPE)
+            tmp = self._path(INDEX_FILE + '.tmp')
+            with open(tmp, 'wb') as f:
+                np.save(f, index)
+            os.replace(tmp, self._path(INDEX_FILE))
+            with open(self._path(META_FILE), 'w') as f:
+                json.dump({'model': self.model_name, 'dim': self.dim, 'capacity': self._capacity}, f)
+            self._unsaved = 0
+            # the index on disk no longer references evicted slots
+            self._free.extend(self._released)
+            self._released.clear()
+
+    def cache_info(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._slots),
+                'max_entries': self.max_entries,
+            }
@@ -1,47 +1,234 @@
+import ast
+import copy
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
 import pandas as pd
 
-def extract_code_and_execute(answer, df):
-           
+from df_index import INDEX_NAME, frame_index, rewrite
+from fingerprint import dataframe_version
+from telemetry import REGISTRY, record_cache, span
+
+
+logger = logging.getLogger('tfm.execute')
+
+MAX_COMPILED = 512
+MAX_MEMOIZED = 1024
+MAX_MEMOIZED_ROWS = 10_000
+# Answer filters, top-n, idxmax and group-by aggregates of read-only expressions from
+# df_index's per-frame indexes instead of scanning the frame
+USE_INDEXES = True
+
+# Calls that write, print, plot, draw random numbers or read the clock: never memoized.
+IMPURE_CALLS = {
+    'pop', 'insert', 'update', 'append', 'extend', 'clear', 'setdefault', 'remove',
+    'sample', 'shuffle', 'permutation', 'now', 'today', 'print', 'exec', 'eval', 'open',
+    'plot', 'hist', 'boxplot', 'setattr', 'delattr', '__import__', 'input',
+}
+
+_compiled = OrderedDict()  # normalized code -> (code object, is expression, read-only, indexed code object)
+_results = OrderedDict()   # (dataframe version, normalized expression) -> result
+cache_stats = {'compiled_hits': 0, 'compiled_misses': 0, 'memo_hits': 0, 'memo_misses': 0}
+_lock = threading.Lock()
+
+
+def extract_code(answer):
     if "```python" not in answer:
-        print("Error: The answer does not contain a valid Python code block.") 
-        return None 
-        
-    # Extract code block
+        return None
     code_start = answer.find("```python") + 9
     code_end = answer.find("```", code_start)
-    code = answer[code_start:code_end].strip()
-    
+    return answer[code_start:code_end].strip()
+
+
+def is_read_only(tree):
+    for node in ast.walk(tree):
+        if isinstance(node, ast.NamedExpr):
+            return False
+        if isinstance(node, ast.Call):
+            func = node.func
+            name = func.attr if isinstance(func, ast.Attribute) else getattr(func, 'id', None)
+            if name in IMPURE_CALLS:
+                return False
+            if (name or '').startswith('to_') and name not in ('to_list', 'to_dict', 'to_numpy', 'to_frame', 'to_string'):
+                return False
+            for keyword in node.keywords:
+                if keyword.arg == 'inplace' and not (isinstance(keyword.value, ast.Constant) and keyword.value.value is False):
+                    return False
+        if isinstance(node, (ast.Attribute, ast.Name)) and 'random' in (getattr(node, 'attr', None) or getattr(node, 'id', '')):
+            return False
+    return True
+
+
+def parse_code(code):
+    # (expression tree or None, the source that is compiled). One-line answers are parsed as
+    # an expression and normalized with ast.unparse, so formatting differences share one
+    # cached code object. Anything else keeps the original `result = <code>` statement form.
     try:
-        # Create local namespace and execute code
-        local_dict = {'df': df, 'pd': pd}
-        code = f"result = {code}"
-        exec(code, None, local_dict)
-        return local_dict.get('result')
-                
-    except SyntaxError as syntax_error:
-        print(f"Code execution error: Invalid syntax in code: {code}\nError: {str(syntax_error)}")
-        return None 
-    
-    except Exception as code_error:
-        print(f"Code execution error: {str(code_error)}")
-        return None 
-            
+        tree = ast.parse(code, mode='eval')
+    except SyntaxError:
+        tree = None
+    return tree, ast.unparse(tree) if tree is not None else f"result = {code}"
+
+
+def compile_code(code):
+    tree, key = parse_code(code)
+
+    with _lock:
+        entry = _compiled.get(key)
+        if entry is not None:
+            _compiled.move_to_end(key)
+            cache_stats['compiled_hits'] += 1
+            record_cache('compiled_code', True)
+            return key, entry
+        cache_stats['compiled_misses'] += 1
+    record_cache('compiled_code', False)
+    if tree is not None:
+        read_only = is_read_only(tree)
+        entry = (compile(tree, '<generated>', 'eval'), True, read_only, rewrite(tree) if read_only else None)
+    else:
+        entry = (compile(key, '<generated>', 'exec'), False, False, None)
+    with _lock:
+        _compiled[key] = entry
+        if len(_compiled) > MAX_COMPILED:
+            _compiled.popitem(last=False)
+    return key, entry
+
+
+def memoizable(result):
+    if isinstance(result, (pd.DataFrame, pd.Series, pd.Index, np.ndarray, list, tuple, dict, set)):
+        return len(result) <= MAX_MEMOIZED_ROWS
+    return True
+
+
+def detach(result):
+    # Hand out copies of memoized containers so callers cannot mutate the cached value.
+    if isinstance(result, (pd.DataFrame, pd.Series, np.ndarray)):
+        return result.copy()
+    if isinstance(result, (list, dict, set)):
+        return copy.deepcopy(result)
+    return result
+
+
+def execute_code(code, df):
+    key, (code_object, is_expression, read_only, indexed) = compile_code(code)
+    memo_key = (dataframe_version(df), key) if read_only else None
+    if memo_key is not None:
+        with _lock:
+            memoized = _results.get(memo_key, _results)
+            if memoized is not _results:
+                _results.move_to_end(memo_key)
+                cache_stats['memo_hits'] += 1
+            else:
+                cache_stats['memo_misses'] += 1
+        record_cache('exec_result', memoized is not _results)
+        if memoized is not _results:
+            return detach(memoized)
+
+    # Create local namespace and execute code
+    local_dict = {'df': df, 'pd': pd}
+    if indexed is not None and USE_INDEXES:
+        local_dict[INDEX_NAME] = frame_index(df)
+        result = eval(indexed, None, local_dict)
+    elif is_expression:
+        result = eval(code_object, None, local_dict)
+    else:
+        exec(code_object, None, local_dict)
+        result = local_dict.get('result')
+
+    if memo_key is not None and memoizable(result):
+        memoized = detach(result)
+        with _lock:
+            _results[memo_key] = memoized
+            if len(_results) > MAX_MEMOIZED:
+                _results.popitem(last=False)
+    return result
+
+
+def forget_dataframe(df):
+    # Drop memoized results of every version of `df`, e.g. when it is unloaded
+    token = dataframe_version(df)[0]
+    with _lock:
+        for key in [key for key in _results if key[0][0] == token]:
+            del _results[key]
+
+
+def clear_caches():
+    with _lock:
+        _compiled.clear()
+        _results.clear()
+
+
+def run_answer(answer, df, executor=None):
+    # Returns (result, error). `error` is the text fed back to the model on a retry and
+    # None when the code ran. `executor` (e.g. sandbox.SandboxExecutor built for the same
+    # df) runs the code in a worker process instead of this one.
+    with span('exec', sandboxed=executor is not None) as attributes:
+        code = extract_code(answer)
+        if code is None:
+            record_exec_failure(attributes, 'NoCodeBlock')
+            logger.warning('answer has no python code block: %.200r', answer)
+            return None, "The answer does not contain a ```python``` code block."
+        attributes['code_chars'] = len(code)
+
+        try:
+            if executor is not None:
+                result = executor.run(code)
+            else:
+                result = execute_code(code, df)
+
+        except SyntaxError as syntax_error:
+            record_exec_failure(attributes, type(syntax_error).__name__)
+            logger.warning('generated code has invalid syntax: %s\n%s', syntax_error, parse_code(code)[1])
+            return None, f"SyntaxError: {syntax_error}"
+
+        except Exception as code_error:
+            record_exec_failure(attributes, type(code_error).__name__)
+            logger.warning('generated code raised %s: %s\n%s', type(code_error).__name__, code_error, parse_code(code)[1])
+            return None, f"{type(code_error).__name__}: {code_error}"
+
+        if result is None:
+            record_exec_failure(attributes, 'NoResult')
+            return None, "The code ran but produced no result (None)."
+        return result, None
+
+
+def extract_code_and_execute(answer, df, executor=None):
+    return run_answer(answer, df, executor)[0]
+
+
+def record_exec_failure(attributes, error):
+    attributes['error'] = error
+    REGISTRY.inc('exec_failures_total', 1, 'Generated code that failed to run, by exception type', error=error)
+
+
+SECTION_HEADERS = [
+    '**The question:**',
+    '**The relative result:**',
+    '**The concluding response:**'
+]
+
+
+def format_section(section):
+    for header in SECTION_HEADERS:
+        if header in section:
+            return section.replace(header, f'\n{header}').strip()
+    return section.strip()
+
+
 def format_llm_output(output: str) -> str:
+    return '\n\n'.join(format_section(section) for section in output.split('\n\n'))
+
 
-    sections = output.split('\n\n')   
-    formatted_output = []
-    headers = [
-        '**The question:**',
-        '**The relative result:**',
-        '**The concluding response:**'
-    ]
-
-    for section in sections:
-        for header in headers:
-            if header in section:
-                formatted_output.append(section.replace(header, f'\n{header}').strip())
-                break
-        else:
-            formatted_output.append(section.strip())
-    
-    return '\n\n'.join(formatted_output)
\ No newline at end of file
+def iter_formatted_sections(chunks):
+    # Streaming counterpart of format_llm_output: a section is formatted and yielded as soon
+    # as the blank line that closes it arrives. '\n\n'.join of the yielded sections equals
+    # format_llm_output of the full text.
+    buffer = ''
+    for chunk in chunks:
+        buffer += chunk
+        *sections, buffer = buffer.split('\n\n')
+        for section in sections:
+            yield format_section(section)
+    yield format_section(buffer)
@@ -0,0 +1,46 @@
+import functools
+import hashlib
+import itertools
+import weakref
+
+
+# str() of a dtype is slow next to everything else on the retrieval path, and frames reuse
+# a handful of dtype objects
+dtype_name = functools.lru_cache(maxsize=256)(str)
+
+
+def schema_of(df):
+    # Ordered (column name, dtype) pairs, the part of a frame the schema index depends on.
+    return tuple(zip(map(str, df.columns), map(dtype_name, df.dtypes.tolist())))
+
+
+def schema_fingerprint(df):
+    digest = hashlib.sha1()
+    for col, dtype in schema_of(df):
+        digest.update(f'{col}\x1f{dtype}\x1e'.encode('utf-8'))
+    return digest.hexdigest()
+
+
+_tokens = itertools.count()
+_versions = {}  # id(df) -> [token, edit counter]
+
+
+def _forget(key):
+    _versions.pop(key, None)
+
+
+def dataframe_version(df):
+    # Cheap version key for memoizing results computed from `df`. It changes when the frame
+    # object is replaced, reshaped or retyped; in-place value edits must call touch_dataframe.
+    key = id(df)
+    state = _versions.get(key)
+    if state is None:
+        state = _versions[key] = [next(_tokens), 0]
+        weakref.finalize(df, _forget, key)
+    return (state[0], state[1], df.shape, schema_of(df))
+
+
+def touch_dataframe(df):
+    # Mark `df` as modified in place so results memoized for it are no longer used.
+    dataframe_version(df)
+    _versions[id(df)][1] += 1
@@ -0,0 +1,46 @@
+import importlib
+import threading
+
+
+# Name -> "module" or "module:attribute" table whose entries are imported on first use,
+# so a process only pays for the providers and backends it actually selects.
+class LazyRegistry:
+    def __init__(self, kind, entries=None):
+        self.kind = kind
+        self._targets = dict(entries or {})
+        self._loaded = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, target):
+        # `target` is an import path string or an already imported object
+        with self._lock:
+            self._targets[name] = target
+            self._loaded.pop(name, None)
+
+    def names(self):
+        return list(self._targets)
+
+    def __contains__(self, name):
+        return name in self._targets
+
+    def __getitem__(self, name):
+        loaded = self._loaded.get(name)
+        if loaded is not None:
+            return loaded
+        try:
+            target = self._targets[name]
+        except KeyError:
+            raise ValueError(f'Unsupported {self.kind}: {name}. Available: {", ".join(self._targets)}') from None
+        if isinstance(target, str):
+            module_name, _, attribute = target.partition(':')
+            try:
+                loaded = importlib.import_module(module_name)
+            except ImportError as e:
+                raise ImportError(f'{self.kind} {name!r} needs {module_name}: {e}') from e
+            if attribute:
+                loaded = getattr(loaded, attribute)
+        else:
+            loaded = target
+        with self._lock:
+            self._loaded[name] = loaded
+        return loaded
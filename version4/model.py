@@ -1,62 +1,189 @@
 import time
-import vertexai
-from langchain_ollama import OllamaLLM
 from tenacity import retry, stop_after_attempt, wait_random_exponential
-from vertexai.preview.generative_models import GenerationConfig, GenerativeModel, HarmCategory, HarmBlockThreshold
+
+from lazy import LazyRegistry
+from rate_limit import alimited, is_quota_error, limited, shared_limiter
+from telemetry import REGISTRY, record_text, span
 
 
 PROJECT_ID = "GCP_PROJECT_ID"
 LOCATION = "GCP_LOCATION"
 
+# Provider SDKs are imported by the first Model that uses them, so an Ollama-only process
+# never loads vertexai.
+PROVIDERS = LazyRegistry('provider', {
+    'ollama': 'langchain_ollama:OllamaLLM',
+    'vertexai': 'vertexai',
+    'google': 'vertexai.preview.generative_models',
+})
+
+BACKOFF = wait_random_exponential(min=1, max=60)
+
+
+def wait_for_retry(retry_state):
+    # A 429 seen by a limiter has already paused it for every caller, so the retry just
+    # queues behind that; other errors (and 429s without a limiter) back off exponentially
+    error = retry_state.outcome.exception()
+    if retry_state.kwargs.get('limiter') is not None and is_quota_error(error):
+        return 0
+    return BACKOFF(retry_state)
+
 
 class Model:
-    def __init__(self, model_name):
+    # `limiter` (a rate_limit.AdaptiveLimiter) admits every Gemini call; without one, a
+    # `rate_limit_per_minute` keyword uses the process-wide limiter of this model name.
+    def __init__(self, model_name, base_url=None, limiter=None):
         #'google' or 'vertex' or 'llama'.
         self.model_name = model_name
+        self.limiter = limiter
         
         # Gemini models
         if 'gemini' in model_name:
             self.provider = "google"
-            vertexai.init(project=PROJECT_ID, location=LOCATION)
-            self.client = GenerativeModel(model_name)
+            PROVIDERS['vertexai'].init(project=PROJECT_ID, location=LOCATION)
+            self.client = PROVIDERS['google'].GenerativeModel(model_name)
         else:
             self.provider = 'ollama'
-            self.llm = OllamaLLM(model=model_name)
+            # base_url=None keeps the client default (OLLAMA_HOST or localhost:11434)
+            self.llm = PROVIDERS['ollama'](model=model_name, base_url=base_url)
 
     def invoke(self, prompt, **kwargs):
         if not prompt:
             return 'Contents must not be empty.'
-        if self.provider == 'ollama':
-            return self.llm.invoke(prompt, **kwargs)  
-        elif self.provider == "google":
-            return self.query_gemini(prompt, **kwargs)
-        else:
-            raise ValueError(f'Unsupported provider: {self.provider}')
+        with span('llm', provider=self.provider, model=self.model_name) as attributes:
+            attributes['prompt_chars'] = record_text('llm', 'prompt', prompt)
+            if self.provider == 'ollama':
+                response = self.llm.invoke(prompt, **kwargs)  
+            elif self.provider == "google":
+                response = self.query_gemini(prompt, **kwargs)
+            else:
+                raise ValueError(f'Unsupported provider: {self.provider}')
+            attributes['response_chars'] = record_text('llm', 'response', response)
+        return response
 
-    @retry(wait=wait_random_exponential(min=1, max=60), stop=stop_after_attempt(10))
-    def query_gemini_with_retry(self, prompt, generation_config):
-        safety_config = {
+    async def ainvoke(self, prompt, **kwargs):
+        if not prompt:
+            return 'Contents must not be empty.'
+        with span('llm', provider=self.provider, model=self.model_name) as attributes:
+            attributes['prompt_chars'] = record_text('llm', 'prompt', prompt)
+            if self.provider == 'ollama':
+                response = await self.llm.ainvoke(prompt, **kwargs)
+            elif self.provider == "google":
+                response = await self.aquery_gemini(prompt, **kwargs)
+            else:
+                raise ValueError(f'Unsupported provider: {self.provider}')
+            attributes['response_chars'] = record_text('llm', 'response', response)
+        return response
+
+    def stream(self, prompt, **kwargs):
+        # Yields the response text as the provider produces it
+        if not prompt:
+            yield 'Contents must not be empty.'
+            return
+        with span('llm', provider=self.provider, model=self.model_name, streamed=True) as attributes:
+            attributes['prompt_chars'] = record_text('llm', 'prompt', prompt)
+            start = time.perf_counter()
+            if self.provider == 'ollama':
+                chunks = self.llm.stream(prompt, **kwargs)
+            elif self.provider == "google":
+                chunks = self.stream_gemini(prompt, **kwargs)
+            else:
+                raise ValueError(f'Unsupported provider: {self.provider}')
+            size = 0
+            for chunk in chunks:
+                if not chunk:
+                    continue
+                if size == 0:
+                    attributes['ttft'] = time.perf_counter() - start
+                    REGISTRY.observe('ttft_seconds', attributes['ttft'], 'Time from request to first streamed token', provider=self.provider)
+                size += record_text('llm', 'response', chunk)
+                yield chunk
+            attributes['response_chars'] = size
+
+    @staticmethod
+    def safety_config():
+        HarmCategory = PROVIDERS['google'].HarmCategory
+        HarmBlockThreshold = PROVIDERS['google'].HarmBlockThreshold
+        return {
             HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
             HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
             HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
             HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
         }
-        response = self.client.generate_content(prompt, generation_config=generation_config, safety_settings=safety_config)
+
+    @staticmethod
+    def response_text(response):
         try:
-            response_text = response.text
+            return response.text
         except Exception as e:
-            response_text = str(e)
-        return response_text
+            return str(e)
 
-    def query_gemini(self, prompt, rate_limit_per_minute = None, **kwargs):
-        generation_config = GenerationConfig(
+    @retry(wait=wait_for_retry, stop=stop_after_attempt(10))
+    def query_gemini_with_retry(self, prompt, generation_config, limiter=None):
+        with limited(limiter):
+            response = self.client.generate_content(prompt, generation_config=generation_config, safety_settings=self.safety_config())
+        return self.response_text(response)
+
+    # Only opening the stream is retried: once text has reached the caller, a failure
+    # propagates instead of restarting the answer. The limiter slot is held until the
+    # stream ends, so stream_gemini gets its start time to release it.
+    @retry(wait=wait_for_retry, stop=stop_after_attempt(10))
+    def open_gemini_stream(self, prompt, generation_config, limiter=None):
+        started = limiter.acquire() if limiter is not None else None
+        try:
+            responses = iter(self.client.generate_content(prompt, generation_config=generation_config,
+                                                          safety_settings=self.safety_config(), stream=True))
+            return next(responses, None), responses, started
+        except Exception as e:
+            if limiter is not None:
+                limiter.release(started, e)
+            raise
+
+    # tenacity's retry awaits coroutine functions and backs off with asyncio.sleep
+    @retry(wait=wait_for_retry, stop=stop_after_attempt(10))
+    async def aquery_gemini_with_retry(self, prompt, generation_config, limiter=None):
+        async with alimited(limiter):
+            response = await self.client.generate_content_async(prompt, generation_config=generation_config, safety_settings=self.safety_config())
+        return self.response_text(response)
+
+    @staticmethod
+    def generation_config(**kwargs):
+        return PROVIDERS['google'].GenerationConfig(
             stop_sequences=kwargs.get('stop', []),
             temperature=kwargs.get('temperature'),
             top_p=kwargs.get('top_p'),
         )
-        if rate_limit_per_minute:
-            time.sleep(60 / rate_limit_per_minute)
-        return self.query_gemini_with_retry(prompt, generation_config=generation_config)
+
+    def gemini_limiter(self, rate_limit_per_minute=None):
+        if self.limiter is None and rate_limit_per_minute:
+            return shared_limiter(self.model_name, rate_limit_per_minute)
+        return self.limiter
+
+    def query_gemini(self, prompt, rate_limit_per_minute = None, **kwargs):
+        return self.query_gemini_with_retry(prompt, generation_config=self.generation_config(**kwargs),
+                                            limiter=self.gemini_limiter(rate_limit_per_minute))
+
+    def stream_gemini(self, prompt, rate_limit_per_minute = None, **kwargs):
+        limiter = self.gemini_limiter(rate_limit_per_minute)
+        first, responses, started = self.open_gemini_stream(prompt, generation_config=self.generation_config(**kwargs),
+                                                            limiter=limiter)
+        error = None
+        try:
+            if first is None:
+                return
+            yield self.response_text(first)
+            for response in responses:
+                yield self.response_text(response)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            if limiter is not None:
+                limiter.release(started, error)
+
+    async def aquery_gemini(self, prompt, rate_limit_per_minute = None, **kwargs):
+        return await self.aquery_gemini_with_retry(prompt, generation_config=self.generation_config(**kwargs),
+                                                   limiter=self.gemini_limiter(rate_limit_per_minute))
 
     
 
@@ -163,6 +163,53 @@ combined_template = """You are a pandas dataframe query code generator. The name
               ```
               """
 
+# For Retriever(column_profiles=...): the context profiles each relevant column, so the
+# model can use real category values and ranges instead of being told it has none.
+profile_template = """You are a pandas dataframe query code generator. The name of the dataframe is `df`. Your task is to answer the question with pandas dataframe operation code.
+
+              The question is: {question}
+              The context is: {context}
+
+              **About the context:**
+              Each entry profiles one relevant column: column_name, dtype, null_rate (omitted when there are no nulls), distinct (number of distinct values), min/max for numeric and date columns, top (most frequent values) and samples (other values).
+              Values listed in top/samples are spelled exactly as in `df`, so you may filter on them, e.g. df[df['test preparation course'] == 'completed']. A column with more distinct values than listed may hold others: when the question needs one you cannot see, group by the column instead of guessing a literal.
+
+              **Thinking Process:**
+              1. Identify the key information needed to answer the question.
+              2. Choose the columns from the context; if the question's words differ from the column names, use the semantically closest column.
+              3. Pick an operation that suits the dtypes, e.g. mean()/max() on numeric columns, groupby() or value_counts() on object columns, and handle nulls if null_rate is shown.
+              4. If the question refers to a total or comprehensive value of several columns, aggregate them, e.g. df[['reading score', 'writing score', 'math score']].sum(axis=1).max().
+              5. If no single value answers the question, return code that selects the detailed rows, e.g. df.iloc[df['reading score'].idxmax()].
+
+              **Example:**
+                 Question: "If students who completed preparation have a better writing score?"
+                 Context: {{"column_name": "test preparation course", "dtype": "object", "distinct": 2, "top": ["none", "completed"]}}, {{"column_name": "writing score", "dtype": "int64", "distinct": 101, "min": 0, "max": 100}}
+                 Answer:
+                 ```python
+                 df.groupby('test preparation course')['writing score'].mean()
+                 ```
+
+              Rules:
+                1. Ensure that the generated code is syntactically correct and complete, including all necessary parentheses and syntax.
+                2. Just return one line of executable code in ```python``` block using the existing `df`, and don't include any explanations or additional text.
+
+              **Answer:**
+              ```python
+              [write your pandas operation code here]
+              ```
+              """
+
+# Appended to the code prompt when the previous attempt failed, so the model sees why
+retry_feedback_template = """
+              **Previous Attempt:**
+              Your previous answer failed. Do not repeat it.
+              ```python
+              {code}
+              ```
+              Error: {error}
+              Fix the error, then return the corrected code in ```python``` block.
+              """
+
 interp_template ="""
       You are an information analysis and summary assistant.
       Your task is to provide a concluding and logical response according to the question and the relative result.
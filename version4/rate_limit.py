@@ -0,0 +1,288 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager, nullcontext
+
+from telemetry import REGISTRY
+
+try:
+    import fcntl
+except ImportError:  # Windows: FileTokenBucket is unavailable, TokenBucket still works
+    fcntl = None
+
+
+# Seconds an async caller sleeps between checks while every concurrency slot is taken
+POLL_SECONDS = 0.01
+
+
+def is_quota_error(error):
+    # 429 / RESOURCE_EXHAUSTED from google.api_core, HTTP clients or the stub server,
+    # recognized without importing any of them
+    if type(error).__name__ in ('ResourceExhausted', 'TooManyRequests'):
+        return True
+    return 429 in (getattr(error, 'code', None), getattr(error, 'status_code', None))
+
+
+# `rate` tokens per second, bursts up to `capacity`, for the threads of one process.
+# take() never blocks: it returns the seconds to wait, so sync and async callers can share it.
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        if rate <= 0:
+            raise ValueError('rate must be positive')
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def take(self, tokens=1.0):
+        # 0.0 when the tokens were taken, else seconds until they can be
+        with self._lock:
+            now = time.monotonic()
+            if now < self._paused_until:
+                return self._paused_until - now
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0.0
+            return (tokens - self._tokens) / self.rate
+
+    def pause(self, seconds):
+        # hand out nothing for `seconds`, e.g. after the provider answered 429
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0.0
+
+
+# TokenBucket whose state lives in a small JSON file under an exclusive flock, so every
+# worker process pointed at the same path shares one rate and one 429 pause. Uses wall-clock
+# time, as monotonic clocks are not comparable across processes.
+class FileTokenBucket:
+    def __init__(self, path, rate, capacity=None):
+        if fcntl is None:
+            raise RuntimeError('FileTokenBucket needs fcntl (POSIX)')
+        if rate <= 0:
+            raise ValueError('rate must be positive')
+        self.path = os.fspath(path)
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._lock = threading.Lock()  # flock is per open file, threads still need this
+
+    @contextmanager
+    def _state(self):
+        with self._lock, open(self.path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            try:
+                state = json.loads(f.read() or '{}')
+            except ValueError:
+                state = {}
+            now = time.time()
+            state.setdefault('tokens', self.capacity)
+            state.setdefault('updated', now)
+            state.setdefault('paused_until', 0.0)
+            yield state, now
+            f.seek(0)
+            f.truncate()
+            f.write(json.dumps(state))
+            f.flush()
+
+    def take(self, tokens=1.0):
+        with self._state() as (state, now):
+            if now < state['paused_until']:
+                return state['paused_until'] - now
+            state['tokens'] = min(self.capacity, state['tokens'] + max(0.0, now - state['updated']) * self.rate)
+            state['updated'] = now
+            if state['tokens'] >= tokens:
+                state['tokens'] -= tokens
+                return 0.0
+            return (tokens - state['tokens']) / self.rate
+
+    def pause(self, seconds):
+        with self._state() as (state, now):
+            state['paused_until'] = max(state['paused_until'], now + seconds)
+            state['tokens'] = 0.0
+
+
+# Admits provider calls through a token bucket and an adaptive concurrency limit. The limit
+# grows by `increase` per limit's worth of successful calls and is multiplied by `decrease`
+# on a 429 (AIMD) or, with target_latency set, by `slow_decrease` on a call slower than that.
+# Only calls started after the last decrease can decrease it again, so one burst of 429s
+# cuts it once. Such a cut on a 429 also pauses the bucket, for `backoff` seconds doubling per
+# consecutive cut up to max_backoff; with a FileTokenBucket the pause holds for every process.
+class AdaptiveLimiter:
+    def __init__(self, bucket, max_concurrency=8, min_concurrency=1, increase=1.0, decrease=0.5,
+                 target_latency=None, slow_decrease=0.9, backoff=1.0, max_backoff=60.0, name='gemini'):
+        self.bucket = bucket
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.increase = increase
+        self.decrease = decrease
+        self.target_latency = target_latency
+        self.slow_decrease = slow_decrease
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.name = name
+        self.limit = float(max_concurrency)
+        self.in_flight = 0
+        self.waiting = 0
+        self.stats = {'calls': 0, 'throttled': 0, 'slow': 0, 'errors': 0, 'wait_seconds': 0.0}
+        self._streak = 0  # consecutive 429s
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def _try_acquire(self):
+        # called with self._cond held: 0.0 when admitted, else seconds to wait (None: a slot)
+        if self.in_flight >= max(self.min_concurrency, int(self.limit)):
+            return None
+        delay = self.bucket.take()
+        if delay == 0.0:
+            self.in_flight += 1
+        return delay
+
+    def _queued(self, change):
+        self.waiting += change
+        REGISTRY.set('rate_limit_queue_depth', self.waiting, 'Calls waiting for the rate limiter', limiter=self.name)
+
+    def _admitted(self, start):
+        waited = time.monotonic() - start
+        self.stats['wait_seconds'] += waited
+        REGISTRY.observe('rate_limit_wait_seconds', waited, 'Time calls waited in the rate limiter', limiter=self.name)
+        REGISTRY.set('rate_limit_in_flight', self.in_flight, 'Calls admitted and not yet finished', limiter=self.name)
+        return time.monotonic()
+
+    def acquire(self):
+        # Blocks until the call may start; returns the start time release() needs
+        start = time.monotonic()
+        with self._cond:
+            self._queued(1)
+            try:
+                while True:
+                    delay = self._try_acquire()
+                    if delay == 0.0:
+                        break
+                    self._cond.wait(delay)
+            finally:
+                self._queued(-1)
+            return self._admitted(start)
+
+    async def aacquire(self):
+        # acquire() that sleeps on the event loop instead of blocking it
+        start = time.monotonic()
+        with self._cond:
+            self._queued(1)
+        try:
+            while True:
+                with self._cond:
+                    delay = self._try_acquire()
+                    if delay == 0.0:
+                        return self._admitted(start)
+                await asyncio.sleep(POLL_SECONDS if delay is None else delay)
+        finally:
+            with self._cond:
+                self._queued(-1)
+
+    def release(self, started, error=None):
+        # Ends a call admitted at `started`, adjusting the limit from its outcome
+        latency = time.monotonic() - started
+        with self._cond:
+            self.in_flight -= 1
+            self.stats['calls'] += 1
+            if error is not None and is_quota_error(error):
+                outcome = 'throttled'
+                self.stats['throttled'] += 1
+                if self._cut(started, self.decrease):
+                    self._streak += 1
+                    self.bucket.pause(min(self.max_backoff, self.backoff * 2 ** (self._streak - 1)))
+            elif error is not None:
+                outcome = 'error'
+                self.stats['errors'] += 1
+            elif self.target_latency is not None and latency > self.target_latency:
+                outcome = 'slow'
+                self.stats['slow'] += 1
+                self._streak = 0
+                self._cut(started, self.slow_decrease)
+            else:
+                outcome = 'ok'
+                self._streak = 0
+                self.limit = min(self.max_concurrency, self.limit + self.increase / max(self.limit, 1.0))
+            REGISTRY.set('rate_limit_concurrency', self.limit, 'Adaptive concurrency limit', limiter=self.name)
+            REGISTRY.set('rate_limit_in_flight', self.in_flight, 'Calls admitted and not yet finished', limiter=self.name)
+            self._cond.notify_all()
+        REGISTRY.inc('rate_limit_calls_total', 1, 'Rate-limited calls by outcome', limiter=self.name, outcome=outcome)
+        REGISTRY.observe('rate_limit_call_seconds', latency, 'Latency of rate-limited calls', limiter=self.name)
+
+    def _cut(self, started, factor):
+        # True when this call decreased the limit, False when an earlier decrease covers it
+        if started < self._last_decrease:
+            return False
+        self.limit = max(float(self.min_concurrency), self.limit * factor)
+        self._last_decrease = time.monotonic()
+        return True
+
+    @contextmanager
+    def slot(self):
+        started = self.acquire()
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self.release(started, error)
+
+    @asynccontextmanager
+    async def aslot(self):
+        started = await self.aacquire()
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self.release(started, error)
+
+    def info(self):
+        with self._cond:
+            return {**self.stats, 'wait_seconds': round(self.stats['wait_seconds'], 3), 'limit': round(self.limit, 2),
+                    'in_flight': self.in_flight, 'waiting': self.waiting}
+
+
+def limited(limiter):
+    return limiter.slot() if limiter is not None else nullcontext()
+
+
+def alimited(limiter):
+    return limiter.aslot() if limiter is not None else nullcontext()
+
+
+_LIMITERS = {}
+_LIMITERS_LOCK = threading.Lock()
+
+
+def shared_limiter(name, rate_per_minute, state_file=None, burst=1, **kwargs):
+    # The process-wide limiter for `name` (e.g. a Gemini model), created on first use with
+    # rate_per_minute; state_file makes its bucket a FileTokenBucket shared across processes.
+    # A burst of 1 spaces calls evenly, which a provider's fixed quota window never sees as
+    # more than the rate. kwargs go to AdaptiveLimiter. Asking again for `name` with another
+    # rate, burst or state_file raises ValueError instead of returning a limiter that ignores them.
+    rate = rate_per_minute / 60
+    path = os.fspath(state_file) if state_file else None
+    with _LIMITERS_LOCK:
+        limiter = _LIMITERS.get(name)
+        if limiter is None:
+            bucket = FileTokenBucket(path, rate, burst) if path else TokenBucket(rate, burst)
+            limiter = _LIMITERS[name] = AdaptiveLimiter(bucket, name=name, **kwargs)
+            return limiter
+        bucket = limiter.bucket
+        if (bucket.rate, bucket.capacity, getattr(bucket, 'path', None)) != (rate, burst, path):
+            raise ValueError(f'Limiter {name} already exists with {bucket.rate * 60:g}/min, burst {bucket.capacity:g}, '
+                             f'state_file {getattr(bucket, "path", None)}; asked for {rate_per_minute:g}/min, '
+                             f'burst {burst:g}, state_file {path}')
+        return limiter
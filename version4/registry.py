@@ -0,0 +1,214 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+
+from agent import RAGAgent
+from df_index import drop_index, index_nbytes
+from execute import forget_dataframe
+from fingerprint import schema_fingerprint
+from lazy import LazyRegistry
+from telemetry import REGISTRY
+
+
+logger = logging.getLogger('tfm.registry')
+
+# Loaders that need another package of the repository (run with the repository root on
+# sys.path) are imported on first use
+LOADERS = LazyRegistry('dataset loader', {
+    'amazon': 'version2.raw_data.data_loader:load_amazon_data',
+})
+
+
+def frame_nbytes(df):
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+class Dataset:
+    def __init__(self, name, loader):
+        self.name = name
+        self.loader = loader
+        self.df = None
+        self.agent = None
+        self.nbytes = 0
+        # bytes expected on the next load: frame plus indexes when last unloaded, before that
+        # the CSV file size (an underestimate for text columns) or 0 when nothing is known
+        self.estimate = 0
+        self.loads = 0
+        self.lock = threading.Lock()  # held while loading, so a frame is loaded once
+
+
+# Serves many DataFrames from one process with one Model, one Retriever (and so one
+# embedder and one schema index cache) and per-dataset RAGAgents. Frames are loaded on first
+# use; when frames plus their df_index indexes exceed `memory_budget` bytes, the least
+# recently used datasets are unloaded together with their indexes, memoized results and
+# schema index, and are loaded again on their next question. Before a load, datasets are
+# unloaded until its estimated size fits as well: its size when last unloaded, else the
+# mean size of the frames loaded so far, else its CSV file size.
+# The budget is soft. A first load larger than its estimate and the column indexes a
+# question builds can exceed it until the eviction that follows the question;
+# stats['peak_bytes'] records the highest total seen, including that overshoot.
+class DatasetRegistry:
+    def __init__(self, model, retriever, prompt, memory_budget=2 * 1024 ** 3, **agent_kwargs):
+        self.model = model
+        self.retriever = retriever
+        self.prompt = prompt
+        self.memory_budget = memory_budget
+        # passed to every RAGAgent, e.g. max_attempts, candidates, semantic_cache, router
+        self.agent_kwargs = agent_kwargs
+        self._datasets = {}
+        self._loaded = OrderedDict()  # name -> Dataset, least recently used first
+        self._lock = threading.Lock()
+        self.stats = {'loads': 0, 'evictions': 0, 'load_seconds': 0.0, 'peak_bytes': 0}
+        self._over_budget = None  # dataset last warned about, to warn once per load
+        self._loaded_bytes = 0  # frame bytes summed over every load, for first-load estimates
+
+    def register(self, name, source, **kwargs):
+        # `source` is a CSV path (kwargs go to pd.read_csv), a LOADERS name such as
+        # 'amazon' (kwargs go to its loader) or a callable returning a DataFrame
+        if callable(source):
+            loader = lambda: source(**kwargs)
+        elif source in LOADERS:
+            loader = lambda: LOADERS[source](**kwargs)
+        elif isinstance(source, (str, os.PathLike)):
+            loader = lambda: pd.read_csv(source, **kwargs)
+        else:
+            raise ValueError(f'Unsupported dataset source for {name}: {source!r}')
+        dataset = Dataset(name, loader)
+        if isinstance(source, (str, os.PathLike)) and source not in LOADERS:
+            try:
+                dataset.estimate = os.path.getsize(source)
+            except OSError:
+                pass
+        with self._lock:
+            if name in self._loaded:
+                replaced = self._loaded.pop(name)
+                with replaced.lock:
+                    self._unload(replaced)
+            self._datasets[name] = dataset
+            # one schema index per dataset must fit next to the others
+            self.retriever.max_cached_schemas = max(self.retriever.max_cached_schemas, len(self._datasets))
+            profiles = getattr(self.retriever, 'column_profiles', None)
+            if profiles is not None:
+                profiles.max_frames = max(profiles.max_frames, len(self._datasets))
+
+    def names(self):
+        return list(self._datasets)
+
+    def load(self, name):
+        # (df, agent) of a dataset, loading it if needed. Taken together under the lock, so
+        # an eviction by another thread cannot hand out one without the other.
+        try:
+            dataset = self._datasets[name]
+        except KeyError:
+            raise KeyError(f'Unknown dataset: {name}. Registered: {", ".join(self._datasets)}') from None
+        with self._lock:
+            if name in self._loaded:
+                self._loaded.move_to_end(name)
+                return dataset.df, dataset.agent
+            # make room first, so the frame is not loaded on top of a full budget
+            self._enforce_budget(keep=name, reserve=self._estimate(dataset))
+        with dataset.lock:
+            if dataset.df is None:
+                self._load(dataset)
+            resident = dataset.df, dataset.agent
+        with self._lock:
+            self._loaded[name] = dataset
+            self._loaded.move_to_end(name)
+            self._enforce_budget(keep=name)
+        return resident
+
+    def _estimate(self, dataset):
+        # called with self._lock held
+        if dataset.loads == 0 and self.stats['loads']:
+            return max(dataset.estimate, self._loaded_bytes // self.stats['loads'])
+        return dataset.estimate
+
+    def _load(self, dataset):
+        start = time.perf_counter()
+        df = dataset.loader()
+        seconds = time.perf_counter() - start
+        dataset.df = df
+        dataset.nbytes = frame_nbytes(df)
+        dataset.agent = RAGAgent(self.retriever, self.prompt, self.model, df, **self.agent_kwargs)
+        dataset.loads += 1
+        self.stats['loads'] += 1
+        self._loaded_bytes += dataset.nbytes
+        self.stats['load_seconds'] += seconds
+        REGISTRY.inc('dataset_loads_total', 1, 'DataFrames loaded by the dataset registry', dataset=dataset.name)
+        REGISTRY.observe('dataset_load_seconds', seconds, 'Time to load a dataset', dataset=dataset.name)
+        logger.info('loaded dataset %s: %d rows, %.1f MiB in %.2fs',
+                    dataset.name, len(df), dataset.nbytes / 2 ** 20, seconds)
+
+    def _unload(self, dataset):
+        df = dataset.df
+        drop_index(df)
+        forget_dataframe(df)
+        fingerprint = schema_fingerprint(df)
+        if not any(schema_fingerprint(other.df) == fingerprint for other in self._loaded.values() if other is not dataset):
+            self.retriever.forget_schema(df)
+        dataset.estimate = dataset.nbytes + index_nbytes(df)
+        dataset.df = None
+        dataset.agent = None
+        dataset.nbytes = 0
+
+    def memory_usage(self):
+        # bytes per loaded dataset: frame plus its column indexes
+        with self._lock:
+            loaded = list(self._loaded.values())
+        return {dataset.name: dataset.nbytes + index_nbytes(dataset.df) for dataset in loaded if dataset.df is not None}
+
+    def _enforce_budget(self, keep, reserve=0):
+        # called with self._lock held; never unloads `keep`, the dataset about to be used.
+        # Unloads until the loaded datasets plus `reserve` bytes about to be loaded fit.
+        usage = {name: dataset.nbytes + index_nbytes(dataset.df) for name, dataset in self._loaded.items()}
+        total = sum(usage.values())
+        self.stats['peak_bytes'] = max(self.stats['peak_bytes'], total)
+        for name in list(self._loaded):
+            if total + reserve <= self.memory_budget:
+                break
+            if name == keep:
+                continue
+            dataset = self._loaded.pop(name)
+            with dataset.lock:
+                self._unload(dataset)
+            total -= usage[name]
+            self.stats['evictions'] += 1
+            REGISTRY.inc('dataset_evictions_total', 1, 'Datasets unloaded to stay within the memory budget', dataset=name)
+            logger.info('evicted dataset %s (%.1f MiB)', name, usage[name] / 2 ** 20)
+        if total + reserve > self.memory_budget and self._over_budget != keep:
+            self._over_budget = keep
+            logger.warning('dataset %s alone needs %.1f MiB, over the %.1f MiB budget',
+                           keep, (total + reserve) / 2 ** 20, self.memory_budget / 2 ** 20)
+
+    def df(self, name):
+        return self.load(name)[0]
+
+    def agent(self, name):
+        return self.load(name)[1]
+
+    def invoke(self, name, query, **kwargs):
+        ctx = self.agent(name).invoke(query, **kwargs)
+        with self._lock:
+            # the question may have built indexes; account for them right away
+            if name in self._loaded:
+                self._enforce_budget(keep=name)
+        return ctx
+
+    async def ainvoke(self, name, query, **kwargs):
+        # loading a frame reads files, keep it off the event loop
+        agent = await asyncio.to_thread(self.agent, name)
+        ctx = await agent.ainvoke(query, **kwargs)
+        with self._lock:
+            if name in self._loaded:
+                self._enforce_budget(keep=name)
+        return ctx
+
+    def info(self):
+        usage = self.memory_usage()
+        return {**self.stats, 'registered': len(self._datasets), 'loaded': list(usage),
+                'memory_bytes': sum(usage.values()), 'memory_budget': self.memory_budget}
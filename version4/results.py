@@ -0,0 +1,194 @@
+from itertools import islice
+
+import numpy as np
+import pandas as pd
+
+from telemetry import REGISTRY
+
+
+# Results with more rows than this are handed out as ResultHandle
+MAX_RESULT_ROWS = 1000
+# Rows from each end, and characters in total, of the summary an InterpAgent prompt gets
+SUMMARY_ROWS = 5
+SUMMARY_CHARS = 4000
+
+
+def result_rows(result):
+    if isinstance(result, (pd.DataFrame, pd.Series, pd.Index, list, tuple, dict)):
+        return len(result)
+    if isinstance(result, np.ndarray):
+        return len(result) if result.ndim else 1
+    return None
+
+
+# Keeps a large DataFrame/Series/ndarray/list/dict result as is (no copy) and exposes bounded views
+# of it: summary() for prompts and logs, page()/iter_pages() for callers that want the rows,
+# to_arrow()/to_numpy() built on first use. str()/repr() give the summary, so formatting a
+# context that holds a handle never stringifies every row.
+class ResultHandle:
+    def __init__(self, value, summary_rows=SUMMARY_ROWS, summary_chars=SUMMARY_CHARS):
+        self.value = value
+        self.summary_rows = summary_rows
+        self.summary_chars = summary_chars
+        self._summary = None
+        self._arrow = None
+
+    @property
+    def shape(self):
+        if isinstance(self.value, (list, tuple, dict)):
+            return (len(self.value),)
+        return self.value.shape
+
+    def __len__(self):
+        return len(self.value)
+
+    def page(self, number, size=100):
+        # Rows [number * size, (number + 1) * size); slicing a NumPy-backed block is a view
+        start = number * size
+        if isinstance(self.value, (np.ndarray, list, tuple)):
+            return self.value[start:start + size]
+        if isinstance(self.value, dict):
+            return dict(islice(self.value.items(), start, start + size))
+        return self.value.iloc[start:start + size]
+
+    def iter_pages(self, size=100):
+        for start in range(0, len(self), size):
+            yield self.page(start // size, size)
+
+    def to_numpy(self, column=None):
+        # NumPy data of the result (or of one column); no copy for NumPy-backed data. A column
+        # of a list is taken from its records (dicts or tuples), of an ndarray along axis 1.
+        value = self.value
+        if column is not None:
+            if isinstance(value, (list, tuple)):
+                value = pd.DataFrame.from_records(value)[column]
+            elif isinstance(value, np.ndarray):
+                value = value[:, column]
+            else:
+                value = value[column]
+        if isinstance(value, (list, tuple, dict)):
+            return np.asarray(list(value.values()) if isinstance(value, dict) else value)
+        return value if isinstance(value, np.ndarray) else value.to_numpy(copy=False)
+
+    def to_arrow(self):
+        # pyarrow Table of the result, converted once; numeric columns without nulls are
+        # converted without copying
+        if self._arrow is None:
+            import pyarrow as pa
+
+            value = self.value
+            if isinstance(value, dict):
+                value = pd.Series(value, name='value')
+            elif isinstance(value, (list, tuple)):
+                value = pd.Series(value, name='value')
+            if isinstance(value, np.ndarray) and value.ndim > 2:
+                # one list column of the flattened rows; the shape is kept in the metadata
+                table = pa.table({'value': pa.FixedSizeListArray.from_arrays(
+                    value.reshape(-1), int(np.prod(value.shape[1:])))})
+                self._arrow = table.replace_schema_metadata({'shape': repr(value.shape)})
+                return self._arrow
+            if isinstance(value, np.ndarray):
+                value = pd.DataFrame(value if value.ndim > 1 else {'value': value})
+            elif isinstance(value, (pd.Series, pd.Index)):
+                value = value.to_frame()
+            self._arrow = pa.Table.from_pandas(value)
+        return self._arrow
+
+    def summary(self):
+        # Shape, dtypes, first/last rows and count/mean/min/max of the numeric columns,
+        # bounded by summary_chars
+        if self._summary is None:
+            self._summary = self._build_summary()
+        return self._summary
+
+    def _build_summary(self):
+        value = self.value
+        n = self.summary_rows
+        if isinstance(value, (list, tuple, dict)):
+            return self._truncate('\n'.join(self._container_summary(value, n)))
+        if isinstance(value, np.ndarray) and value.ndim > 2:
+            return self._truncate('\n'.join(self._array_summary(value, n)))
+        if isinstance(value, np.ndarray):
+            value = pd.DataFrame(value) if value.ndim > 1 else pd.Series(value)
+        elif isinstance(value, pd.Index):
+            value = value.to_series(index=None)
+        kind = type(self.value).__name__
+        size = f"{len(value):,} rows x {value.shape[1]} columns" if value.ndim > 1 else f"{len(value):,} values"
+        lines = [f"{kind} with {size} (first and last {n} shown)"]
+        if isinstance(value, pd.DataFrame):
+            lines.append('dtypes: ' + ', '.join(f'{col}: {dtype}' for col, dtype in value.dtypes.items()))
+        else:
+            lines.append(f'name: {value.name}, dtype: {value.dtype}')
+        with pd.option_context('display.max_columns', 20, 'display.width', 200):
+            lines.append(value.head(n).to_string())
+            lines.append('...')
+            lines.append(value.tail(n).to_string(header=isinstance(value, pd.DataFrame)))
+            # describe() sorts every column for its percentiles (and std is slow on int blocks);
+            # these are single passes
+            numeric = value.select_dtypes('number') if isinstance(value, pd.DataFrame) else value
+            if isinstance(numeric, pd.DataFrame) and numeric.shape[1] or pd.api.types.is_numeric_dtype(numeric):
+                lines.append('statistics:')
+                # one reduction per statistic over the whole block, not one per column
+                stats = {name: getattr(numeric, name)() for name in ('count', 'mean', 'min', 'max')}
+                lines.append((pd.DataFrame(stats).T if numeric.ndim > 1 else pd.Series(stats)).to_string())
+        return self._truncate('\n'.join(lines))
+
+    @staticmethod
+    def _container_summary(value, n):
+        kind = type(value).__name__
+        yield f"{kind} with {len(value):,} items (first and last {n} shown)"
+        if isinstance(value, dict):
+            yield repr(dict(islice(value.items(), n)))
+            yield '...'
+            yield repr(dict(reversed(list(islice(reversed(value.items()), n)))))
+        else:
+            yield repr(value[:n])
+            yield '...'
+            yield repr(value[-n:])
+
+    @staticmethod
+    def _array_summary(value, n):
+        # ndarrays of 3+ dimensions have no table form: shape, dtype and the first/last items
+        yield f"ndarray with shape {value.shape}, dtype {value.dtype} (first and last {n} items shown)"
+        with np.printoptions(threshold=200, edgeitems=2):
+            yield repr(value[:n])
+            yield '...'
+            yield repr(value[-n:])
+
+    def _truncate(self, text):
+        if len(text) > self.summary_chars:
+            text = text[:self.summary_chars] + '\n... (summary truncated)'
+        return text
+
+    def __str__(self):
+        return self.summary()
+
+    def __repr__(self):
+        return self.summary()
+
+
+def shape_result(result, max_rows=MAX_RESULT_ROWS):
+    # `result` unchanged, or a ResultHandle when it has more than max_rows rows
+    if isinstance(result, ResultHandle):
+        return result
+    rows = result_rows(result)
+    if rows is None or rows <= max_rows:
+        return result
+    REGISTRY.inc('shaped_results_total', 1, 'Results larger than max_rows handed out as ResultHandle')
+    return ResultHandle(result)
+
+
+def unwrap(result):
+    # The full value behind a ResultHandle; anything else as is
+    return result.value if isinstance(result, ResultHandle) else result
+
+
+def bounded_context(context, max_rows=SUMMARY_ROWS * 2):
+    # InterpAgent context whose large results render as summaries; small ones are kept, and
+    # small dicts (the context itself) are bounded value by value
+    rows = result_rows(context)
+    if rows is not None and rows > max_rows:
+        return ResultHandle(context)
+    if isinstance(context, dict):
+        return {key: bounded_context(value, max_rows) for key, value in context.items()}
+    return context
@@ -1,26 +1,87 @@
+import asyncio
+import threading
+from collections import OrderedDict
 
-from langchain.docstore.document import Document
-from langchain.retrievers import EnsembleRetriever
-from langchain_community.retrievers import BM25Retriever
-from langchain_chroma import Chroma 
-from langchain_community.vectorstores import FAISS
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_google_vertexai import VertexAIEmbeddings
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from embedding_cache import CachedEmbeddings
+from fingerprint import schema_fingerprint
+from lazy import LazyRegistry
+from schema_index import SchemaIndex
+from telemetry import record_cache
+
+
+# Backends are imported when a Retriever first needs them: bm25 mode with db='numpy'
+# loads none of them.
+VECTOR_STORES = LazyRegistry('vector store', {
+    'chroma': 'langchain_chroma:Chroma',
+    'faiss': 'langchain_community.vectorstores:FAISS',
+})
+EMBEDDERS = LazyRegistry('embedder', {
+    'vertexai': 'langchain_google_vertexai:VertexAIEmbeddings',
+    'huggingface': 'langchain_huggingface:HuggingFaceEmbeddings',
+})
+LANGCHAIN_RETRIEVERS = LazyRegistry('retriever', {
+    'bm25': 'langchain_community.retrievers:BM25Retriever',
+    'ensemble': 'langchain.retrievers:EnsembleRetriever',
+})
+
+
+# Memoizes column-name embeddings so a schema change only embeds the new columns.
+class ColumnEmbeddings(Embeddings):
+    def __init__(self, embedder):
+        self.embedder = embedder
+        self.vectors = {}
+        self.embedded = 0
+
+    def embed_documents(self, texts):
+        missing = [text for text in dict.fromkeys(texts) if text not in self.vectors]
+        if missing:
+            for text, vector in zip(missing, self.embedder.embed_documents(missing)):
+                self.vectors[text] = vector
+            self.embedded += len(missing)
+        return [self.vectors[text] for text in texts]
+
+    def embed_query(self, text):
+        return self.embedder.embed_query(text)
 
 
 class Retriever:
-    def __init__(self, mode, embed_model_name, db = Chroma, top_k = 5):
+    # db is a VECTOR_STORES name ('chroma', 'faiss'), a vector store class, or 'numpy' to
+    # search the schema with schema_index.SchemaIndex (one NumPy matrix per schema) instead
+    # of a vector store and LangChain's BM25/Ensemble retrievers. With column_profiles (a
+    # column_profile.ColumnProfiles), the selected columns are described by their profiles
+    # (null rate, cardinality, range, frequent values) instead of name and dtype only.
+    # `embedder` reuses an already loaded Embeddings (e.g. one shared by several Retrievers)
+    # instead of loading embed_model_name again.
+    def __init__(self, mode, embed_model_name, db = 'chroma', top_k = 5, max_cached_schemas = 8, embedding_cache_dir = None,
+                 column_profiles = None, embedder = None):
         self.mode = mode
         self.embed_model_name = embed_model_name
         self.db = db
         self.top_k = top_k
+        self.max_cached_schemas = max_cached_schemas
+        self.column_profiles = column_profiles
 
         if self.mode == 'bm25':
             self.embedder = None
+        elif embedder is not None:
+            self.embedder = embedder
         elif 'gecko' in self.embed_model_name: # VertexAI
-            self.embedder = VertexAIEmbeddings(model_name=self.embed_model_name)
+            self.embedder = EMBEDDERS['vertexai'](model_name=self.embed_model_name)
         else:
-            self.embedder = HuggingFaceEmbeddings(model_name=self.embed_model_name)
+            self.embedder = EMBEDDERS['huggingface'](model_name=self.embed_model_name)
+        if self.embedder is not None and embedding_cache_dir:
+            self.embedder = CachedEmbeddings(self.embedder, embedding_cache_dir, model_name=self.embed_model_name)
+        self.column_embedder = ColumnEmbeddings(self.embedder) if self.embedder is not None else None
+
+        # schema fingerprint -> built retriever, least recently used first
+        self._retrievers = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # held while a schema's index is built, so concurrent first questions build it once
+        self._lock = threading.Lock()
 
     def build_schema_corpus(self, df):
         docs = []
@@ -28,30 +89,97 @@ class Retriever:
             result_text = f'{{"column_name": "{col_name}", "dtype": "{df[col_name].dtype}"}}'
             docs.append(Document(page_content=col_name, metadata={'result_text': result_text}))
         return docs
-    
-    def get_retriever(self, df):
+
+    def build_retriever(self, df, fingerprint=None):
+        if self.db == 'numpy':
+            return SchemaIndex(self.build_schema_corpus(df), self.mode, self.column_embedder, self.top_k)
         docs = None
         if self.mode == 'embed' or self.mode == 'hybrid':
             docs = self.build_schema_corpus(df)
-            db = self.db.from_documents(docs, self.embedder)
+            store = VECTOR_STORES[self.db] if isinstance(self.db, str) else self.db
+            db_kwargs = {}
+            if getattr(store, '__name__', '') == 'Chroma':
+                # one collection per schema, otherwise rebuilds pile up in the shared default collection
+                db_kwargs['collection_name'] = f'schema_{fingerprint or schema_fingerprint(df)}'
+            db = store.from_documents(docs, self.column_embedder, **db_kwargs)
             embed_retriever = db.as_retriever(search_kwargs={'k': self.top_k})
         if self.mode == 'bm25' or self.mode == 'hybrid':
             if docs is None:
                 docs = self.build_schema_corpus(df)
-            bm25_retriever = BM25Retriever.from_documents(docs)
+            bm25_retriever = LANGCHAIN_RETRIEVERS['bm25'].from_documents(docs)
             bm25_retriever.k = self.top_k
         if self.mode == 'hybrid':
             # return EnsembleRetriever(retrievers=[embed_retriever, bm25_retriever], weights=[0.9, 0.1])
-            return EnsembleRetriever(retrievers=[embed_retriever, bm25_retriever], weights=[0.5, 0.5])
+            return LANGCHAIN_RETRIEVERS['ensemble'](retrievers=[embed_retriever, bm25_retriever], weights=[0.5, 0.5])
         elif self.mode == 'embed':
             return embed_retriever
         elif self.mode == 'bm25':
             return bm25_retriever
 
+    def get_retriever(self, df):
+        fingerprint = schema_fingerprint(df)
+        with self._lock:
+            retriever = self._retrievers.get(fingerprint)
+            record_cache('schema_retriever', retriever is not None)
+            if retriever is not None:
+                self.hits += 1
+                self._retrievers.move_to_end(fingerprint)
+                return retriever
+
+            # Columns added, dropped or retyped: rebuild the index. Column names that were
+            # already embedded for an earlier schema are served from `column_embedder`.
+            self.misses += 1
+            retriever = self.build_retriever(df, fingerprint)
+            self._retrievers[fingerprint] = retriever
+            while len(self._retrievers) > self.max_cached_schemas:
+                self._retrievers.popitem(last=False)
+            return retriever
+
+    def cache_info(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'cached_schemas': len(self._retrievers),
+                'embedded_columns': self.column_embedder.embedded if self.column_embedder is not None else 0,
+            }
+
+    def forget_schema(self, df):
+        # Drop the index built for the schema of `df` (e.g. when the frame is unloaded)
+        with self._lock:
+            self._retrievers.pop(schema_fingerprint(df), None)
+
+    def clear_cache(self):
+        with self._lock:
+            self._retrievers.clear()
+
+    def observations(self, results, df):
+        if self.column_profiles is not None:
+            return self.column_profiles.describe(df, [doc.page_content for doc in results])
+        return [doc.metadata['result_text'] for doc in results if 'result_text' in doc.metadata]
+
     def retrieve_schema(self, query, df):
         results = self.get_retriever(df).invoke(query)
-        observations = [doc.metadata['result_text'] for doc in results if 'result_text' in doc.metadata]
-        return observations
+        return self.observations(results, df)
+
+    def retrieve_columns(self, query, df):
+        # Names of the columns most relevant to `query`, best first
+        return [doc.page_content for doc in self.get_retriever(df).invoke(query)]
 
+    async def aget_retriever(self, df):
+        if schema_fingerprint(df) not in self._retrievers:
+            # first query for this schema embeds the columns, build the index in a worker thread
+            return await asyncio.to_thread(self.get_retriever, df)
+        return self.get_retriever(df)
 
+    async def aretrieve_columns(self, query, df):
+        retriever = await self.aget_retriever(df)
+        return [doc.page_content for doc in await retriever.ainvoke(query)]
 
+    async def aretrieve_schema(self, query, df):
+        retriever = await self.aget_retriever(df)
+        results = await retriever.ainvoke(query)
+        if self.column_profiles is not None:
+            # profiling a column the first time is a pass over its values
+            return await asyncio.to_thread(self.observations, results, df)
+        return self.observations(results, df)
@@ -0,0 +1,195 @@
+import re
+import threading
+
+import pandas as pd
+
+from results import unwrap
+from semantic_cache import CANONICAL, STOPWORDS, TOKEN, cell_values, singular
+from telemetry import REGISTRY
+
+
+NUMBER_WORDS = {'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5,
+                'six': 6, 'seven': 7, 'eight': 8, 'nine': 9, 'ten': 10}
+DISTINCT_WORDS = {'different', 'distinct', 'unique'}
+COMPARATIVES = {'better', 'worse', 'higher', 'lower', 'greater', 'more', 'less'}
+# verbs that end the group part of "which <group> has the best <measure>"
+WHICH_VERBS = {'has', 'have', 'had', 'get', 'gets', 'got', 'is', 'are', 'with'}
+# nouns for "every row" ("how many students ..."); any other noun may be a filter ("girls")
+ROW_NOUNS = {'student', 'product', 'row', 'record', 'entry', 'item'}
+# words a routable question may carry besides columns, intents and numbers
+FILLER = STOPWORDS | ROW_NOUNS | {'how', 'currently', 'now', 'overall', 'whoes', 'whose', 'who', 'them', 'their',
+                                  'all', 'data', 'on', 'by'}
+INTENTS = {'max', 'min', 'mean', 'sum', 'count', 'gt', 'lt', 'not', 'distinct'}
+# words that change what an aggregate means ("second highest", "top 3", "per class"); a
+# question carrying one is never routed
+REFUSED = {'first', 'second', 'third', 'fourth', 'fifth', 'sixth', 'seventh', 'eighth', 'ninth', 'tenth',
+           'last', 'next', 'previous', 'top', 'bottom', 'rank', 'ranked', 'per', 'each', 'every', 'between',
+           'median', 'percent', 'percentage', 'ratio', 'range', 'year', 'month', 'day', 'date'}
+ORDINAL = re.compile(r'\b\d+(?:st|nd|rd|th)\b')
+LABELS = {'max': 'highest', 'min': 'lowest', 'mean': 'average', 'sum': 'total'}
+
+
+def column_tokens(column):
+    return {singular(token) for token in re.findall(r'[a-z0-9]+', str(column).lower())}
+
+
+def plain(value):
+    value = unwrap(value)
+    if isinstance(value, pd.Series):
+        return {plain(key): plain(item) for key, item in value.head(10).items()}
+    value = value.item() if hasattr(value, 'item') else value
+    return round(value, 4) if isinstance(value, float) else value
+
+
+# Deterministic fast path for simple aggregate questions ("What is the highest math score?",
+# "How many students whoes reading score more than 80?", "Which gender has a better math
+# score?"). The question is matched to columns by the Retriever's ranking and the share of
+# each column name's words it contains, and to one intent (max/min/mean/sum, count with a
+# threshold, distinct count, group-by mean) by keyword. plan() returns None whenever the
+# match is ambiguous or the question says more than the intent covers (ordinals, top/bottom
+# n, years, thresholds outside the column's range), and the caller falls back to the LLM.
+class QueryRouter:
+    # No unknown word is tolerated by default: a word outside the column, intent, row-noun
+    # and filler vocabulary ("girls", "boys", 'male', 'completed') usually asks for a filter
+    # the intents do not express, so the question goes to the LLM.
+    def __init__(self, retriever, min_coverage=0.5, max_unknown=0):
+        self.retriever = retriever
+        # share of a column name's words the question must contain
+        self.min_coverage = min_coverage
+        # words that are neither column, intent, number nor filler before giving up
+        self.max_unknown = max_unknown
+        self.stats = {'routed': 0, 'fallback': 0}
+        self._lock = threading.Lock()
+
+    def match_column(self, words, df, accept=None):
+        # Best covered column among the retrieved ones (then the rest of the schema, as the
+        # retriever only returns top_k); None unless it is the single best one
+        ranked = list(dict.fromkeys(self.retriever.retrieve_columns(' '.join(words), df) + list(df.columns)))
+        present = set(words)
+        scored = []
+        for column in ranked:
+            if column not in df.columns or (accept is not None and not accept(df[column])):
+                continue
+            tokens = column_tokens(column)
+            coverage = len(tokens & present) / len(tokens) if tokens else 0.0
+            if coverage >= self.min_coverage:
+                scored.append((coverage, column))
+        if not scored:
+            return None
+        best = max(coverage for coverage, _ in scored)
+        columns = [column for coverage, column in scored if coverage == best]
+        return columns[0] if len(columns) == 1 else None
+
+    def value_words(self, df):
+        return cell_values(df).words - STOPWORDS
+
+    def confident(self, unknown, df):
+        return len(unknown) <= self.max_unknown and not set(unknown) & (self.value_words(df) | REFUSED)
+
+    def intents(self, words, column):
+        # (intents, numbers, unknown words) of `words` once the column's words are removed
+        tokens = column_tokens(column) if column is not None else set()
+        intents, numbers, unknown = set(), [], []
+        for word in words:
+            if word in tokens:
+                continue
+            word = 'distinct' if word in DISTINCT_WORDS else CANONICAL.get(word, word)
+            if word in INTENTS:
+                intents.add(word)
+            elif word in NUMBER_WORDS:
+                numbers.append(NUMBER_WORDS[word])
+            elif re.fullmatch(r'\d+(?:\.\d+)?', word):
+                numbers.append(float(word) if '.' in word else int(word))
+            elif word not in FILLER:
+                unknown.append(word)
+        return intents, numbers, unknown
+
+    def plan(self, query, df):
+        # (pandas expression, one-sentence answer template) or None
+        text = query.lower().replace('’', "'")
+        raw = TOKEN.findall(text)
+        if ORDINAL.search(text) or set(raw) & REFUSED:
+            return None
+        words = [word if word in FILLER else singular(word) for word in raw]
+        if words and words[0] == 'which':
+            verb = next((i for i, word in enumerate(words) if word in WHICH_VERBS), None)
+            if verb is None:
+                return None
+            return self.plan_which(words[1:verb], words[verb + 1:], set(raw), df)
+
+        column = self.match_column(words, df)
+        if column is None:
+            return None
+        intents, numbers, unknown = self.intents(words, column)
+        if not self.confident(unknown, df) or 'not' in intents:
+            return None
+        series = df[column]
+        numeric = pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series)
+        col = repr(column)
+
+        if intents == {'count', 'gt'} or intents == {'count', 'lt'}:
+            if not numeric or len(numbers) != 1:
+                return None
+            if not series.min() <= numbers[0] <= series.max():
+                # "more than 2019" on a score is about something else (a year, an id)
+                return None
+            op, word = ('>', 'above') if 'gt' in intents else ('<', 'below')
+            return f"(df[{col}] {op} {numbers[0]}).sum()", f"{{result}} rows have {column} {word} {numbers[0]}."
+        if numbers:
+            # "lowest math score in 2019", "two lowest scores": a filter or a top-n the
+            # intents cannot express
+            return None
+        if intents == {'count'} and pd.api.types.is_bool_dtype(series):
+            return f"df[{col}].sum()", f"{{result}} rows are {column}."
+        if intents in ({'count', 'distinct'}, {'distinct'}):
+            return f"df[{col}].nunique()", f"{column} has {{result}} distinct values."
+        if len(intents) == 1 and intents <= set(LABELS) and numeric:
+            intent = intents.pop()
+            return f"df[{col}].{intent}()", f"The {LABELS[intent]} {column} is {{result}}."
+        return None
+
+    def plan_which(self, group_words, measure_words, raw, df):
+        # "which <group> has the best/a better <measure>"
+        group = self.match_column(group_words, df, accept=lambda s: not pd.api.types.is_numeric_dtype(s))
+        measure = self.match_column(measure_words, df, accept=lambda s: pd.api.types.is_numeric_dtype(s)
+                                    and not pd.api.types.is_bool_dtype(s))
+        if group is None or measure is None:
+            return None
+        group_intents, numbers, unknown = self.intents(group_words, group)
+        intents, more_numbers, more_unknown = self.intents(measure_words, measure)
+        if group_intents or numbers or more_numbers or not self.confident(unknown + more_unknown, df):
+            return None
+        direction = intents - {'mean'}
+        if direction not in ({'max'}, {'min'}, {'gt'}, {'lt'}):
+            return None
+        g, m = repr(group), repr(measure)
+        if raw & COMPARATIVES:
+            return f"df.groupby({g})[{m}].mean()", f"Average {measure} by {group}: {{result}}."
+        if direction not in ({'max'}, {'min'}):
+            # "which gender has above average math score" compares against a mean
+            return None
+        best = 'idxmax' if direction == {'max'} else 'idxmin'
+        label = LABELS[direction.pop()]
+        if df[group].is_unique:
+            # one row per group value (names, ids): take the row, not a group mean
+            return f"df.loc[df[{m}].{best}(), {g}]", f"{{result}} has the {label} {measure}."
+        return f"df.groupby({g})[{m}].mean().{best}()", f"{{result}} has the {label} average {measure}."
+
+    def record(self, routed):
+        with self._lock:
+            self.stats['routed' if routed else 'fallback'] += 1
+        REGISTRY.inc('router_questions_total', 1, 'Questions by route: answered without the LLM or sent to it',
+                     route='fast' if routed else 'llm')
+
+    def info(self):
+        with self._lock:
+            total = self.stats['routed'] + self.stats['fallback']
+            return {**self.stats, 'fast_share': self.stats['routed'] / total if total else 0.0}
+
+
+def routed_answer(ctx, query):
+    # The three InterpAgent sections for a routed answer, without a model call
+    result = plain(ctx['result'])
+    return (f"**The question:** {query}\n\n"
+            f"**The relative result:** {ctx['code']}\n{result}\n\n"
+            f"**The concluding response:** {ctx['answer'].format(result=result)}")
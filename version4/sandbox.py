@@ -0,0 +1,196 @@
+import multiprocessing
+import os
+import queue
+import resource
+import threading
+import time
+from concurrent.futures import Future
+
+from execute import execute_code
+from fingerprint import dataframe_version
+
+
+POLL_INTERVAL = 0.05
+
+
+def private_memory(pid):
+    # Memory private to the process, so the DataFrame pages it shares with the parent
+    # copy-on-write do not count against its limit. Falls back to RSS.
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            return sum(int(line.split()[1]) * 1024 for line in f if line.startswith(('Private_Clean:', 'Private_Dirty:')))
+    except OSError:
+        try:
+            with open(f'/proc/{pid}/statm') as f:
+                return int(f.read().split()[1]) * resource.getpagesize()
+        except OSError:
+            return 0
+
+
+def address_space():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[0]) * resource.getpagesize()
+
+
+def worker_main(conn, df, max_memory):
+    if max_memory:
+        # Backstop for allocations faster than the parent's polling: grow at most max_memory
+        # beyond what the fork already maps, then MemoryError is raised inside the worker.
+        try:
+            limit = address_space() + max_memory
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+        except (OSError, ValueError):
+            pass
+    while True:
+        try:
+            code = conn.recv()
+        except EOFError:
+            return
+        if code is None:
+            return
+        try:
+            message = (True, execute_code(code, df))
+        except BaseException as e:
+            message = (False, e)
+        try:
+            conn.send(message)
+        except Exception as e:
+            # unpicklable result or exception
+            conn.send((False, RuntimeError(f'{type(e).__name__}: {e}')))
+
+
+class WorkerCrashed(RuntimeError):
+    pass
+
+
+# Pool of pre-forked worker processes that each inherit `df` copy-on-write and run
+# generated code through execute.execute_code. A worker that exceeds the wall-clock
+# timeout or its private-memory limit is killed and replaced by a fresh fork.
+# Each worker holds the frame as it was when forked, tagged with its dataframe_version;
+# once that changes (touch_dataframe after an in-place edit, a reshape or retype) every
+# worker is replaced before it runs its next job, so all workers answer from the same data.
+# 'fork' is only safe while the process has no other threads: a lock held by a thread pool,
+# a tokenizer or gRPC at fork time stays locked forever in the child. Create the executor
+# before starting those, or pass start_method='forkserver', which sends `df` to every worker
+# by pickle instead of sharing it copy-on-write. Replacement workers are started from the
+# executor's own serving threads, so they always come from `respawn_method` ('forkserver' or
+# 'spawn'), never from a fork of this multi-threaded process.
+class SandboxExecutor:
+    def __init__(self, df, workers=None, timeout=30, max_memory_mb=None, start_method='fork',
+                 respawn_method='forkserver'):
+        self.df = df
+        self.timeout = timeout
+        self.max_memory = max_memory_mb * 1024 * 1024 if max_memory_mb else None
+        self.context = multiprocessing.get_context(start_method)
+        if start_method == 'fork':
+            if respawn_method == 'fork':
+                raise ValueError("respawn_method must be 'forkserver' or 'spawn'")
+            self.respawn_context = multiprocessing.get_context(respawn_method)
+            if respawn_method == 'forkserver':
+                # the fork server imports pandas and the executor once, not every replacement
+                self.respawn_context.set_forkserver_preload([__name__])
+        else:
+            self.respawn_context = self.context
+        self.stats = {'executed': 0, 'failed': 0, 'timeouts': 0, 'memory_kills': 0, 'crashes': 0, 'recycled': 0}
+        self._jobs = queue.Queue()
+        self._lock = threading.Lock()
+        self._workers = [self._spawn() for _ in range(workers or os.cpu_count() or 1)]
+        self._threads = [threading.Thread(target=self._serve, args=(slot,), daemon=True) for slot in range(len(self._workers))]
+        for thread in self._threads:
+            thread.start()
+
+    def _spawn(self, context=None):
+        # (process, connection, dataframe_version of the frame it inherited)
+        context = context or self.context
+        version = dataframe_version(self.df)
+        parent_conn, child_conn = context.Pipe()
+        process = context.Process(target=worker_main, args=(child_conn, self.df, self.max_memory), daemon=True)
+        process.start()
+        child_conn.close()
+        return process, parent_conn, version
+
+    def _replace(self, slot):
+        process, conn, _ = self._workers[slot]
+        process.kill()
+        process.join()
+        conn.close()
+        self._workers[slot] = self._spawn(self.respawn_context)
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def _serve(self, slot):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            code, future, timeout = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                ok, value = self._run(slot, code, timeout)
+            except BaseException as e:
+                future.set_exception(e)
+                continue
+            self._count('executed' if ok else 'failed')
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+    def _run(self, slot, code, timeout):
+        if self._workers[slot][2] != dataframe_version(self.df):
+            self._count('recycled')
+            self._replace(slot)
+        process, conn, _ = self._workers[slot]
+        conn.send(code)
+        deadline = time.monotonic() + timeout if timeout else None
+        while True:
+            if conn.poll(POLL_INTERVAL):
+                try:
+                    return conn.recv()
+                except EOFError:
+                    process.join(1)
+            if not process.is_alive():
+                exitcode = process.exitcode
+                self._count('crashes')
+                self._replace(slot)
+                raise WorkerCrashed(f'Sandbox worker died with exit code {exitcode}')
+            if deadline is not None and time.monotonic() > deadline:
+                self._count('timeouts')
+                self._replace(slot)
+                raise TimeoutError(f'Generated code did not finish within {timeout}s')
+            if self.max_memory and private_memory(process.pid) > self.max_memory:
+                self._count('memory_kills')
+                self._replace(slot)
+                raise MemoryError(f'Generated code exceeded the {self.max_memory // (1024 * 1024)} MB memory limit')
+
+    def submit(self, code, timeout=None):
+        future = Future()
+        self._jobs.put((code, future, timeout if timeout is not None else self.timeout))
+        return future
+
+    def run(self, code, timeout=None):
+        return self.submit(code, timeout).result()
+
+    def close(self):
+        for _ in self._threads:
+            self._jobs.put(None)
+        for thread in self._threads:
+            thread.join()
+        for process, conn, _ in self._workers:
+            try:
+                conn.send(None)
+            except OSError:
+                pass
+            process.join(1)
+            if process.is_alive():
+                process.kill()
+            conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,99 @@
+import asyncio
+
+import numpy as np
+
+
+RRF_C = 60
+
+
+def tokenize(text):
+    # Same whitespace split as BM25Retriever's default preprocessing
+    return text.split()
+
+
+# BM25Okapi (rank_bm25, as used by BM25Retriever) over a term-frequency matrix. The BM25
+# saturation of every (document, term) pair is precomputed, so scoring a query is one
+# column gather and one matrix-vector product.
+class BM25Matrix:
+    def __init__(self, texts, k1=1.5, b=0.75, epsilon=0.25):
+        tokens = [tokenize(text) for text in texts]
+        self.vocabulary = {}
+        for doc in tokens:
+            for term in doc:
+                self.vocabulary.setdefault(term, len(self.vocabulary))
+        tf = np.zeros((len(tokens), len(self.vocabulary)))
+        for row, doc in enumerate(tokens):
+            for term in doc:
+                tf[row, self.vocabulary[term]] += 1
+
+        doc_len = tf.sum(axis=1)
+        avgdl = doc_len.sum() / max(len(tokens), 1)
+        doc_freq = (tf > 0).sum(axis=0)
+        idf = np.log(len(tokens) - doc_freq + 0.5) - np.log(doc_freq + 0.5)
+        if len(idf):
+            idf[idf < 0] = epsilon * idf.mean()
+        self.idf = idf
+        norm = k1 * (1 - b + b * doc_len / avgdl) if avgdl else np.full(len(tokens), k1)
+        self.saturation = tf * (k1 + 1) / (tf + norm[:, None])
+
+    def scores(self, query):
+        ids = [self.vocabulary[term] for term in tokenize(query) if term in self.vocabulary]
+        if not ids:
+            return np.zeros(self.saturation.shape[0])
+        ids, counts = np.unique(ids, return_counts=True)
+        return self.saturation[:, ids] @ (self.idf[ids] * counts)
+
+
+def top_k(scores, k):
+    # Highest first; ties keep the order np.argsort(scores)[::-1] gives, as rank_bm25's get_top_n
+    return np.argsort(scores)[::-1][:k]
+
+
+# In-memory retriever over one schema corpus (one short document per column). Column
+# embeddings live in one L2-normalized matrix, so cosine top-k is a single matmul; hybrid
+# mode fuses the embedding and BM25 rankings with the weighted reciprocal rank fusion of
+# EnsembleRetriever. invoke/ainvoke return Documents like the LangChain retrievers.
+class SchemaIndex:
+    def __init__(self, docs, mode='hybrid', embedder=None, top_k=5, weights=(0.5, 0.5), c=RRF_C):
+        self.docs = docs
+        self.mode = mode
+        self.embedder = embedder
+        self.k = top_k
+        self.weights = weights
+        self.c = c
+        texts = [doc.page_content for doc in docs]
+        self.bm25 = BM25Matrix(texts) if mode in ('bm25', 'hybrid') else None
+        self.vectors = None
+        if mode in ('embed', 'hybrid'):
+            vectors = np.asarray(embedder.embed_documents(texts), dtype=np.float32).reshape(len(texts), -1)
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            self.vectors = vectors / np.where(norms == 0, 1, norms)
+
+    def embed_ranking(self, query):
+        vector = np.asarray(self.embedder.embed_query(query), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return top_k(self.vectors @ (vector / norm if norm else vector), self.k)
+
+    def bm25_ranking(self, query):
+        return top_k(self.bm25.scores(query), self.k)
+
+    def rank(self, query):
+        if self.mode == 'bm25':
+            return self.bm25_ranking(query)
+        if self.mode == 'embed':
+            return self.embed_ranking(query)
+        rankings = [self.embed_ranking(query), self.bm25_ranking(query)]
+        fused = np.zeros(len(self.docs))
+        for ranking, weight in zip(rankings, self.weights):
+            fused[ranking] += weight / (np.arange(1, len(ranking) + 1) + self.c)
+        # every doc in either top-k, best fused score first; first appearance breaks ties
+        candidates = list(dict.fromkeys(np.concatenate(rankings).tolist()))
+        return sorted(candidates, key=lambda i: -fused[i])
+
+    def invoke(self, query):
+        return [self.docs[i] for i in self.rank(query)]
+
+    async def ainvoke(self, query):
+        if self.embedder is None:
+            return self.invoke(query)
+        return await asyncio.to_thread(self.invoke, query)
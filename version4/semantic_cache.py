@@ -0,0 +1,241 @@
+import re
+import threading
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from langchain_core.embeddings import Embeddings
+
+from fingerprint import dataframe_version
+from telemetry import REGISTRY, record_cache
+
+
+# Words that flip the meaning of otherwise identical questions, mapped to one canonical token
+# each. Two questions only share cached code when their canonical direction words, numbers
+# and mentioned columns are the same, whatever their embedding similarity.
+DIRECTION_WORDS = {
+    'max': ('highest', 'max', 'maximum', 'most', 'top', 'best', 'largest', 'greatest', 'biggest'),
+    'min': ('lowest', 'min', 'minimum', 'least', 'bottom', 'worst', 'smallest', 'fewest'),
+    'gt': ('more', 'above', 'greater', 'over', 'exceed', 'exceeds', 'higher', 'better'),
+    'lt': ('less', 'below', 'under', 'fewer', 'lower', 'worse'),
+    'mean': ('average', 'mean', 'avg'),
+    'count': ('count', 'many', 'number'),
+    'sum': ('sum', 'total'),
+    'not': ('not', 'no', 'without', 'except', 'excluding', "isn't", "aren't", "don't", "doesn't"),
+}
+CANONICAL = {word: token for token, words in DIRECTION_WORDS.items() for word in words}
+STOPWORDS = {
+    'what', "what's", 'whats', 'which', 'who', 'is', 'are', 'was', 'the', 'a', 'an', 'of', 'in',
+    'for', 'to', 'me', 'show', 'tell', 'give', 'find', 'get', 'please', 'does', 'do', 'value', 'there',
+    'than', 'has', 'have', 'whose', 'whoes', 'that', 'with',
+}
+TOKEN = re.compile(r"[a-z_]+(?:'[a-z]+)?|\d+(?:\.\d+)?")
+NUMBER = re.compile(r'\d+(?:\.\d+)?')
+# categorical columns with more distinct values than this are not scanned for value words
+MAX_CATEGORIES = 100
+MAX_VALUE_FRAMES = 8
+
+
+def singular(token):
+    # 'scores' -> 'score', 'categories' -> 'category'; leaves 'class', 'was' and numbers alone
+    if len(token) > 4 and token.endswith('ies'):
+        return token[:-3] + 'y'
+    return token[:-1] if len(token) > 3 and token.endswith('s') and not token.endswith('ss') else token
+
+
+def canonical_tokens(question):
+    tokens = TOKEN.findall(question.lower().replace('\u2019', "'"))
+    return [CANONICAL.get(token, singular(token)) for token in tokens if token not in STOPWORDS]
+
+
+# Values of a frame's categorical columns: `values` lowercased, `words` their singular words
+# ('group', 'a', 'male'), and `pattern` finding whole values in a question, plural or not
+class CellValues:
+    def __init__(self, values):
+        self.values = frozenset(values)
+        self.words = frozenset(singular(word) for value in self.values for word in TOKEN.findall(value))
+        alternatives = '|'.join(re.escape(value) for value in sorted(self.values, key=len, reverse=True))
+        self.pattern = re.compile(rf"\b({alternatives})s?\b") if alternatives else None
+
+    def mentioned(self, text):
+        return frozenset(self.pattern.findall(text)) if self.pattern is not None else frozenset()
+
+
+NO_VALUES = CellValues(())
+_cell_values = OrderedDict()  # dataframe_version -> CellValues
+_cell_values_lock = threading.Lock()
+
+
+def cell_values(df):
+    # CellValues of df's non-numeric columns with at most MAX_CATEGORIES distinct values,
+    # cached per frame version
+    version = dataframe_version(df)
+    with _cell_values_lock:
+        values = _cell_values.get(version)
+        if values is not None:
+            _cell_values.move_to_end(version)
+            return values
+    found = set()
+    for column in df.columns:
+        series = df[column]
+        if pd.api.types.is_numeric_dtype(series) or series.nunique() > MAX_CATEGORIES:
+            continue
+        found.update(str(value).lower().strip() for value in series.dropna().unique())
+    values = CellValues(value for value in found if value)
+    with _cell_values_lock:
+        _cell_values[version] = values
+        while len(_cell_values) > MAX_VALUE_FRAMES:
+            _cell_values.popitem(last=False)
+    return values
+
+
+def question_guard(question, columns, values=NO_VALUES):
+    # (numbers, direction tokens, mentioned columns, mentioned cell values) that must be
+    # equal for a cache hit. Values are matched as whole phrases before stopwords are
+    # dropped, so 'group A' and 'group B' differ although 'a' is a stopword.
+    text = question.lower().replace('\u2019', "'")
+    directions = frozenset(token for token in canonical_tokens(question) if token in DIRECTION_WORDS)
+    mentioned = frozenset(col for col in columns if str(col).lower() in text)
+    return tuple(NUMBER.findall(text)), directions, mentioned, values.mentioned(text)
+
+
+# Dependency-free question embedding: hashed word unigrams/bigrams and character trigrams of
+# the canonical tokens, L2-normalized. Paraphrases that differ only in stopwords or
+# synonyms from DIRECTION_WORDS embed identically.
+class HashingEmbeddings(Embeddings):
+    def __init__(self, dimensions=1024):
+        self.dimensions = dimensions
+
+    def _features(self, tokens):
+        yield from tokens
+        yield from (f'{a} {b}' for a, b in zip(tokens, tokens[1:]))
+        for token in tokens:
+            padded = f' {token} '
+            yield from (padded[i:i + 3] for i in range(len(padded) - 2))
+
+    def embed_query(self, text):
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for feature in self._features(canonical_tokens(text)):
+            vector[zlib.crc32(feature.encode('utf-8')) % self.dimensions] += 1
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+
+class SchemaBucket:
+    # Question vectors of one schema in one matrix; removal swaps the last row into the hole
+    def __init__(self, dimensions):
+        self.matrix = np.zeros((8, dimensions), dtype=np.float32)
+        self.keys = []
+
+    def add(self, key, vector):
+        if len(self.keys) == len(self.matrix):
+            self.matrix = np.concatenate([self.matrix, np.zeros_like(self.matrix)])
+        self.matrix[len(self.keys)] = vector
+        self.keys.append(key)
+
+    def remove(self, key):
+        row = self.keys.index(key)
+        last = len(self.keys) - 1
+        self.matrix[row] = self.matrix[last]
+        self.keys[row] = self.keys[last]
+        self.keys.pop()
+
+    def nearest(self, vector, k):
+        scores = self.matrix[:len(self.keys)] @ vector
+        order = np.argsort(scores)[::-1][:k]
+        return [(self.keys[i], float(scores[i])) for i in order]
+
+
+# Maps questions to pandas code that already ran successfully on a DataFrame with the same
+# schema. A lookup embeds the question and takes the most similar stored question above
+# `threshold` whose guard (numbers, direction words, mentioned columns and the cell values
+# of `values` it mentions) is identical.
+# At most `max_entries` questions are kept across all schemas, least recently used evicted.
+class SemanticCache:
+    def __init__(self, embedder=None, threshold=0.9, max_entries=2048, candidates=4):
+        self.embedder = embedder or HashingEmbeddings()
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.candidates = candidates
+        self._entries = OrderedDict()  # (schema, question) -> (code, guard)
+        self._buckets = {}             # schema -> SchemaBucket
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'guard_rejections': 0, 'evictions': 0, 'invalidations': 0}
+
+    def _vector(self, question):
+        vector = np.asarray(self.embedder.embed_query(question), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, question, schema, columns, values=NO_VALUES):
+        # Returns (cached question, code) or None; values as from cell_values(df)
+        vector = self._vector(question)
+        guard = question_guard(question, columns, values)
+        with self._lock:
+            bucket = self._buckets.get(schema)
+            rejected = False
+            for key, score in (bucket.nearest(vector, self.candidates) if bucket else []):
+                if score < self.threshold:
+                    break
+                code, stored_guard = self._entries[key]
+                if stored_guard != guard:
+                    rejected = True
+                    continue
+                self._entries.move_to_end(key)
+                self.stats['hits'] += 1
+                record_cache('semantic_question', True)
+                return key[1], code
+            self.stats['misses'] += 1
+            if rejected:
+                self.stats['guard_rejections'] += 1
+                REGISTRY.inc('semantic_cache_guard_rejections_total', 1,
+                             'Similar cached questions rejected for differing numbers, direction words, columns or values')
+        record_cache('semantic_question', False)
+        return None
+
+    def store(self, question, schema, columns, code, values=NO_VALUES):
+        vector = self._vector(question)
+        key = (schema, question)
+        guard = question_guard(question, columns, values)
+        with self._lock:
+            if key in self._entries:
+                self._entries[key] = (code, guard)
+                self._entries.move_to_end(key)
+                return
+            while len(self._entries) >= self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.stats['evictions'] += 1
+            self._entries[key] = (code, guard)
+            bucket = self._buckets.get(schema)
+            if bucket is None:
+                bucket = self._buckets[schema] = SchemaBucket(len(vector))
+            bucket.add(key, vector)
+
+    def invalidate(self, question, schema):
+        # Drop an entry whose code no longer runs (e.g. the data changed)
+        with self._lock:
+            if (schema, question) in self._entries:
+                self._remove((schema, question))
+                self.stats['invalidations'] += 1
+
+    def _remove(self, key):
+        del self._entries[key]
+        bucket = self._buckets[key[0]]
+        bucket.remove(key)
+        if not bucket.keys:
+            del self._buckets[key[0]]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+
+    def info(self):
+        with self._lock:
+            lookups = self.stats['hits'] + self.stats['misses']
+            return {**self.stats, 'entries': len(self._entries), 'schemas': len(self._buckets),
+                    'hit_rate': self.stats['hits'] / lookups if lookups else 0.0}
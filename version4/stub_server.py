@@ -0,0 +1,169 @@
+import asyncio
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+
+CANNED_CODE = "```python\ndf['math score'].max()\n```"
+
+
+# Local stand-in for an Ollama server. Answers /api/generate with `responder(prompt)`
+# after `delay` seconds, streamed as NDJSON chunks of `chunk_size` characters that are
+# `chunk_delay` seconds apart (a model's generation speed). With `quota` set, requests past
+# `quota` per `quota_window` seconds are answered 429, like a provider's per-minute quota.
+class StubModelServer:
+    def __init__(self, responder=None, delay=0.5, chunk_size=16, chunk_delay=0.0, host='127.0.0.1', port=0,
+                 quota=None, quota_window=60.0):
+        self.responder = responder or (lambda prompt: CANNED_CODE)
+        self.delay = delay
+        self.chunk_size = chunk_size
+        self.chunk_delay = chunk_delay
+        self.quota = quota
+        self.quota_window = quota_window
+        self.requests = 0
+        self.throttled = 0
+        self._window = (0.0, 0)  # (window start, requests admitted in it)
+        self._quota_lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def admit(self):
+        # False when the request is over quota
+        if self.quota is None:
+            return True
+        with self._quota_lock:
+            now = time.monotonic()
+            start, count = self._window
+            if now - start >= self.quota_window:
+                start, count = now, 0
+            if count >= self.quota:
+                self.throttled += 1
+                self._window = (start, count)
+                return False
+            self._window = (start, count + 1)
+            return True
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, body, status=200):
+                payload = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                request = json.loads(self.rfile.read(length) or b'{}')
+                if self.path != '/api/generate':
+                    self.send_error(404)
+                    return
+                if not stub.admit():
+                    self._send_json({'error': {'code': 429, 'status': 'RESOURCE_EXHAUSTED'}}, status=429)
+                    return
+                stub.requests += 1
+                time.sleep(stub.delay)
+                text = stub.responder(request.get('prompt', ''))
+                model = request.get('model', 'stub')
+                if not request.get('stream', True):
+                    time.sleep(stub.chunk_delay * -(-len(text) // stub.chunk_size))
+                    self._send_json({'model': model, 'response': text, 'done': True})
+                    return
+
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/x-ndjson')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                chunks = [text[i:i + stub.chunk_size] for i in range(0, len(text), stub.chunk_size)]
+                try:
+                    for i, piece in enumerate(chunks):
+                        if i and stub.chunk_delay:
+                            time.sleep(stub.chunk_delay)
+                        self._write_chunk({'model': model, 'response': piece, 'done': False})
+                    self._write_chunk({'model': model, 'response': '', 'done': True, 'done_reason': 'stop'})
+                    self.wfile.write(b'0\r\n\r\n')
+                except (BrokenPipeError, ConnectionResetError):
+                    # client stopped reading, e.g. a cancelled candidate or abandoned stream
+                    self.close_connection = True
+
+            def _write_chunk(self, body):
+                line = json.dumps(body).encode('utf-8') + b'\n'
+                self.wfile.write(f'{len(line):x}\r\n'.encode('ascii') + line + b'\r\n')
+                self.wfile.flush()
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+# Named like google.api_core.exceptions.ResourceExhausted, which Gemini raises on a 429
+class ResourceExhausted(Exception):
+    code = 429
+
+
+# Stand-in for vertexai.preview.generative_models whose GenerativeModel sends prompts to a
+# StubModelServer, for model.PROVIDERS.register('google', stub_gemini_sdk(server.url)).
+# A 429 from the server raises ResourceExhausted, as the real SDK does.
+def stub_gemini_sdk(url):
+    def post(model_name, prompt):
+        body = json.dumps({'model': model_name, 'prompt': prompt, 'stream': False}).encode('utf-8')
+        request = urllib.request.Request(f'{url}/api/generate', data=body, headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(request) as response:
+                return SimpleNamespace(text=json.loads(response.read())['response'])
+        except urllib.error.HTTPError as e:
+            if e.code == 429:
+                raise ResourceExhausted('429 Quota exceeded') from None
+            raise
+
+    class GenerativeModel:
+        def __init__(self, model_name):
+            self.model_name = model_name
+
+        def generate_content(self, prompt, generation_config=None, safety_settings=None, stream=False):
+            response = post(self.model_name, prompt)
+            return iter([response]) if stream else response
+
+        async def generate_content_async(self, prompt, generation_config=None, safety_settings=None):
+            return await asyncio.to_thread(post, self.model_name, prompt)
+
+    categories = ('HARM_CATEGORY_HATE_SPEECH', 'HARM_CATEGORY_DANGEROUS_CONTENT',
+                  'HARM_CATEGORY_HARASSMENT', 'HARM_CATEGORY_SEXUALLY_EXPLICIT')
+    return SimpleNamespace(
+        GenerativeModel=GenerativeModel,
+        GenerationConfig=lambda **kwargs: kwargs,
+        HarmCategory=SimpleNamespace(**{name: name for name in categories}),
+        HarmBlockThreshold=SimpleNamespace(BLOCK_NONE='BLOCK_NONE'),
+        init=lambda **kwargs: None,
+    )
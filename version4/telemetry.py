@@ -0,0 +1,224 @@
+import contextvars
+import json
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Upper bounds (seconds) of the stage latency histogram buckets
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Rough characters-per-token ratio for English prompts, used when no tokenizer is at hand
+CHARS_PER_TOKEN = 4
+
+logger = logging.getLogger('tfm.telemetry')
+_trace_id = contextvars.ContextVar('trace_id', default=None)
+
+
+class Counter:
+    def __init__(self):
+        self.values = {}
+
+    def inc(self, labels, value=1):
+        self.values[labels] = self.values.get(labels, 0) + value
+
+
+class Gauge(Counter):
+    def set(self, labels, value):
+        self.values[labels] = value
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.values = {}  # labels -> [bucket counts..., count, sum]
+
+    def observe(self, labels, value):
+        row = self.values.get(labels)
+        if row is None:
+            row = self.values[labels] = [0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                row[i] += 1
+                break
+        row[-2] += 1
+        row[-1] += value
+
+
+def _label_text(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + '}'
+
+
+# In-process metric store. Labels are kept as sorted tuples of (name, value) pairs so an
+# update is one dict lookup under one lock; rendering to the Prometheus text format only
+# happens when /metrics is scraped.
+class Registry:
+    def __init__(self, prefix='tfm_'):
+        self.prefix = prefix
+        self.enabled = True
+        self._metrics = {}
+        self._help = {}
+        self._lock = threading.Lock()
+
+    def _metric(self, name, kind, help_text):
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = {'counter': Counter, 'gauge': Gauge}.get(kind, Histogram)()
+            self._help[name] = help_text
+        return metric
+
+    def inc(self, name, value=1, help_text='', **labels):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._metric(name, 'counter', help_text).inc(tuple(sorted(labels.items())), value)
+
+    def set(self, name, value, help_text='', **labels):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._metric(name, 'gauge', help_text).set(tuple(sorted(labels.items())), value)
+
+    def observe(self, name, value, help_text='', **labels):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._metric(name, 'histogram', help_text).observe(tuple(sorted(labels.items())), value)
+
+    def value(self, name, **labels):
+        # Counter or gauge value, or observation count of a histogram; 0 when never recorded
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                return 0
+            row = metric.values.get(tuple(sorted(labels.items())), 0)
+        return row[-2] if isinstance(metric, Histogram) and row else row
+
+    def snapshot(self):
+        with self._lock:
+            snapshot = {}
+            for name, metric in self._metrics.items():
+                if isinstance(metric, Counter):
+                    snapshot[name] = {_label_text(labels): value for labels, value in metric.values.items()}
+                else:
+                    snapshot[name] = {_label_text(labels): {'count': row[-2], 'sum': row[-1]} for labels, row in metric.values.items()}
+            return snapshot
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for name, metric in sorted(self._metrics.items()):
+                full_name = self.prefix + name
+                if self._help[name]:
+                    lines.append(f'# HELP {full_name} {self._help[name]}')
+                if isinstance(metric, Counter):
+                    lines.append(f'# TYPE {full_name} {"gauge" if isinstance(metric, Gauge) else "counter"}')
+                    for labels, value in metric.values.items():
+                        lines.append(f'{full_name}{_label_text(labels)} {value}')
+                    continue
+                lines.append(f'# TYPE {full_name} histogram')
+                for labels, row in metric.values.items():
+                    cumulative = 0
+                    for bound, count in zip(metric.buckets, row):
+                        cumulative += count
+                        lines.append(f'{full_name}_bucket{_label_text(labels, [("le", bound)])} {cumulative}')
+                    lines.append(f'{full_name}_bucket{_label_text(labels, [("le", "+Inf")])} {row[-2]}')
+                    lines.append(f'{full_name}_count{_label_text(labels)} {row[-2]}')
+                    lines.append(f'{full_name}_sum{_label_text(labels)} {row[-1]:.6f}')
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self._lock:
+            self._metrics.clear()
+            self._help.clear()
+
+
+REGISTRY = Registry()
+
+
+def log_event(event, **fields):
+    # One JSON object per line on the 'tfm.telemetry' logger, tagged with the current trace.
+    # Skipped entirely unless that logger is enabled for INFO.
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(json.dumps({'event': event, 'trace_id': _trace_id.get(), 'ts': time.time(), **fields}, default=str))
+
+
+@contextmanager
+def trace(name, **fields):
+    # Root span of one question: everything recorded inside shares its trace_id,
+    # including awaits and asyncio.to_thread calls made from it.
+    token = _trace_id.set(_trace_id.get() or uuid.uuid4().hex[:16])
+    try:
+        with span(name, **fields) as attributes:
+            yield attributes
+    finally:
+        _trace_id.reset(token)
+
+
+@contextmanager
+def span(stage, **fields):
+    # Times the block into stage_seconds{stage=...}. The yielded dict collects extra
+    # attributes for the log line; an exception is counted and logged, then re-raised.
+    # A streaming generator closed by its consumer ends with status 'cancelled', not an error.
+    attributes = dict(fields)
+    start = time.perf_counter()
+    status = 'ok'
+    try:
+        yield attributes
+    except GeneratorExit:
+        status = 'cancelled'
+        raise
+    except BaseException as e:
+        status = type(e).__name__
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        REGISTRY.observe('stage_seconds', seconds, 'Wall time per pipeline stage', stage=stage)
+        if status not in ('ok', 'cancelled'):
+            REGISTRY.inc('stage_errors_total', 1, 'Stages that raised, by exception type', stage=stage, error=status)
+        log_event('span', stage=stage, seconds=round(seconds, 6), status=status, **attributes)
+
+
+def record_text(stage, direction, text):
+    # Prompt/response size in characters and estimated tokens
+    size = len(text) if text else 0
+    REGISTRY.inc('text_chars_total', size, 'Characters sent to or received from a stage', stage=stage, direction=direction)
+    REGISTRY.inc('text_tokens_total', -(-size // CHARS_PER_TOKEN), 'Estimated tokens sent to or received from a stage', stage=stage, direction=direction)
+    return size
+
+
+def record_cache(cache, hit):
+    REGISTRY.inc('cache_events_total', 1, 'Cache lookups by cache and outcome', cache=cache, result='hit' if hit else 'miss')
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port=9464, host='127.0.0.1', registry=REGISTRY):
+    # Serves registry.render() on /metrics from a daemon thread; returns the server. Only
+    # local by default: pass host='0.0.0.0' to let a Prometheus on another machine scrape it.
+    handler = type('MetricsHandler', (_MetricsHandler,), {'registry': registry})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server